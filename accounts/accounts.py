@@ -1,6 +1,10 @@
+import asyncio
+import hashlib
 import json
 import logging
 import configparser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from logging.handlers import RotatingFileHandler
 from order.order import Order
 import sys
@@ -20,6 +24,8 @@ handler.setFormatter(fmt)
 logger.addHandler(handler)
 
 INSTITUTION_TYPE = 'BROKERAGE'
+MAX_FETCH_WORKERS = 8 # upper bound on concurrent per-account requests
+TRANSACTION_PAGE_SIZE = 50 # max transactions the API returns per page
 
 
 ###################### Created Classes #######################
@@ -27,12 +33,18 @@ script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/positions')
 from positions.positions import Position
 sys.path.insert(0, script_path + '/transactions')
-from transactions.transactions import Transaction, BANNED_TRANSACTION_TYPE
+from transactions.transactions import Transaction, BANNED_TRANSACTION_TYPE, parse_transaction
 sys.path.insert(0, script_path + '/holdings')
-from holdings.holdings import SecurityHolding, SecurityHoldings
+from holdings.holdings import SecurityHolding, SecurityHoldings, HoldingsIndex
 #################### End Created Classes #####################
 
 from helper import format_currency
+from events.events import (EventBus, BalanceMoved, LotSellable, PositionClosed, PositionOpened,
+                           QuantityChanged, BALANCE_MOVE_PCT)
+from decoder.decoder import decode_response, log_response
+
+class AccountFetchError(Exception):
+    """A per-account request failed, as opposed to returning an empty result"""
 
 class Account:
     def __init__(self, accountId, accountIdKey, accountDescription, accountName):
@@ -54,29 +66,109 @@ class Account:
     def __repr__(self):
         return f"AccountName: {self.accountName}; Account Value: {format_currency(self.account_value)}"
 
+def content_hash(payload):
+    """Stable digest of a JSON-serializable payload, independent of key order"""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class ChangeSet:
+    def __init__(self):
+        """
+        Delta produced by Accounts.refresh
+        """
+        self.changed_accounts = [] # accountIds whose balance, positions or transactions changed
+        self.failed_accounts = [] # accountIds whose fetch failed; previous payloads and snapshots were kept
+        self.opened_accounts = [] # accountIds new in the account list
+        self.closed_accounts = [] # accountIds no longer in the account list
+        self.rebuilt_accounts = [] # accountIds whose holdings were rebuilt
+        self.added = [] # (accountId, Position)
+        self.removed = [] # (accountId, Position)
+        self.modified = [] # (accountId, previous Position, Position)
+
+    def diff_positions(self, account_id, previous, current):
+        previous = {pos.sym: pos for pos in previous}
+        current = {pos.sym: pos for pos in current}
+        for sym, pos in current.items():
+            if sym not in previous:
+                self.added.append((account_id, pos))
+            elif previous[sym].fields() != pos.fields():
+                self.modified.append((account_id, previous[sym], pos))
+        for sym, pos in previous.items():
+            if sym not in current:
+                self.removed.append((account_id, pos))
+
+    def __bool__(self):
+        return bool(self.changed_accounts or self.opened_accounts or self.closed_accounts)
+
+    def __repr__(self):
+        return f"ChangeSet(accounts={self.changed_accounts}, failed={self.failed_accounts}, " \
+               f"opened={self.opened_accounts}, closed={self.closed_accounts}, added={len(self.added)}, removed={len(self.removed)}, modified={len(self.modified)})"
+
 class Accounts:
-    def __init__(self, session, base_url):
+    def __init__(self, session, base_url, max_workers=MAX_FETCH_WORKERS, ledger=None, snapshot_store=None,
+                 balance_move_pct=BALANCE_MOVE_PCT):
         """
         Initialize Accounts object with session and account information
 
         :param session: authenticated session
+        :param max_workers: maximum number of concurrent requests used by fetch_accounts_concurrently
+        :param ledger: optional TransactionLedger; when set only transactions newer than the ledger are fetched
+        :param snapshot_store: optional SnapshotStore every load and refresh is appended to
+        :param balance_move_pct: account value change in % that emits a BalanceMoved event
         """
         self.session = session
+        self.max_workers = max_workers
+        self.ledger = ledger
+        self.snapshot_store = snapshot_store
         self.account = {}
         self.base_url = base_url
         self.accounts = [] # list of accounts
         self.accounts_transactions = {} # dictionary of transactions - key accountID, value: list of Associated Transactions
+                                        # (after a concurrent fetch only those attached to a held position)
         self.accounts_positions = {} # dictionary of positions - key accountId, value: list of associated positions
         self.accounts_holdings = {}
+        self.holdings_index = HoldingsIndex() # symbol lookups across accounts_holdings
+        self.snapshots = {} # accountId -> content hashes of the last balance, portfolio and transactions
+        self.failed_accounts = set() # accountIds whose last fetch failed and kept their previous payloads
+        self.changes = None # ChangeSet of the last refresh
+        self.events = EventBus() # position, lot and balance events published by refresh
+        self.balance_move_pct = balance_move_pct
+        self._events_at = None # evaluation time of the last published lot events
+        self._event_balances = {} # accountId -> account value at the last BalanceMoved event
+        self._built_holdings = {} # accountId -> SecurityHoldings streamed by the last fetch, consumed by update_holdings
+        self._executor = None # per-account fan-out pool, created on the first threaded fetch and shut down by close
+
+    def close(self):
+        """
+        Shut down the fan-out pool; the session, ledger and snapshot store belong to the caller
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
-    def update_holdings(self):
+    def update_holdings(self, account_ids=None):
+        """
+        :param account_ids: only rebuild these accounts, None rebuilds all
+        """
+        built, self._built_holdings = self._built_holdings, {}
         for acc in self.accounts:
-            holdings = SecurityHoldings()
-            for pos in self.accounts_positions[acc.accountId]:
-                holdings.add_position(pos)
-            for tx in self.accounts_transactions[acc.accountId]:
-                holdings.add_transaction(tx)
+            if account_ids is not None and acc.accountId not in account_ids:
+                continue
+            holdings = built.get(acc.accountId)
+            if holdings is None:
+                holdings = SecurityHoldings()
+                for pos in self.accounts_positions[acc.accountId]:
+                    holdings.add_position(pos)
+                for tx in self.accounts_transactions[acc.accountId]:
+                    holdings.add_transaction(tx)
             self.accounts_holdings[acc.accountId] = holdings
+            self.holdings_index.update(acc.accountId, holdings)
         return True
 
 
@@ -84,14 +176,15 @@ class Accounts:
         self.update_account_balances()
         return sum([acc.account_value for acc in self.accounts]) # sum all of the account values
 
-    def AccountParser(self, AccountListResponse):
+    def AccountParser(self, AccountListResponse, update_balances=True):
         if AccountListResponse is not None and "AccountListResponse" in AccountListResponse and "Accounts" in AccountListResponse["AccountListResponse"] \
                 and "Account" in AccountListResponse["AccountListResponse"]["Accounts"]:
             accounts = AccountListResponse['AccountListResponse']["Accounts"]["Account"]
             for acc in accounts:
                 self.accounts.append(Account(acc['accountId'], acc['accountIdKey'], acc['accountDesc'], acc['accountName']))
             'accountId', 'accountIdKey', 'accountDesc', 'accountName'
-            self.update_account_balances()
+            if update_balances:
+                self.update_account_balances()
             return True
         return False
 
@@ -101,107 +194,405 @@ class Accounts:
 
         :param self: Pass in parameters authenticated session and information on selected account
         """
-
-        # URL for the API endpoint
         for acc in self.accounts:
             try:
-                url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/balance.json"
-
-                # Add parameters and header information
-                params = {"instType": INSTITUTION_TYPE, "realTimeNAV": "true"}
-                headers = {"consumerkey": etrade_config.CONSUMER_KEY}
-
-                # Make API call for GET request
-                response = self.session.get(url, header_auth=True, params=params, headers=headers)
-                logger.debug("Request url: %s", url)
-                logger.debug("Request Header: %s", response.request.headers)
-
-                # Handle and parse response
-                if response is not None and response.status_code == 200:
-                    parsed = json.loads(response.text)
-                    logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                    data = response.json()
-                    if data is not None and "BalanceResponse" in data:
-                        balance_data = data["BalanceResponse"]
-                        if balance_data is not None and "Computed" in balance_data \
-                                and "RealTimeValues" in balance_data["Computed"] \
-                                and "totalAccountValue" in balance_data["Computed"]["RealTimeValues"]:
-                            total_account_value = balance_data["Computed"]["RealTimeValues"]["totalAccountValue"]
-                            if balance_data["Computed"]["RealTimeValues"]["totalAccountValue"] != 0: acc.set_account_value(balance_data["Computed"]["RealTimeValues"]["totalAccountValue"])
-                        if balance_data is not None and "Computed" in balance_data \
-                                and "cashBuyingPower" in balance_data["Computed"]:
-                            buying_power = balance_data["Computed"]["cashBuyingPower"]
-                            if buying_power != 0: acc.set_buying_power(buying_power)
-                    else:
-                        # Handle errors
-                        logger.debug("Response Body: %s", response.text)
-                        if response is not None and response.headers['Content-Type'] == 'application/json' \
-                                and "Error" in response.json() and "message" in response.json()["Error"] \
-                                and response.json()["Error"]["message"] is not None:
-                            print("Error: " + response.json()["Error"]["message"])
-                        else:
-                            print("Error: Balance API service error")
-                else:
-                    # Handle errors
-                    logger.debug("Response Body: %s", response.text)
-                    if response is not None and response.headers['Content-Type'] == 'application/json' \
-                            and "Error" in response.json() and "message" in response.json()["Error"] \
-                            and response.json()["Error"]["message"] is not None:
-                        print("Error: " + response.json()["Error"]["message"])
-                    else:
-                        print("Error: Balance API service error")
+                self._update_account_balance(acc)
             except Exception as e:
                 print(e)
 
-    def load_accounts(self):
+    def _update_account_balance(self, acc):
         """
-        Calls account list API to retrieve a list of the user's E*TRADE accounts
+        Calls account balance API for a single account and sets its account value and buying power
 
-        :param self:Passes in parameter authenticated session
+        :param acc: Account to update
         """
-
         # URL for the API endpoint
-        url = self.base_url + "/v1/accounts/list.json"
+        url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/balance.json"
+
+        # Add parameters and header information
+        params = {"instType": INSTITUTION_TYPE, "realTimeNAV": "true"}
+        headers = {"consumerkey": etrade_config.CONSUMER_KEY}
 
         # Make API call for GET request
-        response = self.session.get(url, header_auth=True)
+        response = self.session.get(url, header_auth=True, params=params, headers=headers)
+        logger.debug("Request url: %s", url)
         logger.debug("Request Header: %s", response.request.headers)
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
+            log_response(logger, response)
+            data = decode_response(response)
+            if data is not None and "BalanceResponse" in data:
+                return self._parse_balance(acc, data["BalanceResponse"])
+            else:
+                # Handle errors
+                logger.debug("Response Body: %s", response.text)
+                if response is not None and response.headers['Content-Type'] == 'application/json' \
+                        and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                        and decode_response(response)["Error"]["message"] is not None:
+                    print("Error: " + decode_response(response)["Error"]["message"])
+                else:
+                    print("Error: Balance API service error")
+        else:
+            # Handle errors
+            logger.debug("Response Body: %s", response.text)
+            if response is not None and response.headers['Content-Type'] == 'application/json' \
+                    and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                    and decode_response(response)["Error"]["message"] is not None:
+                print("Error: " + decode_response(response)["Error"]["message"])
+            else:
+                print("Error: Balance API service error")
+        return False
+
+    def _parse_balance(self, acc, balance_data):
+        """
+        Set account value and buying power from a BalanceResponse
+        """
+        if balance_data is not None and "Computed" in balance_data \
+                and "RealTimeValues" in balance_data["Computed"] \
+                and "totalAccountValue" in balance_data["Computed"]["RealTimeValues"]:
+            total_account_value = balance_data["Computed"]["RealTimeValues"]["totalAccountValue"]
+            if balance_data["Computed"]["RealTimeValues"]["totalAccountValue"] != 0: acc.set_account_value(balance_data["Computed"]["RealTimeValues"]["totalAccountValue"])
+        if balance_data is not None and "Computed" in balance_data \
+                and "cashBuyingPower" in balance_data["Computed"]:
+            buying_power = balance_data["Computed"]["cashBuyingPower"]
+            if buying_power != 0: acc.set_buying_power(buying_power)
+        return True
+
+    def fetch_accounts_concurrently(self):
+        """
+        Loads the balance, positions and transactions of every account at once, then merges the results
+        into accounts_transactions and accounts_positions. With an async client session (see
+        AsyncETradeClient.sync_session) the requests are fanned out on its event loop, otherwise on a
+        bounded thread pool. Accounts with a failed request keep their previous payloads and are listed
+        in failed_accounts.
+
+        :param self: Passes in parameter authenticated session
+        """
+        self.failed_accounts = set()
+        self._built_holdings = {}
+        if not self.accounts:
+            return True
+        client = getattr(self.session, "client", None)
+        if client is not None and hasattr(self.session, "run"):
+            loaded = self.session.run(self._fetch_accounts_async(client))
+        else:
+            loaded = self._fetch_accounts_threaded()
+        for acc in self.accounts:
+            if acc.accountId not in loaded:
+                # a failed fetch is not an emptied account: keep both payloads so they stay consistent
+                self.failed_accounts.add(acc.accountId)
+                self.accounts_transactions.setdefault(acc.accountId, [])
+                self.accounts_positions.setdefault(acc.accountId, [])
+                continue
+            positions, holdings, transactions = loaded[acc.accountId]
+            self.accounts_positions[acc.accountId] = positions
+            self.accounts_transactions[acc.accountId] = transactions
+            self._built_holdings[acc.accountId] = holdings
+        return True
+
+    def _fetch_accounts_threaded(self):
+        """
+        Sends the balance requests and account loads (see _load_account) on the bounded fan-out pool.
+        Each task runs its requests inline, so no task waits on another one in the pool.
 
-            data = response.json()
+        :return: {accountId: (positions, holdings, attached transactions)} of the accounts that loaded
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers), thread_name_prefix="accounts")
+        failed, loaded = set(), {}
+        balances = {self._executor.submit(self._update_account_balance, acc): acc for acc in self.accounts}
+        loads = {self._executor.submit(self._load_account, acc): acc for acc in self.accounts}
 
+        for future, acc in balances.items():
+            try:
+                if not future.result():
+                    failed.add(acc.accountId)
+            except Exception as e:
+                logger.info("Error updating Balance for %s: %s", acc.accountId, e)
+                failed.add(acc.accountId)
+        for future, acc in loads.items():
+            try:
+                loaded[acc.accountId] = future.result()
+            except Exception as e:
+                logger.info("Error adding Positions and Transactions for %s: %s", acc.accountId, e)
+        return {account_id: result for account_id, result in loaded.items() if account_id not in failed}
+
+    async def _fetch_accounts_async(self, client):
+        """
+        Loads every account concurrently on the AsyncETradeClient's event loop, see _load_account_async
+
+        :return: {accountId: (positions, holdings, attached transactions)} of the accounts that loaded
+        """
+        results = await asyncio.gather(*(self._load_account_async(client, acc) for acc in self.accounts),
+                                       return_exceptions=True)
+        loaded = {}
+        for acc, result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                logger.info("Error loading %s: %s", acc.accountId, result)
+            else:
+                loaded[acc.accountId] = result
+        return loaded
+
+    async def _load_account_async(self, client, acc):
+        """
+        Async counterpart of _load_account that also sets the balance: the balance, portfolio and first
+        transactions page are requested at once and each following page is attached as it arrives
+
+        :param client: AsyncETradeClient
+        :return: (positions, holdings, attached transactions)
+        :raises AccountFetchError: when a request failed
+        """
+        loop = asyncio.get_running_loop()
+        # ledger sqlite I/O blocks, so it runs on the loop's executor rather than on the loop itself
+        params = self._transactions_params(*await loop.run_in_executor(None, self._transactions_window, acc))
+        balance, portfolio, page = await asyncio.gather(client.balance(acc.accountIdKey),
+                                                        client.portfolio(acc.accountIdKey),
+                                                        client.transactions(acc.accountIdKey, **params))
+        if balance is None or "BalanceResponse" not in balance:
+            raise AccountFetchError(f"balance failed: {acc.accountId}")
+        self._parse_balance(acc, balance["BalanceResponse"])
+        positions = self._parse_positions(portfolio)
+        if positions is None:
+            raise AccountFetchError(f"portfolio failed: {acc.accountId}")
+        holdings = SecurityHoldings()
+        for pos in positions:
+            holdings.add_position(pos)
+
+        transactions = []
+        while True:
+            # the client returns {} for 204 (no transactions) and None for a failed request
+            if page is None or (page and "TransactionListResponse" not in page):
+                raise AccountFetchError(f"transactions page failed: {acc.accountId}")
+            data = page.get("TransactionListResponse", {})
+            if self.ledger is None:
+                transactions += [tx for tx in self._page_transactions(data) if holdings.add_transaction(tx)]
+            else:
+                transactions += list(self._page_transactions(data, retain=True))
+            if not (data.get("moreTransactions") and data.get("marker")):
+                break
+            params["marker"] = data["marker"]
+            page = await client.transactions(acc.accountIdKey, **params)
+        if self.ledger is not None:
+            transactions = await loop.run_in_executor(None, self._merge_into_ledger, acc, transactions, holdings)
+        return positions, holdings, transactions
+
+    def _merge_into_ledger(self, acc, transactions, holdings):
+        """
+        Merge fetched transactions into the ledger and stream the stored history into holdings
+
+        :return: the stored transactions attached to a held position
+        """
+        self.ledger.merge(acc.accountId, [tx.json for tx in transactions])
+        return [tx for tx in self.ledger.iter_transactions(acc.accountId) if holdings.add_transaction(tx)]
+
+    def _load_account(self, acc):
+        """
+        Fetch an account's positions and stream its transactions straight into a new SecurityHoldings,
+        so only the transactions attached to a held position stay in memory
+
+        :param acc: Account to load
+        :return: (positions, holdings, attached transactions)
+        :raises AccountFetchError: when the portfolio or a transactions page could not be loaded
+        """
+        positions = self._account_positions(acc)
+        if positions is None:
+            raise AccountFetchError(f"portfolio failed: {acc.accountId}")
+        holdings = SecurityHoldings()
+        for pos in positions:
+            holdings.add_position(pos)
+        return positions, holdings, [tx for tx in self._account_transactions(acc) if holdings.add_transaction(tx)]
+
+    def load_accounts(self, concurrent=True):
+        """
+        Calls account list API to retrieve a list of the user's E*TRADE accounts
+
+        :param self:Passes in parameter authenticated session
+        :param concurrent: fetch balances, transactions and positions for all accounts at once
+        """
+        self.failed_accounts = set()
+        data = self._account_list_response()
+        if data is not None:
             # parse account list data using parser
             try:
                 # Add Accounts
-                self.AccountParser(data)
+                self.AccountParser(data, update_balances=not concurrent)
             except Exception as e:
-                logger.info("Error adding Accounts",e)
+                logger.info("Error adding Accounts: %s", e)
                 print("Error adding Accounts",e)
             else:
-                # Add Transactions
-                try:
-                    self.TransactionParser()
-                except Exception as e:
-                    logger.info("Error adding Transactions",e)
-                # Add Positions
-                try:
-                    self.PositionsParser()
-                except Exception as e:
-                    logger.info("Error adding Postions", e)
+                if concurrent:
+                    # Add Balances, Transactions and Positions in one round-trip
+                    self.fetch_accounts_concurrently()
+                else:
+                    # Add Transactions
+                    try:
+                        self.TransactionParser()
+                    except Exception as e:
+                        logger.info("Error adding Transactions: %s", e)
+                    # Add Positions
+                    try:
+                        self.PositionsParser()
+                    except Exception as e:
+                        logger.info("Error adding Postions: %s", e)
                 # Create Holdings
                 try:
                     self.update_holdings()
                 except Exception as e:
-                    logger.info("Error updating Holdings", e)
+                    logger.info("Error updating Holdings: %s", e)
                     return False
+                self.snapshots = {acc.accountId: self._snapshot(acc) for acc in self.accounts
+                                  if acc.accountId not in self.failed_accounts}
+                self._events_at = datetime.today()
+                self._event_balances = {acc.accountId: acc.account_value for acc in self.accounts
+                                        if acc.accountId not in self.failed_accounts}
+                self.store_snapshot()
             return True
 
         return False
 
+    def _snapshot(self, acc):
+        return {"balance": content_hash([acc.account_value, acc.buying_power]),
+                "positions": content_hash([pos.fields() for pos in self.accounts_positions.get(acc.accountId, [])]),
+                "transactions": content_hash([tx.fields() for tx in self.accounts_transactions.get(acc.accountId, [])])}
+
+    def _account_list_response(self):
+        """
+        Calls account list API
+
+        :return: the decoded AccountListResponse, or None when the list could not be loaded
+        """
+        # URL for the API endpoint
+        url = self.base_url + "/v1/accounts/list.json"
+
+        # Make API call for GET request
+        response = self.session.get(url, header_auth=True)
+        logger.debug("Request Header: %s", response.request.headers)
+
+        # Handle and parse response
+        if response is not None and response.status_code == 200:
+            log_response(logger, response)
+            return decode_response(response)
+        logger.debug("Response Body: %s", response.text if response is not None else None)
+        return None
+
+    def sync_account_list(self, changes=None):
+        """
+        Refetch the account list, add accounts opened since the last load and drop closed ones
+
+        :param changes: optional ChangeSet the opened and closed accountIds are recorded in
+        :return: False when the list could not be loaded and the current accounts were kept
+        """
+        data = self._account_list_response()
+        try:
+            listed = {acc['accountId']: acc for acc in data["AccountListResponse"]["Accounts"]["Account"]}
+        except (KeyError, TypeError) as e:
+            logger.info("Error refreshing Account list: %s", e)
+            return False
+        known = {acc.accountId for acc in self.accounts}
+        for account_id, acc in listed.items():
+            if account_id not in known:
+                self.accounts.append(Account(acc['accountId'], acc['accountIdKey'], acc['accountDesc'], acc['accountName']))
+                if changes is not None:
+                    changes.opened_accounts.append(account_id)
+        for acc in [acc for acc in self.accounts if acc.accountId not in listed]:
+            self.accounts.remove(acc)
+            for state in (self.accounts_transactions, self.accounts_positions, self.accounts_holdings,
+                          self.snapshots, self._event_balances):
+                state.pop(acc.accountId, None)
+            self.holdings_index.remove(acc.accountId)
+            if changes is not None:
+                changes.closed_accounts.append(acc.accountId)
+        return True
+
+    def refresh(self):
+        """
+        Refetch the account list and the balances, positions and transactions of every account and
+        rebuild holdings only for accounts whose portfolio or transactions hashed differently from
+        the previous snapshot. Accounts whose fetch failed keep their previous payload and snapshot
+        and are left out of the change set.
+
+        :return: ChangeSet of changed accounts and added, removed and modified positions
+        """
+        changes = ChangeSet()
+        self.sync_account_list(changes)
+        previous_positions = dict(self.accounts_positions)
+        self.fetch_accounts_concurrently()
+        for acc in self.accounts:
+            if acc.accountId in self.failed_accounts:
+                changes.failed_accounts.append(acc.accountId)
+                continue
+            snapshot = self._snapshot(acc)
+            previous = self.snapshots.get(acc.accountId, {})
+            self.snapshots[acc.accountId] = snapshot
+            if snapshot == previous:
+                continue
+            changes.changed_accounts.append(acc.accountId)
+            if snapshot["positions"] != previous.get("positions") \
+                    or snapshot["transactions"] != previous.get("transactions"):
+                changes.rebuilt_accounts.append(acc.accountId)
+            if snapshot["positions"] != previous.get("positions"):
+                changes.diff_positions(acc.accountId, previous_positions.get(acc.accountId, []),
+                                       self.accounts_positions.get(acc.accountId, []))
+        try:
+            self.update_holdings(changes.rebuilt_accounts)
+        except Exception as e:
+            logger.info("Error updating Holdings: %s", e)
+        self.changes = changes
+        logger.debug("Refresh: %s", changes)
+        self.store_snapshot()
+        self.events.publish_all(self.change_events(changes))
+        return changes
+
+    def change_events(self, changes, now=None):
+        """
+        Typed events for a refresh: positions opened, closed or resized, lots whose holding period
+        ended since the previous refresh and account values that moved more than balance_move_pct
+
+        Advances the lot and balance baselines, so each event is produced once.
+
+        :param changes: ChangeSet returned by refresh
+        :param now: evaluation time, defaults to the current time
+        """
+        now = now if now else datetime.today()
+        events = []
+        for account_id, pos in changes.removed:
+            events.append(PositionClosed(account_id, pos.sym, pos))
+        for account_id, pos in changes.added:
+            events.append(PositionOpened(account_id, pos.sym, pos))
+        for account_id, previous, pos in changes.modified:
+            if previous.qty != pos.qty:
+                events.append(QuantityChanged(account_id, pos.sym, previous.qty, pos.qty, pos))
+        if self._events_at is not None:
+            for acc in self.accounts:
+                holdings = self.accounts_holdings.get(acc.accountId)
+                if holdings is None:
+                    continue
+                for sym, tx in holdings.released_lots(self._events_at, now):
+                    events.append(LotSellable(acc.accountId, sym, tx.qty, tx.timestamp, tx.release_date))
+        self._events_at = now
+        for acc in self.accounts:
+            if acc.accountId in changes.failed_accounts:
+                continue
+            previous = self._event_balances.get(acc.accountId)
+            if previous is None or acc.account_value is None:
+                self._event_balances[acc.accountId] = acc.account_value
+                continue
+            pct = (acc.account_value - previous) / abs(previous) * 100 if previous else 0
+            if abs(pct) >= self.balance_move_pct:
+                events.append(BalanceMoved(acc.accountId, previous, acc.account_value, pct))
+                self._event_balances[acc.accountId] = acc.account_value
+        return events
+
+    def store_snapshot(self):
+        if self.snapshot_store is None:
+            return None
+        try:
+            return self.snapshot_store.append(self, skip=self.failed_accounts)
+        except Exception as e:
+            logger.info("Error storing snapshot: %s", e)
+            return None
+
     def account_list(self):
         """
         Calls account list API to retrieve a list of the user's E*TRADE accounts
@@ -218,10 +609,9 @@ class Accounts:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
+            log_response(logger, response)
 
-            data = response.json()
+            data = decode_response(response)
 
             if data is not None and "AccountListResponse" in data and "Accounts" in data["AccountListResponse"] \
                     and "Account" in data["AccountListResponse"]["Accounts"]:
@@ -260,8 +650,8 @@ class Accounts:
                 # Handle errors
                 logger.debug("Response Body: %s", response.text)
                 if response is not None and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
+                        and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                        and decode_response(response)["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
                     print("Error: AccountList API service error")
@@ -270,88 +660,186 @@ class Accounts:
             logger.debug("Response Body: %s", response.text)
             print(response.headers)
             if response is not None and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
+                    and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                    and decode_response(response)["Error"]["message"] is not None:
+                print("Error: " + decode_response(response)["Error"]["message"])
             else:
                 print("Please select an option:")
                 print("Error: AccountList API service error")
 
     def TransactionParser(self):
         for acc in self.accounts:
-            url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/transactions.json"
-            response = self.session.get(url, header_auth=True)
-            logger.debug("Request Header: %s", response.request.headers)
-            transactionList = []
-            if response is not None and response.status_code == 200:
-                parsed = json.loads(response.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                try:
-                    transactionDict = response.json()['TransactionListResponse']['Transaction']
-                except Exception as e:
-                    print(e, "\nTransactionParser No Transactions Error")
-                    self.accounts_transactions[acc.accountId] = []
-                    continue
-
-                # print(response.json())
-
-                for tx in transactionDict:
-                    if tx['transactionType'] not in BANNED_TRANSACTION_TYPE:
-                        try:
-                            transactionList.append(
-                                Transaction(
-                                    displaySymbol = tx['brokerage']['displaySymbol'],
-                                    symbol = tx['brokerage']['product']['symbol'],
-                                    timestamp = tx['transactionDate'],
-                                    amount = tx['amount'],
-                                    desc = tx['description'],
-                                    qty = tx['brokerage']['quantity'],
-                                    price = tx['brokerage']['price'],
-                                    securityType = tx['brokerage']['product']['securityType'],
-                                    txType = tx['transactionType'],
-                                    json = tx)
-                            )
-                        except Exception as e:
-                            pass
-                            # logger.info("\nTransactionParser: Error Adding Transaction", tx['description'])
-            self.accounts_transactions[acc.accountId] = transactionList
+            try:
+                self.accounts_transactions[acc.accountId] = list(self._account_transactions(acc))
+            except Exception as e:
+                logger.info("Error adding Transactions for %s: %s", acc.accountId, e)
+                self.accounts_transactions.setdefault(acc.accountId, [])
+                self.failed_accounts.add(acc.accountId)
         return True
 
+    def _account_transactions(self, acc):
+        """
+        Calls transactions API for a single account, following every page
+
+        :param acc: Account to fetch transactions for
+        :return: iterator over the account's Transactions, newest first
+        """
+        if self.ledger is None:
+            return self.iter_transactions(acc)
+        return self.sync_transactions(acc)
+
+    def sync_transactions(self, acc):
+        """
+        Fetch only the transactions newer than the last stored transactionDate, merge them into the
+        ledger and stream the account's full transaction history back from the ledger
+
+        :param acc: Account to sync
+        :return: iterator over the stored Transactions, newest first
+        """
+        start_date, end_date = self._transactions_window(acc)
+        new_transactions = self.iter_transactions(acc, start_date=start_date, end_date=end_date, retain=True)
+        # merged in one go: pages arrive newest first, so a partial merge would hide the missing older pages
+        self.ledger.merge(acc.accountId, [tx.json for tx in new_transactions])
+        return self.ledger.iter_transactions(acc.accountId)
+
+    def _transactions_window(self, acc):
+        """
+        :return: (start_date, end_date) of the transactions still missing from the ledger,
+                 (None, None) for the full history
+        """
+        last = self.ledger.last_transaction_date(acc.accountId) if self.ledger is not None else None
+        if last is None:
+            return None, None
+        # the API filters by day, so the last stored day is fetched again and de-duplicated by transactionId
+        return datetime.utcfromtimestamp(last / 1000), datetime.utcnow()
+
+    @staticmethod
+    def _transactions_params(start_date=None, end_date=None, count=TRANSACTION_PAGE_SIZE):
+        params = {"count": count}
+        if start_date:
+            params["startDate"] = start_date if isinstance(start_date, str) else start_date.strftime("%m%d%Y")
+        if end_date:
+            params["endDate"] = end_date if isinstance(end_date, str) else end_date.strftime("%m%d%Y")
+        return params
+
+    def transactions_from_ledger(self):
+        """
+        Fill accounts_transactions from the ledger without calling the API and rebuild holdings
+        """
+        for acc in self.accounts:
+            self.accounts_transactions[acc.accountId] = self.ledger.transactions(acc.accountId)
+        return self.update_holdings()
+
+    def _transactions_page(self, url, params):
+        """
+        Fetch one page of the transactions API
+
+        :return: the TransactionListResponse dict, empty when the account has no transactions
+        :raises AccountFetchError: when the page could not be loaded
+        """
+        response = self.session.get(url, header_auth=True, params=params)
+        logger.debug("Request Header: %s", response.request.headers)
+        if response is not None and response.status_code == 200:
+            log_response(logger, response)
+            data = decode_response(response)
+            if data is not None and "TransactionListResponse" in data:
+                return data["TransactionListResponse"]
+            print("TransactionParser No Transactions Error")
+        elif response is not None and response.status_code == 204:
+            return {}
+        else:
+            logger.debug("Response Body: %s", response.text if response is not None else None)
+        raise AccountFetchError(f"transactions page failed: {url}")
+
+    def iter_transactions(self, acc, start_date=None, end_date=None, count=TRANSACTION_PAGE_SIZE, retain=None):
+        """
+        Iterator over an account's Transactions that follows the marker/moreTransactions paging,
+        requesting each page only once the previous one has been consumed
+
+        :param acc: Account to fetch transactions for
+        :param start_date: earliest transaction date, datetime or MMDDYYYY string
+        :param end_date: latest transaction date, datetime or MMDDYYYY string
+        :param count: transactions per page (API maximum is 50)
+        :param retain: keep the raw dict on each Transaction, see parse_transaction
+        """
+        url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/transactions.json"
+        params = self._transactions_params(start_date, end_date, count)
+        while True:
+            data = self._transactions_page(url, dict(params))
+            yield from self._page_transactions(data, retain)
+            if not (data.get("moreTransactions") and data.get("marker")):
+                return
+            params["marker"] = data["marker"]
+
+    @staticmethod
+    def _page_transactions(data, retain=None):
+        """Transactions of one TransactionListResponse page"""
+        for tx in data.get("Transaction", []):
+            try:
+                transaction = parse_transaction(tx, retain)
+            except Exception as e:
+                # logger.info("\nTransactionParser: Error Adding Transaction", tx['description'])
+                continue
+            if transaction is not None:
+                yield transaction
+
     def PositionsParser(self):
         for acc in self.accounts:
-            # URL for the API endpoint
-            url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/portfolio.json"
-
-            # Make API call for GET request
-            response = self.session.get(url, header_auth=True)
-            logger.debug("Request Header: %s", response.request.headers)
-            pos = []
-            # Handle and parse response
-            if response is not None and response.status_code == 200:
-                parsed = json.loads(response.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                data = response.json()
-                try:
-                    positions = data["PortfolioResponse"]["AccountPortfolio"]
-                except Exception as e:
-                    print(e,"\nPositionsParser: Error no Positions in Portfolio")
-                    self.accounts_positions[acc.accountId] = pos
-                    continue
-                for acctPortfolio in positions:
-                    if acctPortfolio is not None and "Position" in acctPortfolio:
-                        for position in acctPortfolio["Position"]:
-                            p = Position(symbolDescription=position["symbolDescription"], quantity=position["quantity"],
-                                         lastTrade=position["Quick"]["lastTrade"], pricePaid=position["pricePaid"],
-                                         totalGain=position["totalGain"], marketValue=position["marketValue"],
-                                         pctOfPortfolio=position["pctOfPortfolio"], json=position)
-                            pos.append(p)
-                self.accounts_positions[acc.accountId] = pos
-                #logger.info("PositionsParser: Successfully added Positions for", acc.accountId,"-", acc.accountName)
+            positions = self._account_positions(acc)
+            if positions is None:
+                self.accounts_positions.setdefault(acc.accountId, [])
+                self.failed_accounts.add(acc.accountId)
             else:
-                #logger.info("PositionsParser: Error with adding Positions for", acc.accountId,"-", acc.accountName)
-                self.accounts_positions[acc.accountId] = pos
+                self.accounts_positions[acc.accountId] = positions
         return True
 
+    def _account_positions(self, acc):
+        """
+        Calls portfolio API for a single account and returns the parsed list of Positions
+
+        :param acc: Account to fetch positions for
+        :return: list of Positions, empty for an empty portfolio, None when the request failed
+        """
+        # URL for the API endpoint
+        url = self.base_url + "/v1/accounts/" + acc.accountIdKey + "/portfolio.json"
+
+        # Make API call for GET request
+        response = self.session.get(url, header_auth=True)
+        logger.debug("Request Header: %s", response.request.headers)
+        # Handle and parse response
+        if response is not None and response.status_code == 200:
+            log_response(logger, response)
+            return self._parse_positions(decode_response(response))
+        if response is not None and response.status_code == 204:
+            return []
+        logger.debug("Response Body: %s", response.text if response is not None else None)
+        return None
+
+    @staticmethod
+    def _parse_positions(data, retain=None):
+        """
+        :param data: decoded portfolio response, {} when the API answered 204 (empty portfolio)
+        :param retain: keep the raw dict on each Position, see Position
+        :return: list of Positions, None when the response has no portfolio
+        """
+        pos = []
+        if data == {}:
+            return pos
+        try:
+            positions = data["PortfolioResponse"]["AccountPortfolio"]
+        except Exception as e:
+            print(e,"\nPositionsParser: Error no Positions in Portfolio")
+            return None
+        for acctPortfolio in positions:
+            if acctPortfolio is not None and "Position" in acctPortfolio:
+                for position in acctPortfolio["Position"]:
+                    p = Position(symbolDescription=position["symbolDescription"], quantity=position["quantity"],
+                                 lastTrade=position["Quick"]["lastTrade"], pricePaid=position["pricePaid"],
+                                 totalGain=position["totalGain"], marketValue=position["marketValue"],
+                                 pctOfPortfolio=position["pctOfPortfolio"], json=position, retain=retain)
+                    pos.append(p)
+        return pos
+
     def transactions(self):
         # url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/transactions.json"
         url = self.base_url + "/v1/accounts/" + "TkvcooSqcC-IFbCRwRxIAQ" + "/transactions.json"
@@ -365,9 +853,8 @@ class Accounts:
         print("Transaction URL",url)
 
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             print(data)
             print(data['TransactionListResponse']['moreTransactions'])
 
@@ -378,9 +865,8 @@ class Accounts:
         logger.debug("Request Header: %s", response.request.headers)
 
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             return data
 
     def portfolio(self):
@@ -401,9 +887,8 @@ class Accounts:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
 
             print(data)
 
@@ -438,9 +923,9 @@ class Accounts:
                 logger.debug("Response Body: %s", response.text)
                 if response is not None and "headers" in response and "Content-Type" in response.headers \
                         and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + response.json()["Error"]["message"])
+                        and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                        and decode_response(response)["Error"]["message"] is not None:
+                    print("Error: " + decode_response(response)["Error"]["message"])
                 else:
                     print("Error: Portfolio API service error")
         elif response is not None and response.status_code == 204:
@@ -450,9 +935,9 @@ class Accounts:
             logger.debug("Response Body: %s", response.text)
             if response is not None and "headers" in response and "Content-Type" in response.headers \
                     and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
+                    and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                    and decode_response(response)["Error"]["message"] is not None:
+                print("Error: " + decode_response(response)["Error"]["message"])
             else:
                 print("Error: Portfolio API service error")
 
@@ -477,9 +962,8 @@ class Accounts:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             if data is not None and "BalanceResponse" in data:
                 balance_data = data["BalanceResponse"]
                 if balance_data is not None and "accountId" in balance_data:
@@ -504,18 +988,18 @@ class Accounts:
                 # Handle errors
                 logger.debug("Response Body: %s", response.text)
                 if response is not None and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + response.json()["Error"]["message"])
+                        and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                        and decode_response(response)["Error"]["message"] is not None:
+                    print("Error: " + decode_response(response)["Error"]["message"])
                 else:
                     print("Error: Balance API service error")
         else:
             # Handle errors
             logger.debug("Response Body: %s", response.text)
             if response is not None and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
+                    and "Error" in decode_response(response) and "message" in decode_response(response)["Error"] \
+                    and decode_response(response)["Error"]["message"] is not None:
+                print("Error: " + decode_response(response)["Error"]["message"])
             else:
                 print("Error: Balance API service error")
 
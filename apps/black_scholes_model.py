@@ -18,6 +18,8 @@ script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/../')
 
 import etrade_config
+from quote_cache.quote_cache import get_last_price
+from option_contract.option_contract import CALL, PUT, parse_option_column
 RATE = etrade_config.RATE  # Annualized risk free rate
 script_path = os.path.dirname(os.path.abspath(__file__))
 IMG_PATH =  script_path + '/../img'
@@ -142,7 +144,7 @@ def black_scholes_ticker_symbol(ticker:str, option_chain:pd.DataFrame, targetPri
     '''
     Get the black scholes calculation given a ticker, options chain, and target price.
     '''
-    underlyingPrice = yf.Ticker(ticker).fast_info['lastPrice']
+    underlyingPrice = get_last_price(ticker)
     sigma = abs(((targetPrice/underlyingPrice)-1)*2)  # the volatility we expect/needed to expire itm using target price
     strike = option_chain.iloc[0]['Strike']
     start_date = datetime.strptime(TODAY,'%Y-%m-%d')
@@ -162,7 +164,7 @@ def black_scholes_ticker_symbol(ticker:str, option_chain:pd.DataFrame, targetPri
     return option_chain
 
 def black_scholes_ticker_symbol_vol(ticker:str, option_chain:pd.DataFrame) -> pd.DataFrame:
-    underlyingPrice = yf.Ticker(ticker).fast_info['lastPrice']
+    underlyingPrice = get_last_price(ticker)
     strike = option_chain.iloc[0]['Strike']
     start_date = datetime.strptime(TODAY,'%Y-%m-%d')
     expiry_date = datetime.strptime(option_chain.iloc[0]['date'], '%Y-%m-%d')
@@ -201,7 +203,7 @@ def black_scholes_option_pricer(ticker:str, call_or_put:str, target_price:float=
                                                                           call_or_put=call_or_put,
                                                                           days=days, long=long)
     elif strike == None and target_price == None:
-        last_price = yf.Ticker(ticker).fast_info['lastPrice']
+        last_price = get_last_price(ticker)
         vol_df = ticker_volatility_matrix_with_time_period_df(ticker,
                                                               time_period=f"{days}d")  # get the volatility days out
         sigma = vol_df.iloc[0]['volatility']
@@ -242,7 +244,7 @@ def black_scholes_pricer_entire_chain_target(option_chain:pd.DataFrame, target_p
     option_chain['BS_Put'] = 0
     option_chain['BS_sigma'] = 0
     for index, row in option_chain.iterrows():
-        black_scholes_dict = black_scholes_price_date_target_price(yf.Ticker(row['Underlying']).fast_info['lastPrice'], row['Strike'], row['date'],targetPrice=target_price)
+        black_scholes_dict = black_scholes_price_date_target_price(get_last_price(row['Underlying']), row['Strike'], row['date'],targetPrice=target_price)
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Call_target')] = black_scholes_dict['call']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Put_target')] = black_scholes_dict['put']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_sigma_target')] = black_scholes_dict['sigma']
@@ -258,7 +260,7 @@ def black_scholes_pricer_entire_chain(option_chain:pd.DataFrame) -> pd.DataFrame
     option_chain['BS_Put'] = 0
     option_chain['BS_sigma'] = 0
     for index, row in option_chain.iterrows():
-        black_scholes_dict = black_scholes_price_date_target_price(yf.Ticker(row['Underlying']).fast_info['lastPrice'], row['Strike'], row['date'],row['Strike'])
+        black_scholes_dict = black_scholes_price_date_target_price(get_last_price(row['Underlying']), row['Strike'], row['date'],row['Strike'])
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Call')] = black_scholes_dict['call']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Put')] = black_scholes_dict['put']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_sigma')] = black_scholes_dict['sigma']
@@ -283,7 +285,7 @@ def black_scholes_pricer_entire_chain_vol(option_chain:pd.DataFrame)-> pd.DataFr
     option_chain['BS_Put_vol'] = 0
     option_chain['BS_sigma_vol'] = 0
     for index, row in option_chain.iterrows():
-        black_scholes_dict = black_scholes_price_date(yf.Ticker(row['Underlying']).fast_info['lastPrice'], row['Strike'], row['date'], sigma=sigma)
+        black_scholes_dict = black_scholes_price_date(get_last_price(row['Underlying']), row['Strike'], row['date'], sigma=sigma)
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Call_vol')] = black_scholes_dict['call']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_Put_vol')] = black_scholes_dict['put']
         option_chain.iloc[index, option_chain.columns.get_loc('BS_sigma_vol')] = black_scholes_dict['sigma']
@@ -297,8 +299,9 @@ def visualize_impl_vs_strike_vs_exp(option_chain:pd.DataFrame):
     @return:
     '''
     fig=plt.figure()
-    calls = option_chain[option_chain['Symbol'].str.match('.*[0-9]C')]
-    puts = option_chain[option_chain['Symbol'].str.match('.*[0-9]P')]
+    call_put = parse_option_column(option_chain['Symbol'])['call_put']
+    calls = option_chain[call_put == CALL]
+    puts = option_chain[call_put == PUT]
     ax = fig.add_subplot(projection='3d')
     call_vol = calls['Implied Volatility']
     put_vol = puts['Implied Volatility']
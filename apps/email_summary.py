@@ -44,17 +44,18 @@ def get_accounts_hold(AccountsObj):
 def get_accounts_sell(AccountsObj):
     s = "<h1>Immediate Liquidation --</h1>"
     for acc in AccountsObj.accounts:
-        df_win = AccountsObj.accounts_holdings[acc.accountId].can_sell_winners_dataframe()
+        holdings = AccountsObj.accounts_holdings[acc.accountId]
+        df_win = holdings.can_sell_winners_dataframe()
         gain = df_win['GAIN RANKING'].sum()
-        df_lose = AccountsObj.accounts_holdings[acc.accountId].can_sell_losers_dataframe()
+        df_lose = holdings.can_sell_losers_dataframe()
         loss = df_lose['GAIN RANKING'].sum()
 
         if gain == loss == 0:
             continue
         s += f"Total Gain: {format_currency(gain)}"
-        s += AccountsObj.accounts_holdings[acc.accountId].can_sell_winners_dataframe(html=True)
+        s += holdings.to_html(df_win, 'green_light')
         s += f"Total Loss: {format_currency(loss)}"
-        s += AccountsObj.accounts_holdings[acc.accountId].can_sell_losers_dataframe(html=True)
+        s += holdings.to_html(df_lose, 'red_light')
         # contents = AccountsObj.accounts_holdings[acc.accountId].str_can_sell(toggle_html=True)
         # if contents:
         #     s += f"<b>-->{ACC_TYPE[acc.accountName]} Account:</b> {acc.accountName}<br>"
@@ -125,7 +125,7 @@ class GeneratedPosition:
 
     def getUpdatedData(self):
         # return TODAY, yf.Ticker(self.ticker).info['currentPrice'], lastSymbolPrice(self.symbol)
-        return TODAY, yf.Ticker(self.ticker).fast_info['lastPrice'], lastSymbolPrice(self.symbol)
+        return TODAY, get_last_price(self.ticker), lastSymbolPrice(self.symbol)
 
     def __repr__(self):
         return f"""
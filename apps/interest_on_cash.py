@@ -18,6 +18,7 @@ script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/../')
 from accounts.accounts import Accounts, Account
 import etrade_config
+from quote_cache.quote_cache import get_last_price
 
 TODAY = datetime.now().strftime("%Y-%m-%d")
 RATE = etrade_config.RATE
@@ -64,7 +65,7 @@ def get_performance_within_past_time_for_ticker(ticker, days=365):
 
 
 def get_share_price(ticker):
-    return yf.Ticker(ticker).fast_info['lastPrice']
+    return get_last_price(ticker)
 
 
 def match_rate(available_cash:float, balance_with_names:list = ["VOO","SCHD","SCHG"], use_days_performance:int =365*10, rate:float =RATE):
@@ -9,6 +9,12 @@ import pandas as pd
 import yfinance as yf
 import time
 import math
+import os
+import sys
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+from quote_cache.quote_cache import get_last_price
 TODAY = datetime.now().strftime("%Y-%m-%d")
 
 # Chain of all FORD MOTOR COMPANY call options for next expiration date
@@ -161,11 +167,6 @@ def get_friday_option_for_ticker_date_closest_to_price(ticker = 'SPY', price=330
     else:
         # return conservative bear position
         return chain.tail(1)
-def get_last_price(ticker):
-    sym = yf.Ticker(ticker)
-    fi = sym.fast_info
-    return fi['lastPrice']
-
 def get_days_away(date):
     if isinstance(date, str):
         if "-" in date:
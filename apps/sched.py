@@ -43,10 +43,13 @@ def check_vol_scraper():
 
 def run_scheduler():
     session, accounts, base_url = e_sub.start_session()
+    keep_alive = e_sub.token_keep_alive(session, base_url)
+    refresh_policy = e_sub.account_refresh_policy(at_times=((6,30), (17,35)))
+    refresh_policy.mark()
     while True:
         time_now = datetime.now()
         print(time_now)
-        accounts = e_sub.stay_awake(session, base_url)
+        accounts = e_sub.stay_awake(session, base_url, accounts, keep_alive=keep_alive, refresh_policy=refresh_policy)
         check_portfolio_time(accounts, time_now)
         # check_vol_scraper() - no longer needed - just need check portfolio
 
@@ -20,6 +20,8 @@ import sys
 script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/../')
 import etrade_config
+from quote_cache.quote_cache import get_last_price
+from rate_limiter.rate_limiter import call_with_retry, YFINANCE
 
 gmail.username = etrade_config.sender_email
 gmail.password = etrade_config.email_password
@@ -39,6 +41,7 @@ EOD_TIME = datetime.today().replace(hour=4,minute=0,second=0,microsecond=0)
 HEADER = ['ticker', 'lastPrice', 'volatility', 'prevDayVolatility', 'percentMove', 'avgVolume']
 TODAY = datetime.now().strftime("%Y-%m-%d")
 EXCLUDE = pd.read_csv(os.path.join(DATA_PATH, 'exclude.csv'))['ticker'].values
+YF_RETRIES = 2 # retries per symbol before it is omitted from a scan
 
 def ticker_volatility_matrix_ranged_time(
         ticker,
@@ -51,16 +54,25 @@ def ticker_volatility_matrix_ranged_time(
     data['Log returns'] = np.log(data['Close'] / data['Close'].shift())
     data['Log returns'].std()
     volatility = data['Log returns'].std() * np.sqrt(time_period)
-    return [ticker, volatility, y.fast_info['lastPrice'],data['Volume'].mean()]
+    return [ticker, volatility, get_last_price(ticker),data['Volume'].mean()]
+
+def _yahoo_history(ticker, time_period):
+    return yf.Ticker(ticker).history(period=time_period)
+
+def yahoo_history(ticker, time_period="3mo"):
+    """
+    Price history under the YFINANCE budget, retried YF_RETRIES times. The last price is fetched
+    separately by get_last_price, which has its own retry, so each upstream call is retried in one place.
+    """
+    return call_with_retry(_yahoo_history, ticker, time_period, limiter=YFINANCE, retries=YF_RETRIES)
 
 def ticker_volatility_matrix_with_time_period(ticker, time_period="3mo"):
-    y = yf.Ticker(ticker)
-    data = y.history(period=time_period)
+    data = yahoo_history(ticker, time_period)
     time_period = data.shape[0]
     data['Log returns'] = np.log(data['Close'] / data['Close'].shift())
     data['Log returns'].std()
     volatility = data['Log returns'].std() * np.sqrt(time_period)
-    return [ticker, volatility, y.fast_info['lastPrice'],data['Volume'].mean()]
+    return [ticker, volatility, get_last_price(ticker),data['Volume'].mean()]
 
 def four_week_vol(ticker,date):
     '''date in format %Y-%m-%d'''
@@ -208,12 +220,11 @@ def tick_vol_runner(time_period='3mo', date=TODAY, test=False):
     return df
 
 def ticker_volatility_matrix_with_time_period_df(ticker, time_period="3mo"):
-    y = yf.Ticker(ticker)
-    data = y.history(period=time_period)
+    data = yahoo_history(ticker, time_period)
     time_period = data.shape[0]
 
     # curr_day = y.info['currentPrice']
-    curr_day = y.fast_info['lastPrice']
+    curr_day = get_last_price(ticker)
     prev_day = data.iloc[-2].loc['Close']
 
     diff_days = curr_day/prev_day-1
@@ -230,7 +241,7 @@ def ticker_volatility_matrix_with_time_period_df(ticker, time_period="3mo"):
     prev_day_volatility = prev_day_data['Log returns'].std() * np.sqrt(time_period-1)
 
     df = pd.DataFrame(columns=HEADER)
-    df.loc[0] = [ticker, y.fast_info['lastPrice'], volatility, prev_day_volatility,diff_days, data['Volume'].mean()]
+    df.loc[0] = [ticker, curr_day, volatility, prev_day_volatility,diff_days, data['Volume'].mean()]
     # df.loc[0] = [ticker, y.info['currentPrice'], volatility, prev_day_volatility,diff_days, data['Volume'].mean()]
     return df
 
@@ -0,0 +1,241 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from types import SimpleNamespace
+from urllib.parse import quote, urlsplit, urlunsplit, parse_qsl
+
+import aiohttp
+
+from decoder.decoder import decode_response
+from rate_limiter.rate_limiter import async_call_with_retry, etrade_limiter
+
+# logger settings
+logger = logging.getLogger('my_logger')
+logger.setLevel(logging.DEBUG)
+handler = RotatingFileHandler("python_client.log", maxBytes=5 * 1024 * 1024, backupCount=3)
+FORMAT = "%(asctime)-15s %(message)s"
+fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
+handler.setFormatter(fmt)
+logger.addHandler(handler)
+
+INSTITUTION_TYPE = 'BROKERAGE'
+MAX_CONNECTIONS = 20 # size of the shared connection pool
+DEFAULT_TIMEOUT = 30
+
+
+def _escape(value) -> str:
+    return quote(str(value), safe='~')
+
+
+def oauth1_header(method, url, params, consumer_key, consumer_secret, token, token_secret) -> str:
+    """
+    Builds a signed OAuth 1.0a (HMAC-SHA1) Authorization header for a request
+
+    :param method: HTTP method
+    :param url: request url, may contain a query string
+    :param params: query parameters sent with the request
+    :return: value for the Authorization header
+    """
+    oauth_params = {
+        "oauth_consumer_key": consumer_key,
+        "oauth_token": token,
+        "oauth_nonce": uuid.uuid4().hex,
+        "oauth_timestamp": str(int(time.time())),
+        "oauth_signature_method": "HMAC-SHA1",
+        "oauth_version": "1.0",
+    }
+
+    scheme, netloc, path, query, _ = urlsplit(url)
+    signed_params = parse_qsl(query, keep_blank_values=True)
+    signed_params += [(k, v) for k, v in (params or {}).items()]
+    signed_params += list(oauth_params.items())
+    normalized = "&".join(f"{k}={v}" for k, v in sorted((_escape(k), _escape(v)) for k, v in signed_params))
+
+    base_url = urlunsplit((scheme.lower(), netloc.lower(), path, "", ""))
+    base_string = "&".join([method.upper(), _escape(base_url), _escape(normalized)])
+    key = f"{_escape(consumer_secret)}&{_escape(token_secret)}"
+    digest = hmac.new(key.encode(), base_string.encode(), hashlib.sha1).digest()
+    oauth_params["oauth_signature"] = base64.b64encode(digest).decode()
+
+    return 'OAuth realm="",' + ",".join(f'{k}="{_escape(v)}"' for k, v in oauth_params.items())
+
+
+class ETradeResponse:
+    """Minimal response object with the attributes the sync code reads from a requests.Response"""
+
+    def __init__(self, status_code, text, headers, url, request_headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.url = url
+        self.request = SimpleNamespace(headers=request_headers, url=url)
+
+    def json(self):
+        return decode_response(self)
+
+
+class AsyncETradeClient:
+    def __init__(self, consumer_key, consumer_secret, access_token, access_token_secret, base_url,
+                 limit=MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        """
+        Initialize an asyncio E*TRADE client that signs its own OAuth1 requests and pools connections
+
+        :param base_url: E*TRADE API base url, e.g. etrade_config.PROD_BASE_URL
+        :param limit: maximum number of pooled connections
+        :param timeout: total request timeout in seconds
+        """
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+        self.base_url = base_url
+        self.limit = limit
+        self.timeout = timeout
+        self._session = None
+
+    @classmethod
+    def from_session(cls, session, base_url, **kwargs):
+        """
+        Build a client from the authenticated rauth OAuth1Session returned by oauth()
+        """
+        return cls(session.consumer_key, session.consumer_secret, session.access_token,
+                   session.access_token_secret, base_url, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _client_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def request(self, method, url, params=None, headers=None, data=None, json=None, timeout=None, **kwargs):
+        """
+        Sign and send a request under its endpoint's limiter budget (see etrade_limiter), returning an
+        ETradeResponse once the body has been read. GETs are retried on connection errors and 429/5xx,
+        POST and PUT (orders are not idempotent) only on a 429, like RateLimitedSession.
+        """
+        params = {k: str(v) for k, v in (params or {}).items()}
+        if method == "GET":
+            retry = {"retry_on": (aiohttp.ClientError, asyncio.TimeoutError)}
+        else:
+            retry = {"retry_on": (), "retry_status": (429,)}
+        return await async_call_with_retry(self._transmit, method, url, params, dict(headers or {}), data, json,
+                                           timeout, limiter=etrade_limiter(url), **retry)
+
+    async def _transmit(self, method, url, params, headers, data=None, json=None, timeout=None):
+        """
+        Send one signed attempt; a Cassette patches this while installed
+        """
+        headers = dict(headers)
+        headers["Authorization"] = oauth1_header(method, url, params, self.consumer_key, self.consumer_secret,
+                                                 self.access_token, self.access_token_secret)
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+
+        async with self._client_session().request(method, url, params=params, headers=headers, data=data,
+                                                  json=json, timeout=request_timeout) as resp:
+            text = await resp.text()
+            logger.debug("Request url: %s", url)
+            return ETradeResponse(resp.status, text, resp.headers, str(resp.url), headers)
+
+    async def get(self, url, header_auth=True, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, header_auth=True, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, header_auth=True, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def _get_json(self, url, **kwargs):
+        response = await self.get(url, **kwargs)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code == 204:
+            return {}
+        logger.debug("Response Body: %s", response.text)
+        return None
+
+    async def list_accounts(self):
+        return await self._get_json(self.base_url + "/v1/accounts/list.json")
+
+    async def balance(self, account_id_key, inst_type=INSTITUTION_TYPE):
+        params = {"instType": inst_type, "realTimeNAV": "true"}
+        headers = {"consumerkey": self.consumer_key}
+        return await self._get_json(self.base_url + "/v1/accounts/" + account_id_key + "/balance.json",
+                                    params=params, headers=headers)
+
+    async def portfolio(self, account_id_key, **params):
+        return await self._get_json(self.base_url + "/v1/accounts/" + account_id_key + "/portfolio.json",
+                                    params=params)
+
+    async def transactions(self, account_id_key, **params):
+        return await self._get_json(self.base_url + "/v1/accounts/" + account_id_key + "/transactions.json",
+                                    params=params)
+
+    async def quote(self, symbols, **params):
+        if not isinstance(symbols, str):
+            symbols = ",".join(symbols)
+        return await self._get_json(self.base_url + "/v1/market/quote/" + symbols + ".json", params=params)
+
+    async def orders(self, account_id_key, status=None, **params):
+        if status:
+            params["status"] = status
+        headers = {"consumerkey": self.consumer_key}
+        return await self._get_json(self.base_url + "/v1/accounts/" + account_id_key + "/orders.json",
+                                    params=params, headers=headers)
+
+    def sync_session(self):
+        """
+        Return a blocking session facade so Accounts, Market and ETradeOrder can use this client
+        in place of the rauth OAuth1Session
+        """
+        return SyncSession(self)
+
+
+class SyncSession:
+    def __init__(self, client: AsyncETradeClient):
+        """
+        Runs an AsyncETradeClient on a private event loop thread and exposes the blocking
+        get/post/put interface of the rauth session. Safe to share between threads.
+        """
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="etrade-async-client", daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        """
+        Run a coroutine on the client's event loop and block for its result, so callers such as
+        Accounts and Market can fan out with the client coroutines directly
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def get(self, url, header_auth=True, **kwargs):
+        return self.run(self.client.request("GET", url, **kwargs))
+
+    def post(self, url, header_auth=True, **kwargs):
+        return self.run(self.client.request("POST", url, **kwargs))
+
+    def put(self, url, header_auth=True, **kwargs):
+        return self.run(self.client.request("PUT", url, **kwargs))
+
+    def close(self):
+        self.run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
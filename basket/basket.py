@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+
+import pandas as pd
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+import etrade_config
+from order_codec.order_codec import decode_order_response
+from order_security.order_security import ETradeOrder, SecurityOrder
+from rate_limiter.rate_limiter import RateLimitedSession, call_with_retry, ETRADE_ORDERS
+
+# logger settings
+logger = logging.getLogger('my_logger')
+
+MAX_BASKET_WORKERS = 8
+CLIENT_ORDER_ID_LENGTH = 20 # E*TRADE limit
+REPORT_COLUMNS = ["symbol", "securityType", "orderAction", "quantity", "clientOrderId", "previewId", "orderId",
+                  "status", "estimatedCommission", "estimatedTotalAmount", "error", "seconds"]
+
+SKIPPED = "SKIPPED"
+PREVIEWED = "PREVIEWED"
+PLACED = "PLACED"
+FAILED = "FAILED"
+
+
+def client_order_id(account_id_key, order, tag=None):
+    """
+    Deterministic clientOrderId: resubmitting the same basket on the same day reuses the id,
+    so E*TRADE rejects the duplicate instead of selling twice
+
+    :param tag: distinguishes intentionally repeated baskets on the same day
+    """
+    key = "|".join(str(part) for part in (account_id_key, order["symbol"], order.get("callPut"),
+                                           order.get("strikePrice"), order.get("expiryYear"),
+                                           order.get("expiryMonth"), order.get("expiryDay"), order["order_action"],
+                                           order["quantity"], date.today().isoformat(), tag))
+    return hashlib.sha1(key.encode()).hexdigest()[:CLIENT_ORDER_ID_LENGTH]
+
+
+def holdings_for(security_holdings, frame):
+    """
+    SecurityHoldings rows selected by a holdings dataframe, e.g. can_sell_winners_dataframe()
+    """
+    return [security_holdings.holdings[sym] for sym in frame["SYMBOL"] if sym in security_holdings.holdings]
+
+
+class BasketOrder:
+    def __init__(self, session, base_url, account_id_key, max_workers=MAX_BASKET_WORKERS, tag=None):
+        """
+        Preview and place closing orders for many holdings at once
+
+        :param session: authenticated session; requests go through the orders rate limit
+        :param tag: salt for client order ids, see client_order_id
+        """
+        self.session = session
+        self.base_url = base_url
+        self.account_id_key = account_id_key
+        self.max_workers = max_workers
+        self.tag = tag
+        if isinstance(session, RateLimitedSession) or hasattr(session, "client"):
+            # RateLimitedSession and the async client's SyncSession already throttle and retry orders
+            self._post = session.post
+        else:
+            self._post = partial(call_with_retry, session.post, limiter=ETRADE_ORDERS, retry_on=(),
+                                 retry_status=(429,))
+
+    def build(self, holdings):
+        """
+        :return: one report row per holding; holdings with nothing to sell are SKIPPED
+        """
+        rows = []
+        for holding in holdings:
+            try:
+                order = ETradeOrder.parse_order(holding)
+            except Exception as e:
+                rows.append({"symbol": holding.sym, "status": FAILED, "error": f"Unparseable holding: {e}"})
+                continue
+            order["client_order_id"] = client_order_id(self.account_id_key, order, self.tag)
+            row = {"symbol": holding.sym, "securityType": order["security_type"],
+                   "orderAction": order["order_action"], "quantity": order["quantity"],
+                   "clientOrderId": order["client_order_id"], "order": order}
+            if not order["quantity"] or order["quantity"] <= 0:
+                row.update(status=SKIPPED, error="Nothing to sell")
+            rows.append(row)
+        return rows
+
+    def _submit(self, row, action):
+        order = row["order"]
+        url = self.base_url + "/v1/accounts/" + self.account_id_key + f"/orders/{action.lower()}.json"
+        headers = {"Content-Type": "application/xml", "consumerKey": etrade_config.CONSUMER_KEY}
+        payload = SecurityOrder.payload_parser(order, action)
+        start = time.perf_counter()
+        try:
+            response = self._post(url, header_auth=True, headers=headers, data=payload)
+            result = decode_order_response(response.text)
+        except Exception as e:
+            row.update(status=FAILED, error=str(e))
+            return row
+        finally:
+            row["seconds"] = row.get("seconds", 0) + time.perf_counter() - start
+
+        if not result.ok or response.status_code != 200:
+            row.update(status=FAILED, error=f"{result.error_code}: {result.error_message}")
+            return row
+        if result.orders:
+            row["estimatedCommission"] = result.orders[0].get("estimatedCommission")
+            row["estimatedTotalAmount"] = result.orders[0].get("estimatedTotalAmount")
+        if action == "Preview":
+            order["preview_id"] = result.preview_id
+            row.update(previewId=result.preview_id, status=PREVIEWED)
+        else:
+            row.update(orderId=result.order_id, status=PLACED)
+        return row
+
+    def _run(self, rows, action, status):
+        pending = [row for row in rows if row.get("status") == status]
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(pending)))) as executor:
+            list(executor.map(lambda row: self._submit(row, action), pending))
+
+    def execute(self, holdings, place=False) -> pd.DataFrame:
+        """
+        Preview every order concurrently, then place the previewed ones in parallel
+
+        :param holdings: SecurityHolding objects to close out at market
+        :param place: False stops after the previews
+        :return: per-order report with REPORT_COLUMNS
+        """
+        rows = self.build(holdings)
+        self._run(rows, "Preview", None)
+        if place:
+            self._run(rows, "Place", PREVIEWED)
+        report = pd.DataFrame([{col: row.get(col) for col in REPORT_COLUMNS} for row in rows], columns=REPORT_COLUMNS)
+        logger.debug("Basket report:\n%s", report)
+        return report
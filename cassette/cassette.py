@@ -0,0 +1,313 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import smtplib
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+from rate_limiter.rate_limiter import bypass_limiters
+
+# logger settings
+logger = logging.getLogger('my_logger')
+
+RECORD = "record"
+REPLAY = "replay"
+# query parameters that change on every call and must not take part in matching
+VOLATILE_PARAMS = ("oauth_nonce", "oauth_timestamp", "oauth_signature", "oauth_token", "oauth_consumer_key",
+                   "oauth_signature_method", "oauth_version", "apiKey", "crumb")
+# response headers that no longer describe the stored (already decoded) body
+DROP_HEADERS = ("Content-Encoding", "Transfer-Encoding", "Content-Length", "Set-Cookie")
+
+
+class CassetteMiss(requests.ConnectionError):
+    """A request that has no recording while replaying"""
+
+
+def _strip_volatile(url):
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in VOLATILE_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def _body_digest(body):
+    if not body:
+        return ""
+    if isinstance(body, str):
+        body = body.encode()
+    return hashlib.sha1(body).hexdigest()
+
+
+def request_keys(method, url, body_sha1=""):
+    """
+    :return: (exact key, loose key); the loose key ignores the query string and body so calls made
+             with different dates or clientOrderIds still replay in recorded order
+    """
+    exact = f"{method} {_strip_volatile(url)} {body_sha1}"
+    parts = urlsplit(url)
+    loose = f"{method} {parts.scheme}://{parts.netloc}{parts.path}"
+    return exact, loose
+
+
+class _SmtpSink:
+    """Stands in for smtplib.SMTP_SSL while replaying so an offline run never sends mail"""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def login(self, *args, **kwargs):
+        return 235, b"Accepted"
+
+    def sendmail(self, sender, receivers, message):
+        self.cassette.sent_mail.append((sender, receivers, message))
+        return {}
+
+    def send_message(self, message, *args, **kwargs):
+        self.cassette.sent_mail.append((message.get("From"), message.get("To"), message.as_string()))
+        return {}
+
+    def quit(self):
+        return 221, b"Bye"
+
+
+class Cassette:
+    def __init__(self, path, mode=REPLAY, realtime=False, allow_network=False):
+        """
+        Record/replay transport for every requests-based upstream: the rauth OAuth1Session, plain
+        requests.get calls and yfinance all go through requests.Session.send, which is patched while installed,
+        as is AsyncETradeClient._transmit for the aiohttp client.
+
+        :param path: gzip-compressed JSON cassette file
+        :param mode: RECORD saves every exchange, REPLAY serves them without touching the network
+        :param realtime: while replaying, sleep for each recorded response time
+                         (limiter budgets are bypassed while replaying either way)
+        :param allow_network: while replaying, fall through to the network on a miss instead of raising CassetteMiss
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"mode must be {RECORD} or {REPLAY}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.allow_network = allow_network
+        self.interactions = []
+        self.sent_mail = []
+        self.hits = 0
+        self.misses = 0
+        self._exact = defaultdict(list) # key -> positions in interactions
+        self._loose = defaultdict(list)
+        self._cursor = defaultdict(int)
+        self._used = set()
+        self._lock = threading.Lock()
+        self._original_send = None
+        self._original_smtp = None
+        self._original_transmit = None
+        self._async_client = None
+        if mode == REPLAY:
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            self.interactions = json.load(f)["interactions"]
+        for position, interaction in enumerate(self.interactions):
+            exact, loose = request_keys(interaction["method"], interaction["url"], interaction["body_sha1"])
+            self._exact[exact].append(position)
+            self._loose[loose].append(position)
+        return self
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            interactions = list(self.interactions)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            json.dump({"version": 1, "recorded": time.time(), "interactions": interactions}, f,
+                      separators=(",", ":"))
+        logger.debug("Saved %s interactions to %s", len(interactions), self.path)
+
+    def install(self):
+        if self._original_send is not None:
+            return self
+        self._original_send = requests.Session.send
+        original_send = self._original_send
+        cassette = self
+
+        def send(session, request, **kwargs):
+            return cassette._send(lambda: original_send(session, request, **kwargs), request)
+
+        requests.Session.send = send
+        self._install_async_client()
+        if self.mode == REPLAY:
+            self._original_smtp = smtplib.SMTP_SSL
+            smtplib.SMTP_SSL = _SmtpSink(self)
+            bypass_limiters(True)
+        return self
+
+    def uninstall(self):
+        if self._original_send is not None:
+            requests.Session.send = self._original_send
+            self._original_send = None
+        if self._original_transmit is not None:
+            self._async_client.AsyncETradeClient._transmit = self._original_transmit
+            self._original_transmit = None
+        if self._original_smtp is not None:
+            smtplib.SMTP_SSL = self._original_smtp
+            self._original_smtp = None
+        if self.mode == REPLAY:
+            bypass_limiters(False)
+        if self.mode == RECORD:
+            self.save()
+        logger.debug("Cassette %s: %s hits, %s misses", self.path, self.hits, self.misses)
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+        return False
+
+    def _install_async_client(self):
+        """
+        Route AsyncETradeClient through the cassette as well; it sends with aiohttp, not requests
+        """
+        try:
+            from async_client import async_client
+        except ImportError: # aiohttp not installed, so there is no async client to patch
+            return
+        self._async_client = async_client
+        self._original_transmit = async_client.AsyncETradeClient._transmit
+        original_transmit = self._original_transmit
+        cassette = self
+
+        async def transmit(client, method, url, params, headers, data=None, json=None, timeout=None):
+            send = lambda: original_transmit(client, method, url, params, headers, data, json, timeout)
+            return await cassette._send_async(send, method, url, params, headers, data, json)
+
+        async_client.AsyncETradeClient._transmit = transmit
+
+    def _lookup(self, request):
+        """
+        :return: the recorded interaction for a replayed request, None to send it over the network
+        :raises CassetteMiss: when there is no recording and allow_network is off
+        """
+        interaction = self._next(request)
+        if interaction is None:
+            with self._lock:
+                self.misses += 1
+            if self.allow_network:
+                return None
+            raise CassetteMiss(f"No recording for {request.method} {_strip_volatile(request.url)}")
+        with self._lock:
+            self.hits += 1
+        return interaction
+
+    def _send(self, send, request):
+        if self.mode == RECORD:
+            return self._record(send, request)
+        interaction = self._lookup(request)
+        if interaction is None:
+            return send()
+        if self.realtime:
+            time.sleep(interaction["elapsed"])
+        return self._response(interaction, request)
+
+    async def _send_async(self, send, method, url, params, headers, data, json):
+        """
+        _send for AsyncETradeClient: send is a coroutine factory returning an ETradeResponse
+        """
+        request = requests.Request(method, url, params=params, data=data, json=json).prepare()
+        if self.mode == RECORD:
+            start = time.monotonic()
+            response = await send()
+            self._store(request, response.status_code, None, response.headers, response.text.encode("utf-8"),
+                        time.monotonic() - start)
+            return response
+        interaction = self._lookup(request)
+        if interaction is None:
+            return await send()
+        if self.realtime:
+            await asyncio.sleep(interaction["elapsed"])
+        response = self._response(interaction, request)
+        return self._async_client.ETradeResponse(response.status_code, response.text, response.headers,
+                                                 request.url, headers)
+
+    def _record(self, send, request):
+        start = time.monotonic()
+        response = send()
+        self._store(request, response.status_code, response.reason, response.headers, response.content,
+                    time.monotonic() - start)
+        return response
+
+    def _store(self, request, status, reason, headers, content, elapsed):
+        interaction = {"method": request.method, "url": _strip_volatile(request.url),
+                       "body_sha1": _body_digest(request.body), "status": status,
+                       "reason": reason, "elapsed": round(elapsed, 4),
+                       "headers": {k: v for k, v in headers.items() if k not in DROP_HEADERS}}
+        try:
+            interaction["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interaction["body_b64"] = base64.b64encode(content).decode()
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def _next(self, request):
+        """
+        Recorded responses for the same request are served in recorded order; the last one repeats
+        """
+        exact, loose = request_keys(request.method, request.url, _body_digest(request.body))
+        with self._lock:
+            for key, index in ((exact, self._exact), (loose, self._loose)):
+                queue = index.get(key)
+                if not queue:
+                    continue
+                cursor = self._cursor[key]
+                while cursor < len(queue) and queue[cursor] in self._used:
+                    cursor += 1
+                self._cursor[key] = cursor
+                position = queue[cursor] if cursor < len(queue) else queue[-1]
+                self._used.add(position)
+                return self.interactions[position]
+        return None
+
+    @staticmethod
+    def _response(interaction, request):
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction.get("reason")
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        if "body_b64" in interaction:
+            response._content = base64.b64decode(interaction["body_b64"])
+        else:
+            response._content = interaction["body"].encode("utf-8")
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def use_cassette(path, mode=REPLAY, **kwargs):
+    """
+    with use_cassette("cassettes/email.json.gz", mode=RECORD):
+        email(load_accounts(session, base_url))
+    """
+    return Cassette(path, mode=mode, **kwargs)
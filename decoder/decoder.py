@@ -0,0 +1,73 @@
+import json
+import logging
+
+# Use a faster JSON parser when one is installed
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+_DECODED = "_decoded_body" # attribute the parsed body is cached under on the response
+_MISSING = object()
+
+
+def set_json_backend(loads):
+    """
+    Swap the function used to parse response bodies, e.g. orjson.loads or ujson.loads
+
+    :param loads: callable taking str/bytes and returning the parsed object
+    """
+    global _loads
+    _loads = loads
+
+
+def decode_response(response, empty=None):
+    """
+    Parse a response body once and cache the result on the response object.
+    Repeated calls (success path, error branches) reuse the cached value.
+
+    :param response: requests/rauth response, or anything with a .text attribute
+    :param empty: returned when the body is empty or not valid JSON
+    :return: parsed JSON body
+    """
+    if response is None:
+        return empty
+    cached = getattr(response, _DECODED, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    text = response.text
+    if not text or not text.strip():
+        data = empty
+    else:
+        try:
+            data = _loads(text)
+        except ValueError:
+            data = empty
+    try:
+        setattr(response, _DECODED, data)
+    except AttributeError:
+        pass
+    return data
+
+
+class _PrettyBody:
+    """Defers json.dumps(indent=4) until a log record is actually formatted"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        data = decode_response(self.response)
+        if data is None:
+            return str(self.response.text)
+        return json.dumps(data, indent=4, sort_keys=True)
+
+
+def log_response(logger, response, label="Response Body: %s"):
+    """
+    Log a pretty-printed response body only when the logger has DEBUG enabled
+    """
+    if response is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(label, _PrettyBody(response))
+
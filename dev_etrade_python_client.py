@@ -12,14 +12,24 @@ import logging
 import configparser
 import sys
 import requests
-from rauth import OAuth1Service
+from rauth import OAuth1Service, OAuth1Session
 from logging.handlers import RotatingFileHandler
 from accounts.accounts import Accounts
+from async_client.async_client import AsyncETradeClient
+from cassette.cassette import Cassette, RECORD, REPLAY
+from keep_alive.keep_alive import KeepAlive, RefreshPolicy, RENEW_INTERVAL, REFRESH_INTERVAL
+from ledger.ledger import TransactionLedger
+from snapshots.snapshots import SnapshotStore
+from events.events import BALANCE_MOVE_PCT
+from rate_limiter.rate_limiter import RateLimitedSession, limiter_metrics
 # from apps.sentiment_analysis import scrape_articles_determine_sentiment_and_send_email
 
 from market.market import Market
+import positions.positions
+import transactions.transactions
 import time
 import argparse
+import atexit
 from inputimeout import inputimeout, TimeoutOccurred
 import etrade_config
 import os
@@ -42,6 +52,8 @@ base = os.getcwd()
 level = logging.DEBUG
 fmt =  "[%(levelname)s] [dev_etrade_python_client.py] %(asctime)-15s %(message)s"
 logging.basicConfig(level=level, format=fmt)
+# raw API dicts are only kept on Positions/Transactions when debugging
+positions.positions.RETAIN_JSON = transactions.transactions.RETAIN_JSON = getattr(etrade_config, "RETAIN_RAW_JSON", False)
 
 def oauth():
     """Allows user authorization for the sample application with OAuth 1"""
@@ -70,23 +82,70 @@ def oauth():
     session = etrade.get_auth_session(request_token,
                                   request_token_secret,
                                   params={"oauth_verifier": text_code})
-    return session, base_url
+    return RateLimitedSession(session), base_url
+
+def replay_session():
+    """
+    Session for replaying a cassette; OAuth parameters are ignored when matching recordings.
+    Not rate limited, so a replay benchmark times the client rather than the limiter.
+    """
+    session = OAuth1Session(etrade_config.CONSUMER_KEY, etrade_config.CONSUMER_SECRET,
+                            access_token="replay", access_token_secret="replay")
+    return session, etrade_config.PROD_BASE_URL
+
+def async_session(session, base_url):
+    """Wrap the authenticated OAuth 1 session in the pooled asyncio client, returning a drop-in sync session"""
+    client = AsyncETradeClient.from_session(session, base_url)
+    return client.sync_session()
 
 def can_i_sell(ticker, AccountsObj):
     logging.info(f"can_i_sell(ticker={ticker}, AccountsObj={AccountsObj}) on host: {socket.gethostname()}")
-    for acc in AccountsObj.accounts:
-        contents = AccountsObj.accounts_holdings[acc.accountId]._can_sell()
-        for tk,qty in contents:
-            if ticker.upper() in tk.upper():
-                logging.info(f"Can Sell: {tk} and Qty: {qty}")
+    for account_id, tk, qty in AccountsObj.holdings_index.can_sell(ticker):
+        logging.info(f"Can Sell: {tk} and Qty: {qty}")
     tk = input("Check Ticker For Ability to Sell (e to exit): ")
     if tk.lower() == "e":
         return
     can_i_sell(tk, AccountsObj)
 
-def load_accounts(session, base_url):
+_local_stores = None # (TransactionLedger, SnapshotStore) opened by local_stores
+
+def local_stores():
+    """
+    The on-disk transaction ledger and snapshot store, opened once per process and closed at exit
+    """
+    global _local_stores
+    if _local_stores is None:
+        _local_stores = (TransactionLedger(), SnapshotStore())
+        atexit.register(close_local_stores)
+    return _local_stores
+
+def close_local_stores():
+    global _local_stores
+    if _local_stores is not None:
+        for store in _local_stores:
+            store.close()
+        _local_stores = None
+
+def load_accounts(session, base_url, ledger=None, snapshot_store=None, use_async=None, persist=None):
+    """
+    :param ledger: TransactionLedger to sync transactions into, None fetches the full history
+    :param snapshot_store: SnapshotStore every load and refresh is appended to, None keeps no history
+    :param use_async: load through async_session; defaults to etrade_config.USE_ASYNC_CLIENT
+    :param persist: when neither store is passed, use the on-disk local_stores();
+                    defaults to etrade_config.PERSIST_ACCOUNT_DATA
+    """
     logging.info(f"load_accounts(session={session},base_url={base_url}) on host: {socket.gethostname()}")
-    accounts = Accounts(session, base_url)
+    if use_async is None:
+        use_async = getattr(etrade_config, "USE_ASYNC_CLIENT", False)
+    if use_async:
+        session = async_session(session, base_url)
+    if persist is None:
+        persist = getattr(etrade_config, "PERSIST_ACCOUNT_DATA", False)
+    if persist and ledger is None and snapshot_store is None:
+        ledger, snapshot_store = local_stores()
+    accounts = Accounts(session, base_url, ledger=ledger, snapshot_store=snapshot_store,
+                        balance_move_pct=getattr(etrade_config, "BALANCE_MOVE_PCT", BALANCE_MOVE_PCT))
+    accounts.events.subscribe(lambda event: logging.info(f"Account event: {event}"))
     accounts.load_accounts()
     return accounts
 
@@ -102,6 +161,19 @@ def different_tickers(accounts):
             continue
     return list(tickers_in_acct)
 
+QUOTE_WARM_TTL = 120 # seconds the batched quotes stay fresh for the volatility table
+
+def warm_quote_cache(accounts, tickers):
+    """
+    Quote the held equities in batched E*TRADE requests (Market.get_quotes stores them in QUOTE_CACHE),
+    so the volatility scanner's get_last_price lookups hit the cache instead of calling yfinance per symbol
+    """
+    try:
+        Market(accounts.session, accounts.base_url).get_quotes([sym for sym in tickers if " " not in sym],
+                                                               ttl=QUOTE_WARM_TTL)
+    except Exception as e:
+        logging.info(f"Unable to warm the quote cache: {e}")
+
 def email(accounts, acc_sum=True, hold_sum=True, sell_sum=True, vol=True):
     logging.info(f"email(accounts={accounts}, acc_sum={acc_sum}, hold_sum={hold_sum}, sell_sum={sell_sum}, vol={vol}) on host: {socket.gethostname()}")
     email_contents = []
@@ -112,7 +184,9 @@ def email(accounts, acc_sum=True, hold_sum=True, sell_sum=True, vol=True):
     if sell_sum:
         email_contents.append(get_accounts_sell(accounts))
     if vol:
-        vol_table,_,_ = apps.volatility.volatility_scanner(symbols=different_tickers(accounts),volatility="0", to_html=True, volume=0)
+        tickers = different_tickers(accounts)
+        warm_quote_cache(accounts, tickers)
+        vol_table,_,_ = apps.volatility.volatility_scanner(symbols=tickers,volatility="0", to_html=True, volume=0)
         vol_contents = "<h1>Volatility of Holdings</h1>" + vol_table
         email_contents.append(vol_contents)
 
@@ -124,21 +198,49 @@ def email(accounts, acc_sum=True, hold_sum=True, sell_sum=True, vol=True):
         logging.debug("Unable to send email.")
         return False
 
-def stay_awake(session, base_url):
+EMAIL_TIMES = ((6,30), (16,0))
+
+def account_refresh_policy(at_times=EMAIL_TIMES):
+    """Account reload policy, overridable with ACCOUNT_REFRESH_SECONDS / ACCOUNT_REFRESH_MARKET_HOURS in etrade_config"""
+    return RefreshPolicy(interval=getattr(etrade_config, "ACCOUNT_REFRESH_SECONDS", REFRESH_INTERVAL),
+                         at_times=at_times,
+                         market_hours=getattr(etrade_config, "ACCOUNT_REFRESH_MARKET_HOURS", None))
+
+def token_keep_alive(session, base_url):
+    return KeepAlive(session, base_url, interval=getattr(etrade_config, "TOKEN_RENEW_SECONDS", RENEW_INTERVAL))
+
+def stay_awake(session, base_url, accounts=None, keep_alive=None, refresh_policy=None):
+    """
+    Keep the token alive and only refresh accounts when the refresh policy says so.
+    Without a refresh policy every call refreshes; loaded accounts are refreshed in place and
+    only accounts whose data changed get their holdings rebuilt.
+    """
     logging.info(f"stay_awake({session}, {base_url}) on host: {socket.gethostname()}")
     time.sleep(5)
-    accounts = load_accounts(session, base_url)
+    if keep_alive is not None:
+        keep_alive.ping()
+    if accounts is None:
+        accounts = load_accounts(session, base_url)
+    elif refresh_policy is None or refresh_policy.due():
+        accounts.refresh()
+    else:
+        return accounts
+    if refresh_policy is not None:
+        refresh_policy.mark()
     return accounts
 
-def stay_live(session, base_url):
+def stay_live(session, base_url, accounts=None):
     logging.info(f"stay_live(session={session}, base_url={base_url}) on host: {socket.gethostname()}")
     print("Press any Key to Interrupt Stay Alive:")
     start = time.time()
-    email_am = (6,30)
-    email_pm = (16,0)
+    email_am, email_pm = EMAIL_TIMES
+    token = token_keep_alive(session, base_url)
+    policy = account_refresh_policy()
+    if accounts is not None:
+        policy.mark()
     while True:
         _now = datetime.now()
-        accounts = stay_awake(session, base_url)
+        accounts = stay_awake(session, base_url, accounts, keep_alive=token, refresh_policy=policy)
         if (_now.hour == email_am[0] and _now.minute == email_am[1]) or (_now.hour == email_pm[0] and _now.minute == email_pm[1]):
             email(accounts)
         logging.info("Time Awake:", time.time() - start, "seconds.")
@@ -169,7 +271,7 @@ def alive_menu():
 def process_input(inp, session, base_url, accounts):
     logging.info(f"process_input(inp={inp}, session={session}, base_url={base_url}, accounts={accounts}) @ {datetime.now()} on host: {socket.gethostname()}")
     if inp == "1":
-        accounts = stay_live(session, base_url)
+        accounts = stay_live(session, base_url, accounts)
         inp = alive_menu()
     elif inp == "2":
         email(accounts)
@@ -209,13 +311,12 @@ def vol_outliers_email(date):
         logging.info('attempting to get data')
         msg,pos = vol_scraper_outliers_data(date)
     except Exception as e:
-        logging.debug(f"Whoops, hit {e}. Trying to re run in 90 seconds.")
-        time.sleep(90)
-        msg,pos = vol_scraper_outliers_data(date)
-        send_email_with_data(msg, subject=f"EMon: Volatility Outliers & Positions Job {date} - Check Logs Encountered Exception",
+        # yfinance calls already retry per symbol behind the limiter, so the scan is not re-run as a whole
+        logging.error(f"Volatility outliers scan failed: {e}")
+        logging.info(f"Rate limiter metrics: {limiter_metrics()}")
+        send_email_with_data(f"Volatility outliers scan for {date} failed: {e}",
+                             subject=f"EMon: Volatility Outliers & Positions Job {date} - Check Logs Encountered Exception",
                              receiver_email=etrade_config.receiver_email)
-        # add_generated_positions(df=pos)
-        # get_generated_positions_obj()
     else:
         send_email_with_data(msg, subject=f"EMon: Volatility Outliers & Positions Job {date}",
                              receiver_email=etrade_config.receiver_email)
@@ -437,10 +538,28 @@ if __name__ == "__main__":
 
     parser.add_argument("-ss", "--stockStats", help="Get stock stats - incl vol surface, income statement, events for stocks given - input is 'TICKER,days out - leave TICKER as * to only fetch highest vol tickers", type=str, const='take input', nargs='?')
 
+    parser.add_argument("--cassette", help="Record or replay every HTTP call of this run to/from a compressed cassette file", type=str)
+    parser.add_argument("--cassetteMode", help="record or replay (default), replay runs offline and never sends mail", choices=[RECORD, REPLAY], default=REPLAY)
+    parser.add_argument("--asyncClient", help="Load accounts through the pooled asyncio client (etrade_config.USE_ASYNC_CLIENT)", action="store_true", default=None)
+    parser.add_argument("--persist", help="Keep the transaction ledger and balance snapshots on disk under data/ (etrade_config.PERSIST_ACCOUNT_DATA)", action="store_true", default=None)
+
     args = parser.parse_args()
+    cassette = None
+    if args.cassette:
+        cassette = Cassette(args.cassette, mode=args.cassetteMode).install()
+        run_start = time.perf_counter()
+        atexit.register(lambda: logging.info(f"Cassette run took {time.perf_counter() - run_start:.3f} seconds"))
+        atexit.register(cassette.uninstall)
     if args.Email or args.canSell or args.StayLive or args.Risk:
-        session, base_url = oauth()
-        accounts = load_accounts(session, base_url)
+        if cassette is not None and cassette.mode == REPLAY:
+            session, base_url = replay_session()
+        else:
+            session, base_url = oauth()
+        # a throwaway ledger keeps recorded and replayed runs identical
+        accounts = load_accounts(session, base_url, ledger=TransactionLedger(':memory:') if cassette else None,
+                                 snapshot_store=SnapshotStore(':memory:') if cassette else None,
+                                 use_async=args.asyncClient, persist=args.persist)
+        atexit.register(accounts.close)
 
     # Process User inputs
     if args.blackScholesPricer:
@@ -466,7 +585,7 @@ if __name__ == "__main__":
         process_input(inp, session, base_url, accounts)
     if args.StayLive:
         while True:
-            accounts = stay_live(session, base_url)
+            accounts = stay_live(session, base_url, accounts)
             inp = alive_menu()
             if inp == "1": continue
             elif inp == "2":
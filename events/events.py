@@ -0,0 +1,88 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Any, NamedTuple
+
+# logger settings
+logger = logging.getLogger('my_logger')
+
+BALANCE_MOVE_PCT = 2.0 # % change in account value, since the last BalanceMoved event, that emits a new one
+
+
+class PositionOpened(NamedTuple):
+    account_id: str
+    symbol: str
+    position: Any
+
+
+class PositionClosed(NamedTuple):
+    account_id: str
+    symbol: str
+    position: Any # last seen Position
+
+
+class QuantityChanged(NamedTuple):
+    account_id: str
+    symbol: str
+    previous_qty: float
+    qty: float
+    position: Any
+
+
+class LotSellable(NamedTuple):
+    account_id: str
+    symbol: str
+    qty: float
+    purchased: datetime
+    sellable: datetime # purchase time + HOLDING_PERIOD
+
+
+class BalanceMoved(NamedTuple):
+    account_id: str
+    previous_value: float
+    value: float
+    pct: float
+
+
+EVENT_TYPES = (PositionOpened, PositionClosed, QuantityChanged, LotSellable, BalanceMoved)
+
+
+class EventBus:
+    def __init__(self):
+        """
+        Synchronous publish/subscribe for account events; subscribers run on the publishing thread
+        """
+        self._subscribers = [] # (callback, event types or None for all)
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, *event_types):
+        """
+        :param callback: called with each event
+        :param event_types: event classes to receive, none for every event
+        :return: function that removes the subscription
+        """
+        entry = (callback, tuple(event_types) or None)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, event_types in subscribers:
+            if event_types is not None and not isinstance(event, event_types):
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                logger.info("Event subscriber %s failed on %s: %s", callback, event, e)
+
+    def publish_all(self, events):
+        for event in events:
+            self.publish(event)
+        return events
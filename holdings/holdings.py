@@ -1,12 +1,16 @@
 ###################### Created Classes #######################
 import sys
 import os
+from bisect import bisect_left
+from datetime import datetime
 # loading configuration file
 script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/positions')
 from positions.positions import Position
 sys.path.insert(0, script_path + '/transactions')
 from transactions.transactions import Transaction, BANNED_TRANSACTION_TYPE
+from option_contract.option_contract import parse_option
+import numpy as np
 import pandas as pd
 #################### End Created Classes #####################
 
@@ -24,6 +28,9 @@ script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_path + '/../')
 from helper import format_currency
 
+EVALUATION_RESOLUTION = 60 # seconds a computed hold matrix stays valid
+NO_SELL_DATE = "N/A"
+
 class SecurityHolding:
     def __init__(self):
         self.can_sell_qty = 0
@@ -35,42 +42,72 @@ class SecurityHolding:
         self.market_value = 0
         self.associated_transactions = []
         self.associated_positions = []
+        self.generation = 0 # bumped on every added position or transaction
+        self._owner = None # SecurityHoldings whose ReleaseCalendar holds this holding's lots
+        self._calendar = None # own calendar while the holding has no owner
+        self._calendar_generation = None
+        self._position_qty = 0
+
+    def add_position(self, position: Position):
+        self.associated_positions.append(position)
+        self._position_qty += position.qty
+        self.invalidate()
+
+    def add_transaction(self, transaction: Transaction):
+        """
+        O(1): the lot is only placed on the release calendar the next time the holding is evaluated
+        """
+        self.associated_transactions.append(transaction)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Mark the hold state stale, e.g. after editing associated_positions/associated_transactions directly
+        """
+        self._position_qty = sum(pos.qty for pos in self.associated_positions)
+        self.generation += 1
+        if self._owner is not None:
+            self._owner.generation += 1
+
+    def calendar(self):
+        """
+        ReleaseCalendar the hold state is read from: the owning account's, or one of this holding alone
+        """
+        if self._owner is not None:
+            return self._owner.calendar()
+        if self._calendar_generation != self.generation:
+            self._calendar = ReleaseCalendar({self.sym: self})
+            self._calendar_generation = self.generation
+        return self._calendar
 
     def percent_gain(self):
         return (self.market_value/(self.market_value-self.total_gain))-1
 
-    def _balance_qty(self):
-        self.can_sell_qty -= self.hold_qty()
-
     def qty(self) -> int:
-        if len(self.hold_matrix()) == 0:
-            return self._can_sell()
-        total_hold_qty = 0
-        for qty, _, _, _ in self.hold_matrix():
-            total_hold_qty += qty
-        return total_hold_qty + self.can_sell_qty
+        return self.hold_qty() + self._can_sell()
 
     def __repr__(self) -> str:
         ret_str = f'Sym: {self.sym}; Qty: {self.qty()}; Price: {format_currency(self.px)}; TotalGain: {format_currency(self.total_gain)}; MarketValue: {format_currency(self.market_value)}'
         return ret_str
 
-    def hold_matrix(self):
-        _hold_matrix = []
-        if len(self.associated_transactions) != 0:
-            for tx in self.associated_transactions:
-                if not tx.can_sell():
-                    _hold_matrix.append((tx.qty, tx.date, tx.can_sell_date(), tx.can_sell_days()))
-        return _hold_matrix
+    def hold_matrix(self, now=None):
+        """
+        Lots still inside the holding period as (qty, purchase date, sell date, time until sellable),
+        in the order the transactions were added
+
+        :param now: evaluation time, defaults to the current time
+        """
+        now = now if now else datetime.today()
+        return [(tx.qty, tx.date, release, release - now) for release, tx in self.calendar().held_lots(self.sym, now)]
 
     def _can_sell(self):
-        self.can_sell_qty = 0
-        for pos in self.associated_positions:
-            self.can_sell_qty += pos.qty
-        if len(self.associated_transactions) != 0:
-            for hold, _, _, _ in self.hold_matrix():
-                self.can_sell_qty -= hold
+        self.can_sell_qty = self._position_qty - self.hold_qty()
         return self.can_sell_qty
 
+    def qty_can_sell(self, now=None):
+        """Position quantity not inside the holding period at now"""
+        return self._position_qty - self.hold_qty(now)
+
     def str_can_sell_matrix(self, line_break: str = "\n"):
         if self._can_sell():
             return f"Qty: {self._can_sell()}{line_break}", self.total_gain * abs(1- self.ratio())
@@ -85,16 +122,19 @@ class SecurityHolding:
                 return ret_str, self.total_gain * self.ratio(), self._can_sell(), self.hold_qty()
         return None
 
-    def can_sell_info(self):
-        for qty, purchase_date, sell_date, sell_days in self.hold_matrix():
-            if qty:
-                return self.total_gain * self.ratio(), self._can_sell(), sell_date.strftime('%m-%d-%Y'), sell_days.days
+    def can_sell_info(self, now=None, calendar=None):
+        """
+        :param calendar: ReleaseCalendar containing this holding, defaults to calendar()
+        :return: (held gain, can-sell qty, sell date, days until then), None if nothing is held
+        """
+        now = now if now else datetime.today()
+        calendar = calendar if calendar is not None else self.calendar()
+        sell_date = calendar.sell_date(self.sym, now)
+        if sell_date is not None:
+            return self.total_gain * self.ratio(), self._can_sell(), sell_date.strftime('%m-%d-%Y'), (sell_date - now).days
 
-    def hold_qty(self) -> int:
-        total_qty = 0
-        for tx_qty, _, _, _ in self.hold_matrix():
-            total_qty += tx_qty
-        return total_qty
+    def hold_qty(self, now=None) -> int:
+        return self.calendar().held_qty(self.sym, now)
 
     def ratio(self):
         hold = self.hold_qty()
@@ -107,9 +147,187 @@ class SecurityHolding:
         # print(f"Symbol: {self.sym}; Ratio: {ratio}; Hold: {hold};  Sell: {sell}")
         return ratio
 
+def _integral(values):
+    # keep whole share counts as ints so tables print 10, not 10.0
+    if len(values) and np.all(np.isfinite(values)) and np.all(values == np.round(values)):
+        return values.astype(np.int64)
+    return values
+
+
+class HoldingsColumns:
+    def __init__(self, holdings):
+        """
+        Columnar copy of a SecurityHoldings dict, one row per holding. The hold state comes from a
+        ReleaseCalendar built from the same holdings.
+
+        :param holdings: {symbol: SecurityHolding}
+        """
+        items = list(holdings.values())
+        self.sym = np.array([holding.sym for holding in items], dtype=object)
+        self.last_px = np.array([holding.last_px for holding in items], dtype=float)
+        self.total_gain = np.array([holding.total_gain for holding in items], dtype=float)
+        self.market_value = np.array([holding.market_value for holding in items], dtype=float)
+        self.pct_portfolio = np.array([holding.pct_portfolio for holding in items], dtype=float)
+        self.position_qty = np.array([sum(pos.qty for pos in holding.associated_positions) for holding in items],
+                                     dtype=float)
+
+    def __len__(self):
+        return len(self.sym)
+
+    def summarize(self, calendar, now=None) -> pd.DataFrame:
+        """
+        Must-hold quantity, can-sell quantity, can-sell date, % gain and gain ranking of every holding
+
+        :param calendar: ReleaseCalendar built from the same holdings
+        :param now: evaluation time, defaults to the current time
+        :return: same columns and order as SecurityHoldings.to_dataframe
+        """
+        n = len(self)
+        must_hold, sell_dates = calendar.holding_state(now)
+        can_sell = self.position_qty - must_hold
+
+        held = ~np.isnat(sell_dates)
+        can_sell_date = np.full(n, NO_SELL_DATE, dtype=object)
+        can_sell_date[held] = pd.DatetimeIndex(sell_dates[held]).strftime('%m-%d-%Y')
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            perc_gain = (self.market_value / (self.market_value - self.total_gain) - 1) * 100
+
+        df = pd.DataFrame({"SYMBOL": self.sym,
+                           "PRICE": [format_currency(px) for px in self.last_px],
+                           "TOTAL GAIN": [format_currency(gain) for gain in self.total_gain],
+                           "% GAIN": perc_gain,
+                           "MUST HOLD": _integral(must_hold),
+                           "CAN SELL": _integral(can_sell),
+                           "CAN SELL DATE": can_sell_date,
+                           "GAIN RANKING": self.total_gain,
+                           "% PORTFOLIO": self.pct_portfolio})
+        df = df.sort_values(by=['GAIN RANKING'])
+        df = df.reset_index(drop=True)
+        return df
+
+
+def _datetime64(value):
+    return np.datetime64(value if value else datetime.today(), 'us')
+
+
+class ReleaseCalendar:
+    def __init__(self, holdings):
+        """
+        Lot-release calendar of one account: every purchase lot sorted by the time it clears HOLDING_PERIOD,
+        plus a per-symbol index, so range and next-release queries are binary searches. It is the hold
+        state behind the holdings views and can_sell_info.
+
+        :param holdings: {symbol: SecurityHolding}
+        """
+        self.symbols = list(holdings) # holding order, shared with HoldingsColumns
+        lots = [(index, sym, tx) for index, (sym, holding) in enumerate(holdings.items())
+                for tx in holding.associated_transactions]
+        # same instants Transaction.can_sell compares against
+        release = np.array([tx.release_date for _, _, tx in lots], dtype='datetime64[us]')
+        order = np.argsort(release, kind='stable')
+        self.release = release[order]
+        self.sequence = order # position of each lot in the order the transactions were added
+        self.holding = np.array([index for index, _, _ in lots], dtype=np.int64)[order]
+        self.symbol = np.array([sym for _, sym, _ in lots], dtype=object)[order]
+        self.qty = np.array([tx.qty for _, _, tx in lots], dtype=float)[order]
+        self.transactions = [lots[i][2] for i in order]
+        self._by_symbol = {} # symbol -> (positions, releases, qty still held from each position on)
+        if len(lots):
+            for sym, positions in pd.Series(self.symbol).groupby(self.symbol).indices.items():
+                qty = self.qty[positions]
+                held = np.append(np.cumsum(qty[::-1])[::-1], 0)
+                self._by_symbol[sym] = (positions, self.release[positions], held)
+
+    def __len__(self):
+        return len(self.release)
+
+    def between(self, start, end):
+        """
+        :return: [(release datetime, symbol, qty, Transaction)] for lots that become sellable after start
+                 and at or before end, in release order
+        """
+        lo = np.searchsorted(self.release, _datetime64(start), side='right')
+        hi = np.searchsorted(self.release, _datetime64(end), side='right')
+        return [(self.release[i].astype(datetime), self.symbol[i], self.qty[i], self.transactions[i])
+                for i in range(lo, hi)]
+
+    def next_release(self, symbol, now=None):
+        """
+        :return: (release datetime, qty released then) of the symbol's next lot release after now, None if nothing is held
+        """
+        if symbol not in self._by_symbol:
+            return None
+        _, releases, held = self._by_symbol[symbol]
+        i = np.searchsorted(releases, _datetime64(now), side='right')
+        if i == len(releases):
+            return None
+        j = np.searchsorted(releases, releases[i], side='right')
+        return releases[i].astype(datetime), held[i] - held[j]
+
+    def _pending(self, symbol, now):
+        """Positions of the symbol's lots still inside the holding period at now, in the order the transactions were added"""
+        if symbol not in self._by_symbol:
+            return np.array([], dtype=np.int64)
+        positions, releases, _ = self._by_symbol[symbol]
+        pending = positions[np.searchsorted(releases, _datetime64(now), side='right'):]
+        return pending[np.argsort(self.sequence[pending], kind='stable')]
+
+    def held_lots(self, symbol, now=None):
+        """
+        :return: [(release datetime, Transaction)] of the symbol's lots still inside the holding period at now,
+                 in the order the transactions were added
+        """
+        return [(self.release[i].astype(datetime), self.transactions[i]) for i in self._pending(symbol, now)]
+
+    def sell_date(self, symbol, now=None):
+        """
+        :return: release datetime of the symbol's first held lot with a quantity, in the order the
+                 transactions were added, as shown in the hold report; None if nothing is held
+        """
+        pending = self._pending(symbol, now)
+        pending = pending[self.qty[pending] != 0]
+        if not len(pending):
+            return None
+        return self.release[pending[0]].astype(datetime)
+
+    def holding_state(self, now=None):
+        """
+        Quantity inside the holding period at now and sell date (see sell_date) of every holding,
+        in the order the calendar was built from, in one pass over the pending lots
+
+        :return: (held qty array, sell date datetime64 array with NaT where nothing is held)
+        """
+        n = len(self.symbols)
+        start = np.searchsorted(self.release, _datetime64(now), side='right')
+        holding, qty, release = self.holding[start:], self.qty[start:], self.release[start:]
+        held = np.bincount(holding, weights=qty, minlength=n)
+        sell_dates = np.full(n, np.datetime64('NaT'), dtype='datetime64[us]')
+        lots = np.flatnonzero(qty != 0)
+        lots = lots[np.argsort(self.sequence[start:][lots], kind='stable')]
+        holders, first = np.unique(holding[lots], return_index=True)
+        sell_dates[holders] = release[lots[first]]
+        return held, sell_dates
+
+    def held_qty(self, symbol, now=None):
+        """Quantity of the symbol still inside the holding period at now"""
+        if symbol not in self._by_symbol:
+            return 0
+        _, releases, held = self._by_symbol[symbol]
+        qty = held[np.searchsorted(releases, _datetime64(now), side='right')]
+        return int(qty) if qty == round(qty) else float(qty)
+
+
 class SecurityHoldings:
     def __init__(self):
         self.holdings = {}
+        self.generation = 0 # bumped on every added position or transaction
+        self._columns = None
+        self._columns_generation = None
+        self._frame = None
+        self._frame_key = None # (generation, evaluation time bucket) of the cached frame
+        self._calendar = None
+        self._calendar_generation = None
 
     def add_position(self, position: Position) -> bool:
         try:
@@ -118,10 +336,11 @@ class SecurityHoldings:
             # print("Position Does Not Exist. Creating...", e)
             self.holdings[position.sym] = SecurityHolding()
             self.holdings[position.sym].sym = position.sym
+            self.holdings[position.sym]._owner = self
 
         finally:
             holdingsItem = self.holdings[position.sym]
-            holdingsItem.associated_positions.append(position)
+            holdingsItem.add_position(position)
             holdingsItem.can_sell_qty = position.qty
             holdingsItem.px = position.px_paid
             holdingsItem.last_px = position.last_trade
@@ -139,10 +358,28 @@ class SecurityHoldings:
             return False
         else:
             holdingsItem = self.holdings[transaction.dsym]
-            self.holdings[transaction.dsym]._balance_qty()
-            holdingsItem.associated_transactions.append(transaction)
+            holdingsItem.add_transaction(transaction)
         return True
 
+    def calendar(self) -> ReleaseCalendar:
+        """
+        Lot-release calendar of the holdings, rebuilt only after a position or transaction is added
+        """
+        if self._calendar_generation != self.generation:
+            self._calendar = ReleaseCalendar(self.holdings)
+            self._calendar_generation = self.generation
+        return self._calendar
+
+    def can_sell_info(self, sym, now=None):
+        """SecurityHolding.can_sell_info of one holding, answered from the account's calendar"""
+        return self.holdings[sym].can_sell_info(now, self.calendar())
+
+    def released_lots(self, start, end):
+        """
+        :return: [(symbol, Transaction)] for lots whose holding period ended after start and at or before end
+        """
+        return [(sym, tx) for _, sym, _, tx in self.calendar().between(start, end)]
+
     def str_must_hold(self, toggle_html = False):
         s = ""
         line_break = ""
@@ -217,63 +454,150 @@ class SecurityHoldings:
     def to_json(self):
         pass
 
-    def to_dataframe(self):
-        sym = []
-        price = []
-        total_gain = []
-        total_gain_secret = []
-        must_hold = []
-        perc_portfolio = []
-        perc_gain = []
-        can_sell = []
-        can_sell_date = []
-        for holding in self.holdings.values():
-            sym.append(holding.sym)
-            price.append(format_currency(holding.last_px))
-            total_gain.append(format_currency(holding.total_gain))
-            must_hold.append(holding.hold_qty())
-            perc_portfolio.append(holding.pct_portfolio)
-            perc_gain.append(holding.percent_gain()*100)
-            can_sell.append(holding._can_sell())
-            total_gain_secret.append(holding.total_gain)
-            try:
-                _,_,date,days = holding.can_sell_info()
-            except Exception as e:
-                can_sell_date.append("N/A")
-            else:
-                can_sell_date.append(date)
-        to_df = {"SYMBOL": sym, "PRICE": price, "TOTAL GAIN": total_gain, "% GAIN": perc_gain, "MUST HOLD": must_hold,
-                  "CAN SELL": can_sell, "CAN SELL DATE": can_sell_date, "GAIN RANKING": total_gain_secret, "% PORTFOLIO": perc_portfolio}
-        df = pd.DataFrame(to_df)
-        df = df.sort_values(by=['GAIN RANKING'])
+    def columns(self) -> HoldingsColumns:
+        """
+        Columnar view of the holdings, rebuilt only after a position or transaction is added
+        """
+        if self._columns_generation != self.generation:
+            self._columns = HoldingsColumns(self.holdings)
+            self._columns_generation = self.generation
+        return self._columns
+
+    def frame(self, now=None) -> pd.DataFrame:
+        """
+        Evaluated holdings frame shared by every view, recomputed only when the holdings change or
+        the evaluation time moves to the next EVALUATION_RESOLUTION window. Do not modify it in place.
+        """
+        now = now if now else datetime.today()
+        key = (self.generation, int(now.timestamp()) // EVALUATION_RESOLUTION)
+        if key != self._frame_key:
+            self._frame = self.columns().summarize(self.calendar(), now)
+            self._frame_key = key
+        return self._frame
+
+    def to_dataframe(self, now=None):
+        return self.frame(now).copy()
+
+    @staticmethod
+    def to_html(df, color):
+        """
+        :param df: one of the holdings views
+        :param color: pretty_html_table theme
+        """
+        df = df.drop(columns=["GAIN RANKING"])
         df = df.reset_index(drop=True)
-        return df
+        return build_table(df, color)
 
     def hold_dataframe(self, html=False):
-        df = self.to_dataframe()
-        df = df.loc[df['CAN SELL DATE'] != 'N/A']
-        if not html:
-            return df
-        df = df.drop(columns=["GAIN RANKING"])
-        df = df.reset_index(drop=True)
-        return build_table(df, 'grey_light')
+        df = self.frame()
+        df = df.loc[df['CAN SELL DATE'] != NO_SELL_DATE]
+        return self.to_html(df, 'grey_light') if html else df
 
     def can_sell_winners_dataframe(self, html=False):
-        df = self.to_dataframe()
-        df = df.loc[df['CAN SELL DATE'] == 'N/A']
-        df = df.loc[df['GAIN RANKING'] >= 0]
-        if not html:
-            return df
-        df = df.drop(columns=["GAIN RANKING"])
-        df = df.reset_index(drop=True)
-        return build_table(df, 'green_light')
+        df = self.frame()
+        df = df.loc[(df['CAN SELL DATE'] == NO_SELL_DATE) & (df['GAIN RANKING'] >= 0)]
+        return self.to_html(df, 'green_light') if html else df
 
     def can_sell_losers_dataframe(self, html=False):
-        df = self.to_dataframe()
-        df = df.loc[df['CAN SELL DATE'] == 'N/A']
-        df = df.loc[df['GAIN RANKING'] <= 0]
-        if not html:
-            return df
-        df = df.drop(columns=["GAIN RANKING"])
-        df = df.reset_index(drop=True)
-        return build_table(df, 'red_light')
+        df = self.frame()
+        df = df.loc[(df['CAN SELL DATE'] == NO_SELL_DATE) & (df['GAIN RANKING'] <= 0)]
+        return self.to_html(df, 'red_light') if html else df
+
+
+def underlying(sym):
+    """Underlying ticker of a symbol description: "AAPL Jan 19 '24 $150 Call" -> "AAPL" """
+    contract = parse_option(sym)
+    if contract is not None:
+        return contract.underlying
+    parts = sym.split()
+    return parts[0].upper() if parts else ""
+
+
+class HoldingsIndex:
+    def __init__(self):
+        """
+        Cross-account symbol index over SecurityHoldings: an exact map from underlying ticker to holdings
+        and a sorted description list for prefix lookups such as "AAPL JAN 19". Can-sell quantities are
+        computed once per EVALUATION_RESOLUTION window, so queries are dict lookups.
+        """
+        self._accounts = {} # accountId -> SecurityHoldings
+        self._by_underlying = {} # underlying -> [(accountId, SecurityHolding)]
+        self._descriptions = [] # sorted (upper-case description, accountId, symbol)
+        self._dirty = False
+        self._totals_key = None
+        self._can_sell = {} # (accountId, symbol) -> can-sell qty
+        self._underlying_totals = {} # underlying -> can-sell qty across accounts
+
+    def update(self, account_id, security_holdings: SecurityHoldings):
+        """Replace the holdings indexed for an account"""
+        self._accounts[account_id] = security_holdings
+        self._dirty = True
+
+    def remove(self, account_id):
+        if self._accounts.pop(account_id, None) is not None:
+            self._dirty = True
+
+    def _rebuild(self):
+        by_underlying = {}
+        descriptions = []
+        for account_id, security_holdings in self._accounts.items():
+            for sym, holding in security_holdings.holdings.items():
+                by_underlying.setdefault(underlying(sym), []).append((account_id, holding))
+                descriptions.append((sym.upper(), account_id, sym))
+        descriptions.sort()
+        self._by_underlying = by_underlying
+        self._descriptions = descriptions
+        self._dirty = False
+        self._totals_key = None
+
+    def _evaluate(self, now=None):
+        if self._dirty:
+            self._rebuild()
+        now = now if now else datetime.today()
+        key = int(now.timestamp()) // EVALUATION_RESOLUTION
+        if key != self._totals_key:
+            can_sell = {}
+            totals = {}
+            for name, entries in self._by_underlying.items():
+                total = 0
+                for account_id, holding in entries:
+                    qty = holding.qty_can_sell(now)
+                    can_sell[(account_id, holding.sym)] = qty
+                    total += qty
+                totals[name] = total
+            self._can_sell = can_sell
+            self._underlying_totals = totals
+            self._totals_key = key
+
+    def holdings(self, query):
+        """
+        :param query: underlying ticker for an exact match, otherwise a symbol description prefix
+        :return: [(accountId, SecurityHolding)]
+        """
+        if self._dirty:
+            self._rebuild()
+        query = query.strip().upper()
+        if query in self._by_underlying:
+            return list(self._by_underlying[query])
+        matches = []
+        for i in range(bisect_left(self._descriptions, (query,)), len(self._descriptions)):
+            description, account_id, sym = self._descriptions[i]
+            if not description.startswith(query):
+                break
+            matches.append((account_id, self._accounts[account_id].holdings[sym]))
+        return matches
+
+    def can_sell(self, query, now=None):
+        """
+        :return: [(accountId, symbol, qty)] for every matching holding with something to sell
+        """
+        self._evaluate(now)
+        return [(account_id, holding.sym, self._can_sell[(account_id, holding.sym)])
+                for account_id, holding in self.holdings(query) if self._can_sell[(account_id, holding.sym)]]
+
+    def can_sell_total(self, ticker, now=None):
+        """
+        :return: can-sell quantity of an underlying (shares and contracts) across all accounts
+        """
+        self._evaluate(now)
+        return self._underlying_totals.get(ticker.strip().upper(), 0)
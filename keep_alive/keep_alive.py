@@ -0,0 +1,98 @@
+import logging
+import time
+from datetime import datetime
+
+# logger settings
+logger = logging.getLogger('my_logger')
+
+RENEW_PATH = "/oauth/renew_access_token"
+RENEW_INTERVAL = 30 * 60 # seconds, E*TRADE deactivates a token after two idle hours
+REFRESH_INTERVAL = 15 * 60 # seconds between account data reloads
+
+
+def renew_access_token(session, base_url) -> bool:
+    """
+    Reactivate the OAuth access token without touching any account endpoint
+
+    :return: True when E*TRADE accepted the renewal
+    """
+    response = session.get(base_url + RENEW_PATH, header_auth=True)
+    if response is not None and response.status_code == 200:
+        logger.debug("Access token renewed: %s", response.text)
+        return True
+    logger.debug("Access token renewal failed: %s %s", getattr(response, "status_code", None),
+                 getattr(response, "text", None))
+    return False
+
+
+class KeepAlive:
+    def __init__(self, session, base_url, interval=RENEW_INTERVAL):
+        """
+        Calls the token renew endpoint on a timer
+
+        :param interval: seconds between renewals
+        """
+        self.session = session
+        self.base_url = base_url
+        self.interval = interval
+        self.last_renewed = None
+        self.renewals = 0
+        self.failures = 0
+
+    def due(self) -> bool:
+        return self.last_renewed is None or time.monotonic() - self.last_renewed >= self.interval
+
+    def ping(self, force=False) -> bool:
+        """
+        Renew the token if the interval elapsed
+
+        :return: False only when a renewal was attempted and failed
+        """
+        if not force and not self.due():
+            return True
+        if renew_access_token(self.session, self.base_url):
+            self.last_renewed = time.monotonic()
+            self.renewals += 1
+            return True
+        self.failures += 1
+        return False
+
+
+class RefreshPolicy:
+    def __init__(self, interval=REFRESH_INTERVAL, at_times=(), market_hours=None):
+        """
+        Decides when account data actually needs reloading, independently of the keep-alive
+
+        :param interval: seconds between reloads, None to only reload at at_times
+        :param at_times: (hour, minute) tuples that always get fresh data, e.g. email times
+        :param market_hours: ((open_hour, open_minute), (close_hour, close_minute)); interval reloads
+                             only happen inside this window when given
+        """
+        self.interval = interval
+        self.at_times = tuple(at_times)
+        self.market_hours = market_hours
+        self.last_refresh = None
+        self._last_slot = None
+
+    def _in_market_hours(self, now):
+        if self.market_hours is None:
+            return True
+        (open_h, open_m), (close_h, close_m) = self.market_hours
+        return now.weekday() < 5 and (open_h, open_m) <= (now.hour, now.minute) < (close_h, close_m)
+
+    def due(self, now=None) -> bool:
+        now = now if now else datetime.now()
+        if self.last_refresh is None:
+            return True
+        slot = (now.date(), now.hour, now.minute)
+        if (now.hour, now.minute) in self.at_times and slot != self._last_slot:
+            return True
+        if self.interval is None or not self._in_market_hours(now):
+            return False
+        return time.monotonic() - self.last_refresh >= self.interval
+
+    def mark(self, now=None):
+        now = now if now else datetime.now()
+        self.last_refresh = time.monotonic()
+        if (now.hour, now.minute) in self.at_times:
+            self._last_slot = (now.date(), now.hour, now.minute)
@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+from transactions.transactions import parse_transaction
+
+DATA_PATH = script_path + '/../data'
+LEDGER_PATH = os.path.join(DATA_PATH, 'transaction_ledger.db')
+READ_CHUNK = 500 # rows read per query by iter_transactions
+
+
+class TransactionLedger:
+    def __init__(self, path=LEDGER_PATH):
+        """
+        Local on-disk store of raw E*TRADE transactions keyed by (account, transactionId)
+
+        :param path: sqlite database file, ':memory:' for a throwaway ledger
+        """
+        self.path = path
+        if path != ':memory:' and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS transactions (
+                                  account_id TEXT NOT NULL,
+                                  transaction_id TEXT NOT NULL,
+                                  transaction_date INTEGER NOT NULL,
+                                  payload TEXT NOT NULL,
+                                  PRIMARY KEY (account_id, transaction_id))""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS transactions_account_date
+                                  ON transactions (account_id, transaction_date)""")
+        self._conn.commit()
+
+    def last_transaction_date(self, account_id):
+        """
+        :return: newest stored transactionDate (epoch ms) for the account, or None when nothing is stored
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(transaction_date) FROM transactions WHERE account_id = ?",
+                                     (str(account_id),)).fetchone()
+        return row[0] if row else None
+
+    def merge(self, account_id, raw_transactions) -> int:
+        """
+        Insert or replace raw TransactionListResponse entries for an account
+
+        :return: number of entries written
+        """
+        rows = [(str(account_id), str(tx['transactionId']), tx['transactionDate'], json.dumps(tx))
+                for tx in raw_transactions if 'transactionId' in tx]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def raw_transactions(self, account_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM transactions WHERE account_id = ? "
+                                      "ORDER BY transaction_date DESC, transaction_id DESC", (str(account_id),)).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def iter_transactions(self, account_id, chunk=READ_CHUNK):
+        """
+        Generator over the stored Transactions for the account, newest first, reading chunk rows at a time
+
+        :param chunk: rows per query
+        """
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._conn.execute("SELECT transaction_date, transaction_id, payload FROM transactions "
+                                              "WHERE account_id = ? "
+                                              "ORDER BY transaction_date DESC, transaction_id DESC LIMIT ?",
+                                              (str(account_id), chunk)).fetchall()
+                else:
+                    rows = self._conn.execute("SELECT transaction_date, transaction_id, payload FROM transactions "
+                                              "WHERE account_id = ? AND (transaction_date < ? "
+                                              "OR (transaction_date = ? AND transaction_id < ?)) "
+                                              "ORDER BY transaction_date DESC, transaction_id DESC LIMIT ?",
+                                              (str(account_id), last[0], last[0], last[1], chunk)).fetchall()
+            for _, _, payload in rows:
+                try:
+                    transaction = parse_transaction(json.loads(payload))
+                except Exception as e:
+                    continue
+                if transaction is not None:
+                    yield transaction
+            if len(rows) < chunk:
+                return
+            last = rows[-1]
+
+    def transactions(self, account_id):
+        """
+        :return: stored Transactions for the account, newest first, without touching the network
+        """
+        return list(self.iter_transactions(account_id))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,7 +1,13 @@
-import json
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 
+import pandas as pd
+
+from decoder.decoder import decode_response, log_response
+from quote_cache.quote_cache import QUOTE_CACHE
+
 # logger settings
 logger = logging.getLogger('my_logger')
 logger.setLevel(logging.DEBUG)
@@ -11,12 +17,91 @@ fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
 handler.setFormatter(fmt)
 logger.addHandler(handler)
 
+QUOTE_SYMBOL_LIMIT = 25 # max symbols per quote request
+MAX_QUOTE_WORKERS = 8
+QUOTE_COLUMNS = ["last", "bid", "ask", "bidSize", "askSize", "volume", "change", "changePct"]
+# E*TRADE "All" detail field for each column
+QUOTE_FIELDS = {"last": "lastTrade", "bid": "bid", "ask": "ask", "bidSize": "bidSize", "askSize": "askSize",
+                "volume": "totalVolume", "change": "changeClose", "changePct": "changeClosePercentage"}
+
 
 class Market:
     def __init__(self, session, base_url):
         self.session = session
         self.base_url = base_url
 
+    def _quote_chunk(self, symbols):
+        """
+        Calls quotes API for up to QUOTE_SYMBOL_LIMIT symbols
+
+        :return: list of QuoteData entries
+        """
+        url = self.base_url + "/v1/market/quote/" + ",".join(symbols) + ".json"
+        response = self.session.get(url, header_auth=True, params={"detailFlag": "ALL"})
+        logger.debug("Request Header: %s", response.request.headers)
+
+        if response is not None and response.status_code == 200:
+            log_response(logger, response)
+            return self._quote_data(decode_response(response))
+        logger.debug("Response Body: %s", response)
+        return []
+
+    @staticmethod
+    def _quote_data(data):
+        """
+        :return: list of QuoteData entries of a decoded QuoteResponse
+        """
+        if data is not None and "QuoteResponse" in data and "QuoteData" in data["QuoteResponse"]:
+            return data["QuoteResponse"]["QuoteData"]
+        if data is not None and 'QuoteResponse' in data and 'Messages' in data["QuoteResponse"]:
+            for error_message in data["QuoteResponse"]["Messages"].get("Message", []):
+                logger.debug("Quote Error: %s", error_message.get("description"))
+        return []
+
+    async def _quotes_async(self, client, chunks):
+        """
+        Sends every quote chunk at once on the AsyncETradeClient's event loop
+        """
+        responses = await asyncio.gather(*(client.quote(chunk, detailFlag="ALL") for chunk in chunks))
+        return [self._quote_data(data) for data in responses]
+
+    def get_quotes(self, symbols, max_workers=MAX_QUOTE_WORKERS, cache=QUOTE_CACHE, ttl=None) -> pd.DataFrame:
+        """
+        Quotes any number of symbols, split into QUOTE_SYMBOL_LIMIT sized requests that are sent concurrently,
+        on the event loop of an async client session (see AsyncETradeClient.sync_session) or a thread pool
+
+        :param symbols: iterable of symbols
+        :param cache: QuoteCache every last price is stored in, so later get_last_price lookups hit; None skips it
+        :param ttl: seconds the cached prices stay fresh, defaults to the cache's ttl
+        :return: DataFrame indexed by symbol with columns QUOTE_COLUMNS
+        """
+        symbols = list(dict.fromkeys(sym.strip().upper() for sym in symbols if sym and sym.strip()))
+        chunks = [symbols[i:i + QUOTE_SYMBOL_LIMIT] for i in range(0, len(symbols), QUOTE_SYMBOL_LIMIT)]
+        if not chunks:
+            return pd.DataFrame(columns=QUOTE_COLUMNS)
+
+        client = getattr(self.session, "client", None)
+        if client is not None and hasattr(self.session, "run"):
+            results = self.session.run(self._quotes_async(client, chunks))
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+                results = list(executor.map(self._quote_chunk, chunks))
+
+        index = []
+        columns = {col: [] for col in QUOTE_COLUMNS}
+        for quote_data in results:
+            for quote in quote_data:
+                if quote is None or "Product" not in quote or "All" not in quote:
+                    continue
+                index.append(quote["Product"]["symbol"])
+                for col, field in QUOTE_FIELDS.items():
+                    columns[col].append(quote["All"].get(field))
+        if cache is not None:
+            for sym, last in zip(index, columns["last"]):
+                if last is not None:
+                    cache.put(sym, last, ttl)
+        return pd.DataFrame(columns, index=pd.Index(index, name="symbol"), columns=QUOTE_COLUMNS)
+
     def quotes(self):
         """
         Calls quotes API to provide quote details for equities, options, and mutual funds
@@ -34,12 +119,11 @@ class Market:
 
         if response is not None and response.status_code == 200:
 
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
+            log_response(logger, response)
 
             # Handle and parse response
             print("")
-            data = response.json()
+            data = decode_response(response)
             if data is not None and "QuoteResponse" in data and "QuoteData" in data["QuoteResponse"]:
                 for quote in data["QuoteResponse"]["QuoteData"]:
                     if quote is not None and "dateTime" in quote:
@@ -0,0 +1,91 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+CALL = "CALL"
+PUT = "PUT"
+OPTION_CACHE_SIZE = 4096
+# E*TRADE symbolDescription, e.g. "AAPL Jan 19 '24 $150 Call"
+DESCRIPTION_PATTERN = r"^(?P<underlying>\S+) (?P<month>[A-Za-z]{3}) (?P<day>\d{1,2}) '(?P<year>\d{2}) " \
+                      r"\$(?P<strike>[\d,]+(?:\.\d+)?) (?P<call_put>Call|Put)\b"
+# OCC "AAPL  240119C00150000", E*TRADE "AAPL--240119C00150000" and Yahoo contractSymbol "AAPL240119C00150000"
+OCC_PATTERN = r"^(?P<underlying>[A-Z][A-Z0-9.]{0,5}?)[ -]*(?P<date>\d{6})(?P<call_put>[CP])(?P<strike>\d{8})$"
+_DESCRIPTION = re.compile(DESCRIPTION_PATTERN, re.IGNORECASE)
+_OCC = re.compile(OCC_PATTERN)
+_MONTHS = {month: index for index, month in enumerate(("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP",
+                                                       "OCT", "NOV", "DEC"), 1)}
+
+
+class OptionContract(NamedTuple):
+    """Single option contract; hashable, so it can key dicts and sets across all symbol notations"""
+    underlying: str
+    expiry: date
+    call_put: str # CALL or PUT
+    strike: float
+
+    def occ(self, pad=" ") -> str:
+        """21 character OCC symbol; pad="-" gives E*TRADE's productId symbol, e.g. "PLTR--220218P00023000" """
+        return f"{self.underlying:{pad}<6}{self.expiry:%y%m%d}{self.call_put[0]}{round(self.strike * 1000):08d}"
+
+    def yahoo(self) -> str:
+        return f"{self.underlying}{self.expiry:%y%m%d}{self.call_put[0]}{round(self.strike * 1000):08d}"
+
+    def description(self) -> str:
+        return f"{self.underlying} {self.expiry:%b} {self.expiry.day} '{self.expiry:%y} ${self.strike:g} " \
+               f"{self.call_put.capitalize()}"
+
+    def expiry_datetime(self) -> datetime:
+        return datetime(self.expiry.year, self.expiry.month, self.expiry.day)
+
+
+@lru_cache(maxsize=OPTION_CACHE_SIZE)
+def parse_option(symbol: str) -> Optional[OptionContract]:
+    """
+    :param symbol: E*TRADE symbolDescription, OCC, E*TRADE productId or Yahoo contractSymbol
+    :return: OptionContract, None when the symbol is not an option
+    """
+    if not symbol:
+        return None
+    symbol = symbol.strip()
+    match = _OCC.match(symbol)
+    if match:
+        day = match["date"]
+        return OptionContract(match["underlying"], date(2000 + int(day[:2]), int(day[2:4]), int(day[4:])),
+                              CALL if match["call_put"] == "C" else PUT, int(match["strike"]) / 1000)
+    match = _DESCRIPTION.match(symbol)
+    if match and match["month"].upper() in _MONTHS:
+        return OptionContract(match["underlying"].upper(),
+                              date(2000 + int(match["year"]), _MONTHS[match["month"].upper()], int(match["day"])),
+                              match["call_put"].upper(), float(match["strike"].replace(",", "")))
+    return None
+
+
+def is_option(symbol: str) -> bool:
+    return parse_option(symbol) is not None
+
+
+def parse_option_column(symbols: pd.Series) -> pd.DataFrame:
+    """
+    Parse a whole column of option symbols, e.g. an option chain's contractSymbol, without a Python loop per row
+
+    :return: frame with the index of symbols and columns underlying, expiry (datetime64), call_put, strike;
+             rows that are not options are NaN/NaT
+    """
+    symbols = symbols.astype(str).str.strip()
+    occ = symbols.str.extract(OCC_PATTERN)
+    frame = pd.DataFrame({"underlying": occ["underlying"],
+                          "expiry": pd.to_datetime(occ["date"], format="%y%m%d", errors="coerce"),
+                          "call_put": occ["call_put"].map({"C": CALL, "P": PUT}),
+                          "strike": pd.to_numeric(occ["strike"], errors="coerce") / 1000}, index=symbols.index)
+    rest = frame["underlying"].isna()
+    if rest.any():
+        described = symbols[rest].str.extract(DESCRIPTION_PATTERN, flags=re.IGNORECASE)
+        frame.loc[rest, "underlying"] = described["underlying"].str.upper()
+        frame.loc[rest, "expiry"] = pd.to_datetime(described["month"].str.capitalize() + " " + described["day"] +
+                                                   " " + described["year"], format="%b %d %y", errors="coerce")
+        frame.loc[rest, "call_put"] = described["call_put"].str.upper()
+        frame.loc[rest, "strike"] = pd.to_numeric(described["strike"].str.replace(",", ""), errors="coerce")
+    return frame
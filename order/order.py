@@ -4,12 +4,17 @@
 # Created Date: 20/05/2023
 # Email       : kori.s.vernon@gmail.com
 # ---------------------------------------------------------------------------
-import json
 import logging
 from logging.handlers import RotatingFileHandler
 import configparser
 import random
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from decoder.decoder import decode_response, log_response
+from order_codec.order_codec import EQ, encode_cancel, encode_order
 
 # loading configuration file
 config = configparser.ConfigParser()
@@ -24,6 +29,125 @@ fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
 handler.setFormatter(fmt)
 logger.addHandler(handler)
 
+ORDER_STATUSES = ["OPEN", "EXECUTED", "INDIVIDUAL_FILLS", "CANCELLED", "REJECTED", "EXPIRED"]
+ORDER_PAGE_SIZE = 100 # max count accepted by the orders API
+ORDER_BOOK_COLUMNS = ["orderId", "status", "orderType", "placedTime", "orderStatus", "symbol", "securityType",
+                      "orderAction", "orderedQuantity", "filledQuantity", "averageExecutionPrice", "priceType",
+                      "orderTerm", "limitPrice", "stopPrice"]
+OPTION_FIELDS = ("callPut", "expiryYear", "expiryMonth", "expiryDay", "strikePrice")
+
+
+def order_payload(order, action="Preview"):
+    """
+    XML body for an order dict as built by user_select_order / print_orders, see order_codec.encode_order
+
+    :param order: snake_case order dict; option orders also carry the OPTION_FIELDS of their Product
+    :param action: Preview or Place
+    """
+    security_type = order.get("security_type") or EQ
+    fields = {"securityType": security_type,
+              "clientOrderId": order["client_order_id"],
+              "symbol": order["symbol"],
+              "orderAction": order["order_action"],
+              "quantity": order["quantity"],
+              "priceType": order["price_type"],
+              "orderTerm": order["order_term"],
+              "limitPrice": order.get("limit_price", order.get("limitPrice")),
+              "previewId": order.get("preview_id")}
+    if security_type != EQ:
+        fields.update((field, order.get(field)) for field in OPTION_FIELDS)
+    return encode_order(f"{action}OrderRequest", **fields)
+
+
+def fetch_order_statuses(session, url, headers, statuses=ORDER_STATUSES):
+    """
+    Send the orders request for every status at once instead of one after another
+
+    :return: dict of status -> first page response
+    """
+    with ThreadPoolExecutor(max_workers=len(statuses)) as executor:
+        futures = {status: executor.submit(session.get, url, header_auth=True, params={"status": status},
+                                           headers=headers) for status in statuses}
+        return {status: future.result() for status, future in futures.items()}
+
+
+def _order_rows(order, status):
+    rows = []
+    for details in order.get("OrderDetail", []):
+        for instrument in details.get("Instrument", []):
+            product = instrument.get("Product", {})
+            rows.append({"orderId": order.get("orderId"),
+                         "status": status,
+                         "orderType": order.get("orderType"),
+                         "placedTime": details.get("placedTime"),
+                         "orderStatus": details.get("status"),
+                         "symbol": product.get("symbol"),
+                         "securityType": product.get("securityType"),
+                         "orderAction": instrument.get("orderAction"),
+                         "orderedQuantity": instrument.get("orderedQuantity"),
+                         "filledQuantity": instrument.get("filledQuantity"),
+                         "averageExecutionPrice": instrument.get("averageExecutionPrice"),
+                         "priceType": details.get("priceType"),
+                         "orderTerm": details.get("orderTerm"),
+                         "limitPrice": details.get("limitPrice"),
+                         "stopPrice": details.get("stopPrice")})
+    return rows
+
+
+class OrderBookError(Exception):
+    """The orders of one status could not be loaded completely"""
+
+
+def _status_rows(session, url, headers, status):
+    """
+    Every order for one status, following the marker until the last page
+
+    :raises OrderBookError: when a page failed, so a partial status is never mistaken for a complete one
+    """
+    rows = []
+    params = {"status": status, "count": ORDER_PAGE_SIZE}
+    while True:
+        response = session.get(url, header_auth=True, params=params, headers=headers)
+        if response is not None and response.status_code == 204:
+            return rows
+        if response is None or response.status_code != 200:
+            logger.debug("Orders %s returned %s: %s", status, getattr(response, "status_code", None),
+                         getattr(response, "text", None))
+            raise OrderBookError(f"{status}: orders request returned {getattr(response, 'status_code', None)}")
+        log_response(logger, response)
+        data = decode_response(response)
+        if not data or "OrdersResponse" not in data:
+            raise OrderBookError(f"{status}: no OrdersResponse")
+        for order in data["OrdersResponse"].get("Order", []):
+            if order is not None:
+                rows.extend(_order_rows(order, status))
+        marker = data["OrdersResponse"].get("marker")
+        if not marker:
+            return rows
+        params = {"status": status, "count": ORDER_PAGE_SIZE, "marker": marker}
+
+
+def fetch_order_book(session, url, headers, statuses=ORDER_STATUSES) -> pd.DataFrame:
+    """
+    Query every order status concurrently, following pagination within each status
+
+    :param url: the account's orders.json endpoint
+    :return: one row per order leg indexed by (orderId, status); statuses that could not be loaded are
+             listed in book.attrs["failed_statuses"], empty for a complete book
+    """
+    rows, failed = [], []
+    with ThreadPoolExecutor(max_workers=len(statuses)) as executor:
+        futures = {status: executor.submit(_status_rows, session, url, headers, status) for status in statuses}
+        for status, future in futures.items():
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                logger.info("Error loading %s orders: %s", status, e)
+                failed.append(status)
+    book = pd.DataFrame(rows, columns=ORDER_BOOK_COLUMNS).set_index(["orderId", "status"]).sort_index()
+    book.attrs["failed_statuses"] = failed
+    return book
+
 
 class Order:
 
@@ -50,29 +174,7 @@ class Order:
         headers = {"Content-Type": "application/xml", "consumerKey": config["DEFAULT"]["CONSUMER_KEY"]}
 
         # Add payload for POST Request
-        payload = """<PreviewOrderRequest>
-                       <orderType>EQ</orderType>
-                       <clientOrderId>{0}</clientOrderId>
-                       <Order>
-                           <allOrNone>false</allOrNone>
-                           <priceType>{1}</priceType>
-                           <orderTerm>{2}</orderTerm>
-                           <marketSession>REGULAR</marketSession>
-                           <stopPrice></stopPrice>
-                           <limitPrice>{3}</limitPrice>
-                           <Instrument>
-                               <Product>
-                                   <securityType>EQ</securityType>
-                                   <symbol>{4}</symbol>
-                               </Product>
-                               <orderAction>{5}</orderAction>
-                               <quantityType>QUANTITY</quantityType>
-                               <quantity>{6}</quantity>
-                           </Instrument>
-                       </Order>
-                   </PreviewOrderRequest>"""
-        payload = payload.format(order["client_order_id"], order["price_type"], order["order_term"],
-                                 order["limit_price"], order["symbol"], order["order_action"], order["quantity"])
+        payload = order_payload(dict(order, security_type="EQ"))
 
         # Make API call for POST request
         response = self.session.post(url, header_auth=True, headers=headers, data=payload)
@@ -81,9 +183,8 @@ class Order:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             print("\nPreview Order:")
 
             if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
@@ -91,7 +192,7 @@ class Order:
                     print("Preview ID: " + str(previewids["previewId"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
@@ -127,14 +228,14 @@ class Order:
                     print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
                     print("Error: Preview Order API service error")
         else:
             # Handle errors
-            data = response.json()
+            data = decode_response(response)
             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                 print("Error: " + data["Error"]["message"])
             else:
@@ -174,40 +275,10 @@ class Order:
                     # Add parameters and header information
                     headers = {"Content-Type": "application/xml", "consumerKey": config["DEFAULT"]["CONSUMER_KEY"]}
 
-                    # Add payload for POST Request
-                    payload = """<PreviewOrderRequest>
-                                   <orderType>{0}</orderType>
-                                   <clientOrderId>{1}</clientOrderId>
-                                   <Order>
-                                       <allOrNone>false</allOrNone>
-                                       <priceType>{2}</priceType>  
-                                       <orderTerm>{3}</orderTerm>   
-                                       <marketSession>REGULAR</marketSession>
-                                       <stopPrice></stopPrice>
-                                       <limitPrice>{4}</limitPrice>
-                                       <Instrument>
-                                           <Product>
-                                               <securityType>{5}</securityType>
-                                               <symbol>{6}</symbol>
-                                           </Product>
-                                           <orderAction>{7}</orderAction> 
-                                           <quantityType>QUANTITY</quantityType>
-                                           <quantity>{8}</quantity>
-                                       </Instrument>
-                                   </Order>
-                               </PreviewOrderRequest>"""
 
                     options_select = int(options_select)
                     prev_orders[options_select - 1]["client_order_id"] = str(random.randint(1000000000, 9999999999))
-                    payload = payload.format(prev_orders[options_select - 1]["order_type"],
-                                             prev_orders[options_select - 1]["client_order_id"],
-                                             prev_orders[options_select - 1]["price_type"],
-                                             prev_orders[options_select - 1]["order_term"],
-                                             prev_orders[options_select - 1]["limitPrice"],
-                                             prev_orders[options_select - 1]["security_type"],
-                                             prev_orders[options_select - 1]["symbol"],
-                                             prev_orders[options_select - 1]["order_action"],
-                                             prev_orders[options_select - 1]["quantity"])
+                    payload = order_payload(prev_orders[options_select - 1])
 
                     # Make API call for POST request
                     response = session.post(url, header_auth=True, headers=headers, data=payload)
@@ -216,16 +287,15 @@ class Order:
 
                     # Handle and parse response
                     if response is not None and response.status_code == 200:
-                        parsed = json.loads(response.text)
-                        logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                        data = response.json()
+                        log_response(logger, response)
+                        data = decode_response(response)
                         print("\nPreview Order: ")
                         if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
                             for previewids in data["PreviewOrderResponse"]["PreviewIds"]:
                                 print("Preview ID: " + str(previewids["previewId"]))
                         else:
                             # Handle errors
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
@@ -262,14 +332,14 @@ class Order:
                                 print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
                         else:
                             # Handle errors
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
                                 print("Error: Preview Order API service error")
                     else:
                         # Handle errors
-                        data = response.json()
+                        data = decode_response(response)
                         if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                             print("Error: " + data["Error"]["message"])
                         else:
@@ -327,6 +397,9 @@ class Order:
                                 if instrument is not None and 'Product' in instrument and 'symbol' in instrument["Product"]:
                                     order_str += "Symbol: " + instrument["Product"]["symbol"] + " | "
                                     order_obj["symbol"] = instrument["Product"]["symbol"]
+                                    for field in OPTION_FIELDS:
+                                        if field in instrument["Product"]:
+                                            order_obj[field] = instrument["Product"][field]
 
                                 if details is not None and 'priceType' in details:
                                     order_str += "Price Type: " + details["priceType"] + " | "
@@ -500,9 +573,8 @@ class Order:
                         print("Unknown Option Selected!")
                 break
             elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
+                log_response(logger, response_open, label="%s")
+                data = decode_response(response_open)
 
                 order_list = []
                 count = 1
@@ -584,11 +656,7 @@ class Order:
                         headers = {"Content-Type": "application/xml", "consumerKey": config["DEFAULT"]["CONSUMER_KEY"]}
 
                         # Add payload for POST Request
-                        payload = """<CancelOrderRequest>
-                                        <orderId>{0}</orderId>
-                                    </CancelOrderRequest>
-                                   """
-                        payload = payload.format(order_list[int(selection) - 1])
+                        payload = encode_cancel(order_list[int(selection) - 1])
 
                         # Add payload for PUT Request
                         response = self.session.put(url, header_auth=True, headers=headers, data=payload)
@@ -597,9 +665,8 @@ class Order:
 
                         # Handle and parse response
                         if response is not None and response.status_code == 200:
-                            parsed = json.loads(response.text)
-                            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                            data = response.json()
+                            log_response(logger, response)
+                            data = decode_response(response)
                             if data is not None and "CancelOrderResponse" in data \
                                     and "orderId" in data["CancelOrderResponse"]:
                                 print("\nOrder number #" + str(
@@ -608,7 +675,7 @@ class Order:
                                 # Handle errors
                                 logger.debug("Response Headers: %s", response.headers)
                                 logger.debug("Response Body: %s", response.text)
-                                data = response.json()
+                                data = decode_response(response)
                                 if 'Error' in data and 'message' in data["Error"] \
                                         and data["Error"]["message"] is not None:
                                     print("Error: " + data["Error"]["message"])
@@ -618,7 +685,7 @@ class Order:
                             # Handle errors
                             logger.debug("Response Headers: %s", response.headers)
                             logger.debug("Response Body: %s", response.text)
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
@@ -633,9 +700,9 @@ class Order:
                     # Handle errors
                     logger.debug("Response Body: %s", response_open.text)
                     if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                            and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                            and response_open.json()["Error"]["message"] is not None:
-                        print("Error: " + response_open.json()["Error"]["message"])
+                            and "Error" in decode_response(response_open) and "message" in decode_response(response_open)["Error"] \
+                            and decode_response(response_open)["Error"]["message"] is not None:
+                        print("Error: " + decode_response(response_open)["Error"]["message"])
                     else:
                         print("Error: Balance API service error")
                     break
@@ -643,13 +710,21 @@ class Order:
                 # Handle errors
                 logger.debug("Response Body: %s", response_open.text)
                 if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                        and response_open.json()["Error"]["message"] is not None:
-                    print("Error: " + response_open.json()["Error"]["message"])
+                        and "Error" in decode_response(response_open) and "message" in decode_response(response_open)["Error"] \
+                        and decode_response(response_open)["Error"]["message"] is not None:
+                    print("Error: " + decode_response(response_open)["Error"]["message"])
                 else:
                     print("Error: Balance API service error")
                 break
 
+    def order_book(self) -> pd.DataFrame:
+        """
+        Non-interactive view of every order on the account, see fetch_order_book
+        """
+        url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/orders.json"
+        headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
+        return fetch_order_book(self.session, url, headers)
+
     def view_orders(self):
         """
         Calls orders API to provide the details for the orders
@@ -662,20 +737,15 @@ class Order:
 
             # Add parameters and header information
             headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
-            params_open = {"status": "OPEN"}
-            params_executed = {"status": "EXECUTED"}
-            params_indiv_fills = {"status": "INDIVIDUAL_FILLS"}
-            params_cancelled = {"status": "CANCELLED"}
-            params_rejected = {"status": "REJECTED"}
-            params_expired = {"status": "EXPIRED"}
 
-            # Make API call for GET request
-            response_open = self.session.get(url, header_auth=True, params=params_open, headers=headers)
-            response_executed = self.session.get(url, header_auth=True, params=params_executed, headers=headers)
-            response_indiv_fills = self.session.get(url, header_auth=True, params=params_indiv_fills, headers=headers)
-            response_cancelled = self.session.get(url, header_auth=True, params=params_cancelled, headers=headers)
-            response_rejected = self.session.get(url, header_auth=True, params=params_rejected, headers=headers)
-            response_expired = self.session.get(url, header_auth=True, params=params_expired, headers=headers)
+            # Make API calls for GET request, all statuses in parallel
+            responses = fetch_order_statuses(self.session, url, headers)
+            response_open = responses["OPEN"]
+            response_executed = responses["EXECUTED"]
+            response_indiv_fills = responses["INDIVIDUAL_FILLS"]
+            response_cancelled = responses["CANCELLED"]
+            response_rejected = responses["REJECTED"]
+            response_expired = responses["EXPIRED"]
 
             prev_orders = []
 
@@ -689,9 +759,8 @@ class Order:
                 logger.debug(response_open)
                 print("None")
             elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
+                log_response(logger, response_open, label="%s")
+                data = decode_response(response_open)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "open"))
@@ -707,9 +776,8 @@ class Order:
                 logger.debug(response_executed)
                 print("None")
             elif response_executed.status_code == 200:
-                parsed = json.loads(response_executed.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_executed.json()
+                log_response(logger, response_executed, label="%s")
+                data = decode_response(response_executed)
 
                 # Display list of executed orders
                 prev_orders.extend(self.print_orders(data, "executed"))
@@ -724,9 +792,8 @@ class Order:
                 logger.debug("Response Body: %s", response_indiv_fills)
                 print("None")
             elif response_indiv_fills.status_code == 200:
-                parsed = json.loads(response_indiv_fills.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_indiv_fills.json()
+                log_response(logger, response_indiv_fills)
+                data = decode_response(response_indiv_fills)
 
                 # Display list of individual fills orders
                 prev_orders.extend(self.print_orders(data, "indiv_fills"))
@@ -741,9 +808,8 @@ class Order:
                 logger.debug(response_cancelled)
                 print("None")
             elif response_cancelled.status_code == 200:
-                parsed = json.loads(response_cancelled.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_cancelled.json()
+                log_response(logger, response_cancelled, label="%s")
+                data = decode_response(response_cancelled)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "cancelled"))
@@ -758,9 +824,8 @@ class Order:
                 logger.debug(response_rejected)
                 print("None")
             elif response_rejected.status_code == 200:
-                parsed = json.loads(response_rejected.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_rejected.json()
+                log_response(logger, response_rejected, label="%s")
+                data = decode_response(response_rejected)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "rejected"))
@@ -772,9 +837,8 @@ class Order:
                 logger.debug(response_executed)
                 print("None")
             elif response_expired.status_code == 200:
-                parsed = json.loads(response_expired.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_expired.json()
+                log_response(logger, response_expired, label="%s")
+                data = decode_response(response_expired)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "expired"))
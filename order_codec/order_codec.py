@@ -0,0 +1,257 @@
+import json
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+PREVIEW = "PreviewOrderRequest"
+PLACE = "PlaceOrderRequest"
+CANCEL = "CancelOrderRequest"
+EQ = "EQ"
+OPTN = "OPTN"
+
+_PRODUCT = {
+    EQ: "<Product><securityType>EQ</securityType><symbol>{symbol}</symbol></Product>",
+    OPTN: "<Product><securityType>OPTN</securityType><symbol>{symbol}</symbol><callPut>{callPut}</callPut>"
+          "<expiryYear>{expiryYear}</expiryYear><expiryMonth>{expiryMonth}</expiryMonth>"
+          "<expiryDay>{expiryDay}</expiryDay><strikePrice>{strikePrice}</strikePrice></Product>",
+}
+_ORDER = ("<Order><allOrNone>{allOrNone}</allOrNone><priceType>{priceType}</priceType>"
+          "<orderTerm>{orderTerm}</orderTerm><marketSession>{marketSession}</marketSession>{prices}"
+          "<Instrument>{product}<orderAction>{orderAction}</orderAction><quantityType>QUANTITY</quantityType>"
+          "<quantity>{quantity}</quantity></Instrument></Order>")
+
+
+def _compile(root, security_type):
+    # the fixed skeleton is built once; per order only the escaped values are substituted
+    order = _ORDER.replace("{product}", _PRODUCT[security_type])
+    return (f"<{root}><orderType>{security_type}</orderType><clientOrderId>{{clientOrderId}}</clientOrderId>"
+            f"{{previewIds}}{order}</{root}>")
+
+
+TEMPLATES = {(root, security_type): _compile(root, security_type)
+             for root in (PREVIEW, PLACE) for security_type in (EQ, OPTN)}
+CANCEL_TEMPLATE = f"<{CANCEL}><orderId>{{orderId}}</orderId></{CANCEL}>"
+DEFAULTS = {"allOrNone": "false", "orderTerm": "GOOD_FOR_DAY", "marketSession": "REGULAR", "priceType": "MARKET"}
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return escape(str(value))
+
+
+def encode_order(root, **fields):
+    """
+    Fill the precompiled Preview/Place template for an EQ or OPTN order
+
+    :param root: PREVIEW or PLACE; change preview/place use the same bodies
+    :param fields: API field names: securityType, clientOrderId, symbol, orderAction, quantity, priceType,
+                   orderTerm, marketSession, allOrNone, limitPrice, stopPrice, previewId and for options
+                   callPut, expiryYear, expiryMonth, expiryDay, strikePrice
+    :return: XML request body
+    """
+    security_type = fields.get("securityType") or EQ
+    values = dict(DEFAULTS)
+    values.update((key, _text(value)) for key, value in fields.items() if value is not None)
+    if security_type == OPTN:
+        values["callPut"] = values["callPut"].upper()
+    prices = ""
+    for price in ("limitPrice", "stopPrice"):
+        if fields.get(price) not in (None, "", 0):
+            prices += f"<{price}>{values[price]}</{price}>"
+    values["prices"] = prices
+    values["previewIds"] = f"<PreviewIds><previewId>{values['previewId']}</previewId></PreviewIds>" \
+        if fields.get("previewId") is not None else ""
+    return TEMPLATES[(root, security_type)].format_map(values)
+
+
+def encode_cancel(order_id):
+    return CANCEL_TEMPLATE.format(orderId=_text(order_id))
+
+
+def encode_payload(payload):
+    """
+    XML body for a build_order_payload style dict ({root: {orderType, clientOrderId, Order, PreviewIds}})
+    or {"CancelOrderRequest": {"orderId": ...}}
+    """
+    (root, body), = payload.items()
+    if root == CANCEL:
+        return encode_cancel(body["orderId"])
+    order = body["Order"]
+    instrument = order["Instrument"]
+    instrument = instrument[0] if isinstance(instrument, list) else instrument
+    product = instrument["Product"]
+    preview_ids = body.get("PreviewIds")
+    return encode_order(root, securityType=product.get("securityType", body.get("orderType")),
+                        clientOrderId=body["clientOrderId"], symbol=product["symbol"],
+                        callPut=product.get("callPut"), expiryYear=product.get("expiryYear"),
+                        expiryMonth=product.get("expiryMonth"), expiryDay=product.get("expiryDay"),
+                        strikePrice=product.get("strikePrice"), orderAction=instrument["orderAction"],
+                        quantity=instrument["quantity"], priceType=order.get("priceType"),
+                        orderTerm=order.get("orderTerm"), marketSession=order.get("marketSession"),
+                        allOrNone=order.get("allOrNone"), limitPrice=order.get("limitPrice"),
+                        stopPrice=order.get("stopPrice"),
+                        previewId=preview_ids.get("previewId") if preview_ids else None)
+
+
+def _element(elem):
+    children = list(elem)
+    if not children:
+        return elem.text
+    value = {}
+    for child in children:
+        item = _element(child)
+        if child.tag not in value:
+            value[child.tag] = item
+        elif isinstance(value[child.tag], list):
+            value[child.tag].append(item)
+        else:
+            value[child.tag] = [value[child.tag], item]
+    return value
+
+
+def xml_to_dict(text):
+    """Same shape as xmltodict.parse for attribute-free E*TRADE documents"""
+    root = ET.fromstring(text)
+    return {root.tag: _element(root)}
+
+
+class OrderResponse:
+    __slots__ = ("kind", "preview_ids", "order_ids", "client_order_id", "orders", "messages",
+                 "error_code", "error_message", "_stack", "_order", "_leg", "_message")
+
+    def __init__(self):
+        """
+        Typed view of a Preview/Place/Change/Cancel order response
+
+        kind: Preview, Place or Cancel (from the root element), Error for an error document
+        orders: one dict of Order level fields per Order, each with a "legs" list of Instrument/Product fields
+        messages: (code, type, description) tuples
+        """
+        self.kind = None
+        self.preview_ids = []
+        self.order_ids = []
+        self.client_order_id = None
+        self.orders = []
+        self.messages = []
+        self.error_code = None
+        self.error_message = None
+        self._stack = []
+        self._order = None
+        self._leg = None
+        self._message = None
+
+    @property
+    def ok(self):
+        return self.kind != "Error" and self.error_code is None
+
+    @property
+    def preview_id(self):
+        return self.preview_ids[0] if self.preview_ids else None
+
+    @property
+    def order_id(self):
+        return self.order_ids[0] if self.order_ids else None
+
+    def __repr__(self):
+        return f"OrderResponse(kind={self.kind}, preview_ids={self.preview_ids}, order_ids={self.order_ids}, " \
+               f"error={self.error_code} {self.error_message})"
+
+    def _start(self, tag):
+        if not self._stack:
+            self.kind = tag.replace("OrderResponse", "") if tag.endswith("OrderResponse") else tag
+        self._stack.append(tag)
+        if tag == "Order":
+            self._order = {"legs": []}
+            self.orders.append(self._order)
+        elif tag == "Instrument" and self._order is not None:
+            self._leg = {}
+            self._order["legs"].append(self._leg)
+        elif tag == "Message":
+            self._message = {}
+
+    def _end(self, tag, value):
+        self._stack.pop()
+        parent = self._stack[-1] if self._stack else None
+        if tag == "Order":
+            self._order = None
+        elif tag == "Instrument":
+            self._leg = None
+        elif tag == "Message":
+            self.messages.append((self._message.get("code"), self._message.get("type"),
+                                  self._message.get("description")))
+            self._message = None
+        elif value is None:
+            return
+        elif tag == "previewId":
+            self.preview_ids.append(int(value))
+        elif tag == "orderId" and (parent == "OrderIds" or len(self._stack) == 1):
+            self.order_ids.append(int(value))
+        elif self.kind == "Error" and len(self._stack) == 1:
+            if tag == "code":
+                self.error_code = value
+            elif tag == "message":
+                self.error_message = value
+        elif self._message is not None:
+            self._message[tag] = value
+        elif self._leg is not None:
+            self._leg[tag] = value
+        elif self._order is not None:
+            self._order[tag] = value
+        elif tag == "clientOrderId":
+            self.client_order_id = value
+
+    def _walk(self, tag, value):
+        if isinstance(value, list):
+            for item in value:
+                self._walk(tag, item)
+            return
+        self._start(tag)
+        if isinstance(value, dict):
+            for key, item in value.items():
+                self._walk(key, item)
+            self._end(tag, None)
+        else:
+            self._end(tag, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build from a decoded JSON order response"""
+        response = cls()
+        for tag, value in data.items():
+            response._walk(tag, value)
+        return response
+
+    @classmethod
+    def from_xml(cls, chunks):
+        """
+        Stream-parse an XML order response
+
+        :param chunks: str/bytes document or an iterable of chunks, e.g. response.iter_content()
+        """
+        response = cls()
+        parser = ET.XMLPullParser(events=("start", "end"))
+        for chunk in ((chunks,) if isinstance(chunks, (str, bytes)) else chunks):
+            parser.feed(chunk)
+            response._events(parser)
+        parser.close()
+        response._events(parser)
+        return response
+
+    def _events(self, parser):
+        for event, elem in parser.read_events():
+            if event == "start":
+                self._start(elem.tag)
+            else:
+                text = elem.text.strip() if elem.text and len(elem) == 0 else None
+                self._end(elem.tag, text or None)
+                elem.clear()
+
+
+def decode_order_response(text):
+    """
+    :param text: XML or JSON order response body
+    """
+    text = text.strip() if isinstance(text, str) else text.strip().decode()
+    if text.startswith("{"):
+        return OrderResponse.from_dict(json.loads(text))
+    return OrderResponse.from_xml(text)
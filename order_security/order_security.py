@@ -5,15 +5,12 @@
 # Email       : kori.s.vernon@gmail.com
 # ---------------------------------------------------------------------------
 from datetime import datetime
-import json
 import logging
 from logging.handlers import RotatingFileHandler
 import random
 import re
 import sys
-import xmltodict
 from typing import Union
-from jxmlease import emit_xml
 import os
 
 import etrade_config
@@ -27,6 +24,10 @@ sys.path.insert(0, script_path + '/transactions')
 from transactions.transactions import Transaction, BANNED_TRANSACTION_TYPE
 sys.path.insert(0, script_path + '/holdings')
 from holdings.holdings import SecurityHolding, SecurityHoldings
+from decoder.decoder import decode_response, log_response
+from order.order import OPTION_FIELDS, fetch_order_book, fetch_order_statuses, order_payload
+from order_codec.order_codec import OrderResponse, decode_order_response, encode_cancel, encode_payload, xml_to_dict
+from option_contract.option_contract import OptionContract, parse_option
 
 CALL = "Call"
 PUT = "Put"
@@ -52,12 +53,10 @@ class SecurityOrder:
 
     @staticmethod
     def parse_options_order(security_holding: SecurityHolding):
-        sym, m, d, y, p, t = security_holding.sym.split(" ")
-        combined = "-".join([m, d, y.strip("'")])
-        dto = datetime.strptime(combined, "%b-%d-%y")
-        price = p.strip("$")
+        contract = parse_option(security_holding.sym)
+        dto = contract.expiry_datetime()
 
-        order = {"symbol": sym,
+        order = {"symbol": contract.underlying,
                  "security_type": "OPTN",
                  "price_type": "MARKET",
                  "order_term": "GOOD_FOR_DAY",
@@ -65,8 +64,8 @@ class SecurityOrder:
                  "expiryDay": dto.day,
                  "expiryMonth": dto.month,
                  "expiryYear": dto.year,
-                 "callPut": t,
-                 "strikePrice": price,
+                 "callPut": contract.call_put.capitalize(),
+                 "strikePrice": f"{contract.strike:g}",
                  "limit_price": None,
                  # "quantity": security_holding._can_sell(),
                  "quantity": 1,
@@ -74,58 +73,9 @@ class SecurityOrder:
         return order
 
 
-    def payload_parser(self, order, action="Preview"):
-        # Add payload for POST Request
-        if order["security_type"] == "EQ":
-            payload = f"""<{action}OrderRequest>
-                                   <orderType>{order["security_type"]}</orderType>
-                                   <clientOrderId>{order["client_order_id"]}</clientOrderId>
-                                   <Order>
-                                       <allOrNone>false</allOrNone>
-                                       <priceType>{order["price_type"]}</priceType>
-                                       <orderTerm>{order["order_term"]}</orderTerm>
-                                       <marketSession>REGULAR</marketSession>
-                                       <stopPrice></stopPrice>
-                                       <limitPrice>{order["limit_price"]}</limitPrice>
-                                       <Instrument>
-                                           <Product>
-                                               <securityType>{order["security_type"]}</securityType>
-                                               <symbol>{order["symbol"]}</symbol>
-                                           </Product>
-                                           <orderAction>{order["order_action"]}</orderAction>
-                                           <quantityType>QUANTITY</quantityType>
-                                           <quantity>{order["quantity"]}</quantity>
-                                       </Instrument>
-                                   </Order>
-                               </{action}OrderRequest>"""
-        else:
-            payload = f"""<{action}OrderRequest>
-                            <Order>
-                                <Instrument>
-                                    <Product>
-                                        <callPut>{order["callPut"].upper()}</callPut>
-                                        <expiryDay>{order["expiryDay"]}</expiryDay>
-                                        <expiryMonth>{order["expiryMonth"]}</expiryMonth>
-                                        <expiryYear>{order["expiryYear"]}</expiryYear>
-                                        <securityType>OPTN</securityType>
-                                        <strikePrice>{order["strikePrice"]}</strikePrice>
-                                        <symbol>{order["symbol"]}</symbol>
-                                    </Product>
-                                    <orderAction>{order["order_action"]}</orderAction>
-                                    <orderedQuantity>{order['quantity']}</orderedQuantity>
-                                    <quantity>{order['quantity']}</quantity>
-                                </Instrument>
-                                <allOrNone>false</allOrNone>
-                                <limitPrice>{order['limit_price']}</limitPrice>
-                                <marketSession>REGULAR</marketSession>
-                                <orderTerm>{order["order_term"]}</orderTerm>
-                                <priceType>MARKET</priceType>
-                                <stopPrice></stopPrice>
-                            </Order>
-                            <clientOrderId>{order['client_order_id']}</clientOrderId>
-                            <orderType>OPTN</orderType>
-                        </{action}OrderRequest>"""
-        return payload
+    @staticmethod
+    def payload_parser(order, action="Preview"):
+        return order_payload(order, action)
 
     def sell_security_market_order(self, security_holding: SecurityHolding, action = "preview"):
         """
@@ -138,7 +88,7 @@ class SecurityOrder:
         url = self.base_url + "/v1/accounts/" + self.account.accountIdKey + f"/orders/{action}.json"
 
         order = {}
-        if CALL in security_holding.sym or PUT in security_holding.sym:
+        if parse_option(security_holding.sym) is not None:
             order = self.parse_options_order(security_holding)
             order["client_order_id"] = random.randint(1000000000, 9999999999)
         else:
@@ -164,9 +114,8 @@ class SecurityOrder:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             print("\nPreview Order:")
 
             if data is not None and f"{action_dict[action]}OrderResponse" in data and f"{action_dict[action]}Ids" in data[f"{action_dict[action]}OrderResponse"]:
@@ -174,7 +123,7 @@ class SecurityOrder:
                     print(f"{action_dict[action]} ID: " + str(previewids[f"{action}Id"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
@@ -210,14 +159,14 @@ class SecurityOrder:
                     print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
                     print(f"Error: {action_dict[action]} Order API service error")
         else:
             # Handle errors
-            data = response.json()
+            data = decode_response(response)
             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                 print("Error: " + data["Error"]["message"])
             else:
@@ -241,29 +190,7 @@ class SecurityOrder:
         headers = {"Content-Type": "application/xml", "consumerKey": etrade_config.CONSUMER_KEY}
 
         # Add payload for POST Request
-        payload = """<PreviewOrderRequest>
-                       <orderType>EQ</orderType>
-                       <clientOrderId>{0}</clientOrderId>
-                       <Order>
-                           <allOrNone>false</allOrNone>
-                           <priceType>{1}</priceType>
-                           <orderTerm>{2}</orderTerm>
-                           <marketSession>REGULAR</marketSession>
-                           <stopPrice></stopPrice>
-                           <limitPrice>{3}</limitPrice>
-                           <Instrument>
-                               <Product>
-                                   <securityType>EQ</securityType>
-                                   <symbol>{4}</symbol>
-                               </Product>
-                               <orderAction>{5}</orderAction>
-                               <quantityType>QUANTITY</quantityType>
-                               <quantity>{6}</quantity>
-                           </Instrument>
-                       </Order>
-                   </PreviewOrderRequest>"""
-        payload = payload.format(order["client_order_id"], order["price_type"], order["order_term"],
-                                 order["limit_price"], order["symbol"], order["order_action"], order["quantity"])
+        payload = order_payload(dict(order, security_type="EQ"))
 
         # Make API call for POST request
         response = self.session.post(url, header_auth=True, headers=headers, data=payload)
@@ -272,9 +199,8 @@ class SecurityOrder:
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
+            log_response(logger, response)
+            data = decode_response(response)
             print("\nPreview Order:")
 
             if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
@@ -282,7 +208,7 @@ class SecurityOrder:
                     print("Preview ID: " + str(previewids["previewId"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
@@ -318,14 +244,14 @@ class SecurityOrder:
                     print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
             else:
                 # Handle errors
-                data = response.json()
+                data = decode_response(response)
                 if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                     print("Error: " + data["Error"]["message"])
                 else:
                     print("Error: Preview Order API service error")
         else:
             # Handle errors
-            data = response.json()
+            data = decode_response(response)
             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                 print("Error: " + data["Error"]["message"])
             else:
@@ -364,40 +290,10 @@ class SecurityOrder:
                     # Add parameters and header information
                     headers = {"Content-Type": "application/xml", "consumerKey": etrade_config.CONSUMER_KEY}
 
-                    # Add payload for POST Request
-                    payload = """<PreviewOrderRequest>
-                                   <orderType>{0}</orderType>
-                                   <clientOrderId>{1}</clientOrderId>
-                                   <Order>
-                                       <allOrNone>false</allOrNone>
-                                       <priceType>{2}</priceType>  
-                                       <orderTerm>{3}</orderTerm>   
-                                       <marketSession>REGULAR</marketSession>
-                                       <stopPrice></stopPrice>
-                                       <limitPrice>{4}</limitPrice>
-                                       <Instrument>
-                                           <Product>
-                                               <securityType>{5}</securityType>
-                                               <symbol>{6}</symbol>
-                                           </Product>
-                                           <orderAction>{7}</orderAction> 
-                                           <quantityType>QUANTITY</quantityType>
-                                           <quantity>{8}</quantity>
-                                       </Instrument>
-                                   </Order>
-                               </PreviewOrderRequest>"""
 
                     options_select = int(options_select)
                     prev_orders[options_select - 1]["client_order_id"] = str(random.randint(1000000000, 9999999999))
-                    payload = payload.format(prev_orders[options_select - 1]["order_type"],
-                                             prev_orders[options_select - 1]["client_order_id"],
-                                             prev_orders[options_select - 1]["price_type"],
-                                             prev_orders[options_select - 1]["order_term"],
-                                             prev_orders[options_select - 1]["limitPrice"],
-                                             prev_orders[options_select - 1]["security_type"],
-                                             prev_orders[options_select - 1]["symbol"],
-                                             prev_orders[options_select - 1]["order_action"],
-                                             prev_orders[options_select - 1]["quantity"])
+                    payload = order_payload(prev_orders[options_select - 1])
 
                     # Make API call for POST request
                     response = session.post(url, header_auth=True, headers=headers, data=payload)
@@ -406,16 +302,15 @@ class SecurityOrder:
 
                     # Handle and parse response
                     if response is not None and response.status_code == 200:
-                        parsed = json.loads(response.text)
-                        logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                        data = response.json()
+                        log_response(logger, response)
+                        data = decode_response(response)
                         print("\nPreview Order: ")
                         if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
                             for previewids in data["PreviewOrderResponse"]["PreviewIds"]:
                                 print("Preview ID: " + str(previewids["previewId"]))
                         else:
                             # Handle errors
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
@@ -452,14 +347,14 @@ class SecurityOrder:
                                 print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
                         else:
                             # Handle errors
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
                                 print("Error: Preview Order API service error")
                     else:
                         # Handle errors
-                        data = response.json()
+                        data = decode_response(response)
                         if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                             print("Error: " + data["Error"]["message"])
                         else:
@@ -517,6 +412,9 @@ class SecurityOrder:
                                 if instrument is not None and 'Product' in instrument and 'symbol' in instrument["Product"]:
                                     order_str += "Symbol: " + instrument["Product"]["symbol"] + " | "
                                     order_obj["symbol"] = instrument["Product"]["symbol"]
+                                    for field in OPTION_FIELDS:
+                                        if field in instrument["Product"]:
+                                            order_obj[field] = instrument["Product"][field]
 
                                 if details is not None and 'priceType' in details:
                                     order_str += "Price Type: " + details["priceType"] + " | "
@@ -729,9 +627,8 @@ class SecurityOrder:
                         print("Unknown Option Selected!")
                 break
             elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
+                log_response(logger, response_open, label="%s")
+                data = decode_response(response_open)
 
                 order_list = []
                 count = 1
@@ -813,11 +710,7 @@ class SecurityOrder:
                         headers = {"Content-Type": "application/xml", "consumerKey": etrade_config.CONSUMER_KEY}
 
                         # Add payload for POST Request
-                        payload = """<CancelOrderRequest>
-                                        <orderId>{0}</orderId>
-                                    </CancelOrderRequest>
-                                   """
-                        payload = payload.format(order_list[int(selection) - 1])
+                        payload = encode_cancel(order_list[int(selection) - 1])
 
                         # Add payload for PUT Request
                         response = self.session.put(url, header_auth=True, headers=headers, data=payload)
@@ -826,9 +719,8 @@ class SecurityOrder:
 
                         # Handle and parse response
                         if response is not None and response.status_code == 200:
-                            parsed = json.loads(response.text)
-                            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                            data = response.json()
+                            log_response(logger, response)
+                            data = decode_response(response)
                             if data is not None and "CancelOrderResponse" in data \
                                     and "orderId" in data["CancelOrderResponse"]:
                                 print("\nOrder number #" + str(
@@ -837,7 +729,7 @@ class SecurityOrder:
                                 # Handle errors
                                 logger.debug("Response Headers: %s", response.headers)
                                 logger.debug("Response Body: %s", response.text)
-                                data = response.json()
+                                data = decode_response(response)
                                 if 'Error' in data and 'message' in data["Error"] \
                                         and data["Error"]["message"] is not None:
                                     print("Error: " + data["Error"]["message"])
@@ -847,7 +739,7 @@ class SecurityOrder:
                             # Handle errors
                             logger.debug("Response Headers: %s", response.headers)
                             logger.debug("Response Body: %s", response.text)
-                            data = response.json()
+                            data = decode_response(response)
                             if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
                                 print("Error: " + data["Error"]["message"])
                             else:
@@ -862,9 +754,9 @@ class SecurityOrder:
                     # Handle errors
                     logger.debug("Response Body: %s", response_open.text)
                     if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                            and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                            and response_open.json()["Error"]["message"] is not None:
-                        print("Error: " + response_open.json()["Error"]["message"])
+                            and "Error" in decode_response(response_open) and "message" in decode_response(response_open)["Error"] \
+                            and decode_response(response_open)["Error"]["message"] is not None:
+                        print("Error: " + decode_response(response_open)["Error"]["message"])
                     else:
                         print("Error: Balance API service error")
                     break
@@ -872,13 +764,21 @@ class SecurityOrder:
                 # Handle errors
                 logger.debug("Response Body: %s", response_open.text)
                 if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                        and response_open.json()["Error"]["message"] is not None:
-                    print("Error: " + response_open.json()["Error"]["message"])
+                        and "Error" in decode_response(response_open) and "message" in decode_response(response_open)["Error"] \
+                        and decode_response(response_open)["Error"]["message"] is not None:
+                    print("Error: " + decode_response(response_open)["Error"]["message"])
                 else:
                     print("Error: Balance API service error")
                 break
 
+    def order_book(self):
+        """
+        Non-interactive view of every order on the account, indexed by (orderId, status), see fetch_order_book
+        """
+        url = self.base_url + "/v1/accounts/" + self.account.accountIdKey + "/orders.json"
+        headers = {"consumerkey": etrade_config.CONSUMER_KEY}
+        return fetch_order_book(self.session, url, headers)
+
     def view_orders(self):
         """
         Calls orders API to provide the details for the orders
@@ -891,20 +791,15 @@ class SecurityOrder:
 
             # Add parameters and header information
             headers = {"consumerkey": etrade_config.CONSUMER_KEY}
-            params_open = {"status": "OPEN"}
-            params_executed = {"status": "EXECUTED"}
-            params_indiv_fills = {"status": "INDIVIDUAL_FILLS"}
-            params_cancelled = {"status": "CANCELLED"}
-            params_rejected = {"status": "REJECTED"}
-            params_expired = {"status": "EXPIRED"}
 
-            # Make API call for GET request
-            response_open = self.session.get(url, header_auth=True, params=params_open, headers=headers)
-            response_executed = self.session.get(url, header_auth=True, params=params_executed, headers=headers)
-            response_indiv_fills = self.session.get(url, header_auth=True, params=params_indiv_fills, headers=headers)
-            response_cancelled = self.session.get(url, header_auth=True, params=params_cancelled, headers=headers)
-            response_rejected = self.session.get(url, header_auth=True, params=params_rejected, headers=headers)
-            response_expired = self.session.get(url, header_auth=True, params=params_expired, headers=headers)
+            # Make API calls for GET request, all statuses in parallel
+            responses = fetch_order_statuses(self.session, url, headers)
+            response_open = responses["OPEN"]
+            response_executed = responses["EXECUTED"]
+            response_indiv_fills = responses["INDIVIDUAL_FILLS"]
+            response_cancelled = responses["CANCELLED"]
+            response_rejected = responses["REJECTED"]
+            response_expired = responses["EXPIRED"]
 
             prev_orders = []
 
@@ -918,9 +813,8 @@ class SecurityOrder:
                 logger.debug(response_open)
                 print("None")
             elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
+                log_response(logger, response_open, label="%s")
+                data = decode_response(response_open)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "open"))
@@ -936,9 +830,8 @@ class SecurityOrder:
                 logger.debug(response_executed)
                 print("None")
             elif response_executed.status_code == 200:
-                parsed = json.loads(response_executed.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_executed.json()
+                log_response(logger, response_executed, label="%s")
+                data = decode_response(response_executed)
 
                 # Display list of executed orders
                 prev_orders.extend(self.print_orders(data, "executed"))
@@ -953,9 +846,8 @@ class SecurityOrder:
                 logger.debug("Response Body: %s", response_indiv_fills)
                 print("None")
             elif response_indiv_fills.status_code == 200:
-                parsed = json.loads(response_indiv_fills.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_indiv_fills.json()
+                log_response(logger, response_indiv_fills)
+                data = decode_response(response_indiv_fills)
 
                 # Display list of individual fills orders
                 prev_orders.extend(self.print_orders(data, "indiv_fills"))
@@ -970,9 +862,8 @@ class SecurityOrder:
                 logger.debug(response_cancelled)
                 print("None")
             elif response_cancelled.status_code == 200:
-                parsed = json.loads(response_cancelled.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_cancelled.json()
+                log_response(logger, response_cancelled, label="%s")
+                data = decode_response(response_cancelled)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "cancelled"))
@@ -987,9 +878,8 @@ class SecurityOrder:
                 logger.debug(response_rejected)
                 print("None")
             elif response_rejected.status_code == 200:
-                parsed = json.loads(response_rejected.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_rejected.json()
+                log_response(logger, response_rejected, label="%s")
+                data = decode_response(response_rejected)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "rejected"))
@@ -1001,9 +891,8 @@ class SecurityOrder:
                 logger.debug(response_executed)
                 print("None")
             elif response_expired.status_code == 200:
-                parsed = json.loads(response_expired.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_expired.json()
+                log_response(logger, response_expired, label="%s")
+                data = decode_response(response_expired)
 
                 # Display list of open orders
                 prev_orders.extend(self.print_orders(data, "expired"))
@@ -1055,19 +944,15 @@ def get_request_result(req: OAuth1Session.request, empty_json: dict, resp_format
     LOGGER.debug(req.text)
 
     if resp_format == "json":
-        if req.text.strip() == "":
-            # otherwise, when ETrade server return empty string, we got this error:
-            # simplejson.errors.JSONDecodeError: Expecting value: line 1 column 1 (char 0)
-            req_output = empty_json  # empty json object
-        else:
-            req_output = req.json()
+        # when ETrade server returns an empty string decode_response falls back to empty_json
+        req_output = decode_response(req, empty=empty_json)
     else:
         xmlstr = req.text
         # import xml.etree.ElementTree as ET
         # xml_data = ET.parse(req.text).getroot()
         # xmlstr = ET.tostring(xml_data, encoding='utf-8', method='xml')
 
-        req_output = xmltodict.parse(xmlstr)
+        req_output = xml_to_dict(xmlstr)
 
     if 'Error' in req_output.keys():
         raise Exception(f'Etrade API Error - Code: {req_output["Error"]["code"]}, Msg: {req_output["Error"]["message"]}')
@@ -1077,19 +962,8 @@ def get_request_result(req: OAuth1Session.request, empty_json: dict, resp_format
 
 # return Etrade internal option symbol: e.g. "PLTR--220218P00023000" ref:_test_option_symbol()
 def option_symbol(symbol: str, call_put: str, expiry_date: datetime, strike_price: float) -> str:
-    sym = symbol.strip().upper()
-    symstr = sym + ("-" * (6 - len(sym)))
-
-    edstr = expiry_date.strftime("%y%m%d")
-    assert (len(edstr) == 6)
-
-    sp = "%08d" % (float(strike_price) * 1000)
-    assert (len(sp) == 8)
-
-    opt_sym = symstr + edstr + call_put.strip().upper()[0] + sp
-    assert (len(opt_sym) == 21)
-
-    return opt_sym
+    return OptionContract(symbol.strip().upper(), expiry_date.date() if isinstance(expiry_date, datetime) else expiry_date,
+                          call_put.strip().upper(), float(strike_price)).occ(pad="-")
 
 
 class OrderException(Exception):
@@ -1263,13 +1137,12 @@ class ETradeOrder:
         ):
             raise OrderException
 
-    def parse_options_order(self, security_holding: SecurityHolding):
-        sym, m, d, y, p, t = security_holding.sym.split(" ")
-        combined = "-".join([m, d, y.strip("'")])
-        dto = datetime.strptime(combined, "%b-%d-%y")
-        price = p.strip("$")
+    @staticmethod
+    def parse_options_order(security_holding: SecurityHolding):
+        contract = parse_option(security_holding.sym)
+        dto = contract.expiry_datetime()
 
-        order = {"symbol": sym,
+        order = {"symbol": contract.underlying,
                  "security_type": "OPTN",
                  "price_type": "MARKET",
                  "order_term": "GOOD_FOR_DAY",
@@ -1277,15 +1150,16 @@ class ETradeOrder:
                  "expiryDay": dto.day,
                  "expiryMonth": dto.month,
                  "expiryYear": dto.year,
-                 "callPut": t,
-                 "strikePrice": price,
+                 "callPut": contract.call_put.capitalize(),
+                 "strikePrice": f"{contract.strike:g}",
                  "limit_price": None,
                  "datetime_object": dto,
                  "quantity": security_holding._can_sell(),
                  }
         return order
 
-    def parse_equity_order(self, security_holding: SecurityHolding):
+    @staticmethod
+    def parse_equity_order(security_holding: SecurityHolding):
         order = {"symbol": security_holding.sym,
                  "security_type": "EQ",
                  "price_type": "MARKET",
@@ -1296,10 +1170,11 @@ class ETradeOrder:
                  }
         return order
 
-    def parse_order(self, security_holding: SecurityHolding):
-        if CALL in security_holding.sym or PUT in security_holding.sym:
-            return self.parse_options_order(security_holding)
-        return self.parse_equity_order(security_holding)
+    @staticmethod
+    def parse_order(security_holding: SecurityHolding):
+        if parse_option(security_holding.sym) is not None:
+            return ETradeOrder.parse_options_order(security_holding)
+        return ETradeOrder.parse_equity_order(security_holding)
 
     def build_order_payload(self, order_type: str, **kwargs) -> dict:
         """:description: Builds the POST payload of a preview or place order
@@ -1462,7 +1337,7 @@ class ETradeOrder:
     #
     #     return payload
 
-    def perform_request(self, method, api_url: str, payload: Union[dict, str], resp_format: str = "xml") -> dict:
+    def perform_request(self, method, api_url: str, payload: Union[dict, str], resp_format: str = "xml") -> Union[dict, OrderResponse]:
         """:description: POST or PUT request with json or xml used by preview, place and cancel
            :param method: PUT or POST method
            :type method: session, required
@@ -1473,7 +1348,7 @@ class ETradeOrder:
            :param payload: Payload
            :type  payload: json/dict or str xml, required
            :return: Return request
-           :rtype: xml or json based on ``resp_format``
+           :rtype: :class:`OrderResponse` for xml, dict for json
            :EtradeRef: https://apisb.etrade.com/docs/api/order/api-order-v1.html
         """
 
@@ -1482,16 +1357,21 @@ class ETradeOrder:
 
         if resp_format == "json":
             req = method(api_url, json=payload, timeout=self.timeout)
-        else:
-            headers = {"Content-Type": "application/xml"}
-            payload = emit_xml(payload)
-            LOGGER.debug("xml payload: %s", payload)
-            # print("api url:", api_url)
-            req = method(api_url, data=payload, headers=headers, timeout=self.timeout)
+            return get_request_result(req, {}, resp_format)
 
-        return get_request_result(req, {}, resp_format)
+        headers = {"Content-Type": "application/xml"}
+        payload = payload if isinstance(payload, str) else encode_payload(payload)
+        LOGGER.debug("xml payload: %s", payload)
+        # print("api url:", api_url)
+        req = method(api_url, data=payload, headers=headers, timeout=self.timeout)
+        LOGGER.debug(req.text)
 
-    def preview_equity_order(self, **kwargs) -> dict:
+        result = decode_order_response(req.text)
+        if not result.ok:
+            raise Exception(f'Etrade API Error - Code: {result.error_code}, Msg: {result.error_message}')
+        return result
+
+    def preview_equity_order(self, **kwargs) -> OrderResponse:
         """API is used to submit an order request for preview before placing it
            :param accountIdKey: AccountIDkey retrived from :class:`list_accounts` :type  accountIdKey: str, required
            :param symbol: Market symbol for the security being bought or sold :type  symbol: str, required
@@ -1584,7 +1464,7 @@ class ETradeOrder:
            :param symbol: The market symbol for the underlier
            :type  symbol: str
            :return: Confirmation of the Preview Equity Order
-           :rtype: ``xml`` or ``json`` based on ``resp_format``
+           :rtype: :class:`OrderResponse`
            :EtradeRef: https://apisb.etrade.com/docs/api/order/api-order-v1.html
         """
         LOGGER.debug(kwargs)
@@ -1623,7 +1503,7 @@ class ETradeOrder:
 
         return self.perform_request(self.session.put, api_url, payload, "xml")
 
-    def place_option_order(self, **kwargs) -> dict:
+    def place_option_order(self, **kwargs) -> OrderResponse:
         """:description: Places Option Order, only single leg CALL or PUT is supported for now
            :return: Returns confirmation of the equity order
         """
@@ -1631,12 +1511,12 @@ class ETradeOrder:
 
         return self.place_equity_order(**kwargs)
 
-    def place_equity_order(self, **kwargs) -> dict:
+    def place_equity_order(self, **kwargs) -> OrderResponse:
         """:description: Places Equity Order
            :param kwargs: Parameters for api, refer :class:`preview_equity_order`
            :type  kwargs: ``**kwargs``, required
            :return: Returns confirmation of the equity order
-           :rtype: xml or json based on ``resp_format``
+           :rtype: :class:`OrderResponse`
            :EtradeRef: https://apisb.etrade.com/docs/api/order/api-order-v1.html
         """
 
@@ -1653,7 +1533,7 @@ class ETradeOrder:
             preview = self.preview_equity_order(**kwargs)
             print("this is preview:", preview
                   )
-            kwargs["previewId"] = preview["PreviewOrderResponse"]["PreviewIds"]["previewId"]
+            kwargs["previewId"] = preview.preview_id
 
             LOGGER.debug("Got a successful preview with previewId: %s", kwargs["previewId"])
             print("Got a successful preview with previewId: %s", kwargs["previewId"])
@@ -1665,7 +1545,7 @@ class ETradeOrder:
 
         return self.perform_request(self.session.post, api_url, payload, "xml")
 
-    def place_changed_option_order(self, **kwargs) -> dict:
+    def place_changed_option_order(self, **kwargs) -> OrderResponse:
         """:description: Places Option Order, only single leg CALL or PUT is supported for now
            :return: Returns confirmation of the equity order
         """
@@ -1673,13 +1553,13 @@ class ETradeOrder:
 
         return self.place_changed_equity_order(**kwargs)
 
-    def place_changed_equity_order(self, **kwargs) -> dict:
+    def place_changed_equity_order(self, **kwargs) -> OrderResponse:
         """:description: Places changes to equity orders
             NOTE: the ETrade server will actually cancel the old orderId, and create a new orderId
            :param kwargs: Parameters for api, refer :class:`change_preview_equity_order`
            :type  kwargs: ``**kwargs``, required
            :return: Returns confirmation similar to :class:`preview_equity_order`
-           :rtype: xml or json based on ``resp_format``
+           :rtype: :class:`OrderResponse`
            :EtradeRef: https://apisb.etrade.com/docs/api/order/api-order-v1.html
         """
 
@@ -1695,11 +1575,11 @@ class ETradeOrder:
             )
             preview = self.preview_equity_order(**kwargs)
 
-            if "Error" in preview:
+            if not preview.ok:
                 LOGGER.error(preview)
                 raise Exception("Please check your order!")
 
-            kwargs["previewId"] = preview["PreviewOrderResponse"]["PreviewIds"]["previewId"]
+            kwargs["previewId"] = preview.preview_id
             LOGGER.debug("Got a successful preview with previewId: %s", kwargs["previewId"])
 
         api_url = f'{self.base_url}/{self.account_id_key}/orders/{kwargs["orderId"]}/change/place'
@@ -1709,7 +1589,7 @@ class ETradeOrder:
 
         return self.perform_request(self.session.put, api_url, payload, "xml")
 
-    def cancel_order(self, order_num: int, resp_format: str = "xml") -> dict:
+    def cancel_order(self, order_num: int, resp_format: str = "xml") -> Union[dict, OrderResponse]:
         """:description: Cancels a specific order for a given account
            :param account_id_key: AccountIDkey retrived from
                               :class:`pyetrade.accounts.ETradeAccounts.list_accounts`
@@ -4,8 +4,17 @@
 # Created Date: 20/05/2023
 # Email       : kori.s.vernon@gmail.com
 # ---------------------------------------------------------------------------
+RETAIN_JSON = False # keep the raw API dict on every Position, for debugging
+
 class Position:
-    def __init__(self, symbolDescription, quantity, lastTrade, pricePaid, totalGain, marketValue, pctOfPortfolio, json):
+    __slots__ = ("sym", "qty", "last_trade", "px_paid", "total_gain", "market_value", "pct_portfolio", "json")
+
+    def __init__(self, symbolDescription, quantity, lastTrade, pricePaid, totalGain, marketValue, pctOfPortfolio, json=None,
+                 retain=None):
+        """
+        :param json: raw API dict, only kept when retention is requested
+        :param retain: keep json on the Position, defaults to RETAIN_JSON
+        """
         self.sym = symbolDescription
         self.qty = quantity
         self.last_trade = lastTrade
@@ -13,22 +22,26 @@ class Position:
         self.total_gain = totalGain
         self.market_value = marketValue
         self.pct_portfolio = pctOfPortfolio
-        self.json = json
+        self.json = json if (RETAIN_JSON if retain is None else retain) else None
+
+    def fields(self):
+        """Compact identity of the position, used instead of the raw dict for change detection"""
+        return self.sym, self.qty, self.last_trade, self.px_paid, self.total_gain, self.market_value, self.pct_portfolio
 
     def __str__(self):
         ret_str = f"Position: {self.sym}; Qty: {self.qty}; Last Trade: {self.px_paid}; Total Gain: {self.total_gain}; Market Value: {self.market_value}; Percentage of Portfolio; {self.pct_portfolio}"
         return ret_str
     
     def __repr__(self):
-        return str(self.json)
+        return str(self.json) if self.json is not None else str(self)
     
-def PositionsParser(portfolioPositionResponse):
+def PositionsParser(portfolioPositionResponse, retain=None):
     positions = portfolioPositionResponse["PortfolioResponse"]["AccountPortfolio"]
 
     pos = []
     for acctPortfolio in positions:
         if acctPortfolio is not None and "Position" in acctPortfolio:
             for position in acctPortfolio["Position"]:
-                p = Position(symbolDescription= position["symbolDescription"], quantity=position["quantity"], lastTrade=position["Quick"]["lastTrade"], pricePaid=position["pricePaid"], totalGain=position["totalGain"], marketValue=position["marketValue"], pctOfPortfolio=position["pctOfPortfolio"],json = position)
+                p = Position(symbolDescription= position["symbolDescription"], quantity=position["quantity"], lastTrade=position["Quick"]["lastTrade"], pricePaid=position["pricePaid"], totalGain=position["totalGain"], marketValue=position["marketValue"], pctOfPortfolio=position["pctOfPortfolio"],json = position, retain=retain)
                 pos.append(p)
     return pos
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import yfinance as yf
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+from rate_limiter.rate_limiter import call_with_retry, YFINANCE
+
+DEFAULT_TTL = 15 # seconds a spot price is considered fresh
+MAX_ENTRIES = 2048
+
+
+def _yahoo_last_price(symbol):
+    return yf.Ticker(symbol).fast_info['lastPrice']
+
+
+def yahoo_last_price(symbol):
+    return call_with_retry(_yahoo_last_price, symbol, limiter=YFINANCE)
+
+
+class _Flight:
+    """An in-progress fetch that other callers for the same symbol wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QuoteCache:
+    def __init__(self, fetch=yahoo_last_price, ttl=DEFAULT_TTL, maxsize=MAX_ENTRIES):
+        """
+        Thread-safe spot price cache with per-symbol TTL, LRU eviction and single-flight misses:
+        concurrent lookups of the same missing symbol share one upstream fetch.
+
+        :param fetch: callable(symbol) -> last price
+        :param ttl: default seconds before an entry is refetched
+        :param maxsize: maximum number of cached symbols
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict() # symbol -> (expires_at, price)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol, ttl=None):
+        symbol = symbol.strip().upper()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(symbol)
+                self.hits += 1
+                return entry[1]
+            flight = self._flights.get(symbol)
+            leader = flight is None
+            if leader:
+                flight = self._flights[symbol] = _Flight()
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self.fetch(symbol)
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            self.put(symbol, flight.value, ttl)
+        finally:
+            with self._lock:
+                self._flights.pop(symbol, None)
+            flight.done.set()
+        return flight.value
+
+    def put(self, symbol, price, ttl=None):
+        """
+        Store a price fetched elsewhere, e.g. from Market.get_quotes
+        """
+        symbol = symbol.strip().upper()
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[symbol] = (expires_at, price)
+            self._entries.move_to_end(symbol)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol.strip().upper(), None)
+
+
+# process-wide cache used for every spot lookup
+QUOTE_CACHE = QuoteCache()
+
+
+def get_last_price(symbol, ttl=None):
+    return QUOTE_CACHE.get(symbol, ttl)
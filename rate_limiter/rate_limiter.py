@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# logger settings
+logger = logging.getLogger('my_logger')
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+MAX_RETRIES = 4
+BASE_DELAY = 0.5 # seconds, first backoff ceiling
+MAX_DELAY = 30 # seconds, largest backoff ceiling
+MAX_WAIT = 60 # seconds a request may queue for a token before it is rejected
+
+ETRADE_MARKET = "etrade_market"
+ETRADE_ACCOUNTS = "etrade_accounts"
+ETRADE_ORDERS = "etrade_orders"
+YFINANCE = "yfinance"
+
+
+class RateLimitRejected(RuntimeError):
+    """The wait for a token would exceed the bucket's max_wait"""
+
+
+class TokenBucket:
+    def __init__(self, name, rate, capacity=None, min_rate=None, max_wait=MAX_WAIT):
+        """
+        Adaptive token bucket. The refill rate is halved whenever the upstream throttles (penalize)
+        and creeps back toward the configured rate on every success (reward).
+
+        :param rate: sustained requests per second
+        :param capacity: burst size, defaults to rate
+        :param min_rate: floor the rate never drops below
+        :param max_wait: seconds call_with_retry queues for a token before rejecting the call, None waits indefinitely
+        """
+        self.name = name
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else rate)
+        self.min_rate = float(min_rate if min_rate else rate / 8)
+        self.max_wait = max_wait
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = 0
+        self.retried = 0
+        self.throttled = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, deadline, queued):
+        """
+        Take one token if one is available
+
+        :return: 0 when a token was taken, seconds to wait before trying again, or None when that wait
+                 would pass deadline
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.acquired += 1
+                return 0
+            wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                self.rejected += 1
+                return None
+            if not queued:
+                self.queued += 1
+            return wait
+
+    def acquire(self, timeout=None) -> bool:
+        """
+        Take one token, waiting for the bucket to refill when empty
+
+        :param timeout: seconds to wait at most, None waits indefinitely
+        :return: False when the request was rejected because the wait would exceed timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = self._reserve(deadline, False)
+        while wait:
+            time.sleep(wait)
+            wait = self._reserve(deadline, True)
+        return wait is not None
+
+    async def acquire_async(self, timeout=None) -> bool:
+        """
+        acquire for coroutines: waits on the event loop instead of blocking the thread
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = self._reserve(deadline, False)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._reserve(deadline, True)
+        return wait is not None
+
+    def penalize(self):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def record_retry(self):
+        with self._lock:
+            self.retried += 1
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"rate": self.rate, "acquired": self.acquired, "queued": self.queued,
+                    "rejected": self.rejected, "retried": self.retried, "throttled": self.throttled}
+
+
+# separate budget per upstream
+LIMITERS = {
+    ETRADE_MARKET: TokenBucket(ETRADE_MARKET, rate=4),
+    ETRADE_ACCOUNTS: TokenBucket(ETRADE_ACCOUNTS, rate=4),
+    ETRADE_ORDERS: TokenBucket(ETRADE_ORDERS, rate=2),
+    YFINANCE: TokenBucket(YFINANCE, rate=5, capacity=10),
+}
+
+
+_bypass = threading.Event() # set while a cassette replays, see bypass_limiters
+
+
+def bypass_limiters(enabled=True):
+    """Skip every limiter budget, e.g. while a Cassette replays recorded responses"""
+    if enabled:
+        _bypass.set()
+    else:
+        _bypass.clear()
+
+
+def limiter_metrics() -> dict:
+    return {name: limiter.metrics() for name, limiter in LIMITERS.items()}
+
+
+def is_rate_limited(error) -> bool:
+    """True for exceptions that signal upstream throttling, e.g. yfinance's YFRateLimitError or an HTTP 429"""
+    if "RateLimit" in type(error).__name__ or "Too Many Requests" in str(error):
+        return True
+    return getattr(getattr(error, "response", None), "status_code", None) == 429
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def _settle(bucket, result, retry_status):
+    """Penalize the bucket for a 429 response, reward it for any other final response"""
+    status = getattr(result, "status_code", None)
+    if bucket is not None and status == 429:
+        bucket.penalize()
+    elif bucket is not None and status not in retry_status:
+        bucket.reward()
+    return status
+
+
+def call_with_retry(fn, *args, limiter=None, retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                    retry_on=(Exception,), retry_status=RETRY_STATUS, **kwargs):
+    """
+    Call fn under a limiter's budget, retrying with jittered exponential backoff when it raises
+    one of retry_on or returns a response whose status_code is in retry_status. A 429 response or
+    a rate-limit exception (see is_rate_limited) slows the limiter down.
+
+    :param limiter: LIMITERS key, or None to only retry; ignored while bypass_limiters is on
+    :raises RateLimitRejected: when the limiter's queue is longer than its max_wait
+    """
+    bucket = None if _bypass.is_set() else LIMITERS.get(limiter)
+    attempt = 0
+    while True:
+        if bucket is not None and not bucket.acquire(bucket.max_wait):
+            raise RateLimitRejected(f"{bucket.name}: no token within {bucket.max_wait}s")
+        try:
+            result = fn(*args, **kwargs)
+        except retry_on as e:
+            if bucket is not None and is_rate_limited(e):
+                bucket.penalize()
+            if attempt >= retries:
+                raise
+            logger.debug("%s failed with %s, retry %s/%s", getattr(fn, "__name__", fn), e, attempt + 1, retries)
+        else:
+            status = _settle(bucket, result, retry_status)
+            if status not in retry_status or attempt >= retries:
+                return result
+            logger.debug("%s returned %s, retry %s/%s", getattr(fn, "__name__", fn), status, attempt + 1, retries)
+        if bucket is not None:
+            bucket.record_retry()
+        time.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+
+async def async_call_with_retry(fn, *args, limiter=None, retries=MAX_RETRIES, base_delay=BASE_DELAY,
+                                max_delay=MAX_DELAY, retry_on=(Exception,), retry_status=RETRY_STATUS, **kwargs):
+    """
+    call_with_retry for a coroutine function: token waits and backoff sleep on the event loop,
+    against the same LIMITERS budgets as the blocking callers
+    """
+    bucket = None if _bypass.is_set() else LIMITERS.get(limiter)
+    attempt = 0
+    while True:
+        if bucket is not None and not await bucket.acquire_async(bucket.max_wait):
+            raise RateLimitRejected(f"{bucket.name}: no token within {bucket.max_wait}s")
+        try:
+            result = await fn(*args, **kwargs)
+        except retry_on as e:
+            if bucket is not None and is_rate_limited(e):
+                bucket.penalize()
+            if attempt >= retries:
+                raise
+            logger.debug("%s failed with %s, retry %s/%s", getattr(fn, "__name__", fn), e, attempt + 1, retries)
+        else:
+            status = _settle(bucket, result, retry_status)
+            if status not in retry_status or attempt >= retries:
+                return result
+            logger.debug("%s returned %s, retry %s/%s", getattr(fn, "__name__", fn), status, attempt + 1, retries)
+        if bucket is not None:
+            bucket.record_retry()
+        await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+
+def etrade_limiter(url):
+    path = urlsplit(url).path
+    if path.startswith("/v1/market"):
+        return ETRADE_MARKET
+    if "/orders" in path:
+        return ETRADE_ORDERS
+    return ETRADE_ACCOUNTS
+
+
+class RateLimitedSession:
+    def __init__(self, session):
+        """
+        Wraps the rauth OAuth1Session so every E*TRADE call is throttled by its endpoint's budget
+        and retried on 429/5xx. Other attributes pass through to the wrapped session.
+        """
+        self.session = session
+
+    def __getattr__(self, item):
+        return getattr(self.session, item)
+
+    def get(self, url, *args, **kwargs):
+        return call_with_retry(self.session.get, url, *args, limiter=etrade_limiter(url), **kwargs)
+
+    def post(self, url, *args, **kwargs):
+        # orders are not idempotent; only a 429 (request never processed) is safe to retry
+        return call_with_retry(self.session.post, url, *args, limiter=etrade_limiter(url), retry_on=(),
+                               retry_status=(429,), **kwargs)
+
+    def put(self, url, *args, **kwargs):
+        return call_with_retry(self.session.put, url, *args, limiter=etrade_limiter(url), retry_on=(),
+                               retry_status=(429,), **kwargs)
@@ -11,6 +11,16 @@ echo "PROD_BASE_URL = 'https://api.etrade.com'" >> etrade_config.py
 echo "OPENAIKEY = 'OPENAIKEY' #THIS IS FOR CHAT GPT INTEGRATION" >> etrade_config.py
 echo "PERIGON_API_KEY = 'PERIGONKEY' #THIS IS FOR PERIGON SENTIMENT ANALYSIS" >> etrade_config.py
 echo "receiver_email = ['your.email@website.com','another.email.if.you.want@gmail.com']" >> etrade_config.py
+# optional: seconds between token renewals and account reloads, reloads only inside ((9,30),(16,0)) when set
+echo "TOKEN_RENEW_SECONDS = 1800" >> etrade_config.py
+echo "ACCOUNT_REFRESH_SECONDS = 900" >> etrade_config.py
+echo "ACCOUNT_REFRESH_MARKET_HOURS = None" >> etrade_config.py
+# optional: % account value move that publishes a BalanceMoved event
+echo "BALANCE_MOVE_PCT = 2.0" >> etrade_config.py
+# optional: keep the raw API dict on every position and transaction (debugging, uses more memory)
+echo "RETAIN_RAW_JSON = False" >> etrade_config.py
+# optional: keep the transaction ledger and balance snapshots on disk under data/ between runs
+echo "PERSIST_ACCOUNT_DATA = False" >> etrade_config.py
 echo "Setup of etrade config is complete!"
 echo "Removing setup etrade config file!"
 rm -f setup_etrade_config.sh
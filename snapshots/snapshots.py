@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = script_path + '/../data'
+SNAPSHOT_PATH = os.path.join(DATA_PATH, 'snapshots.db')
+
+
+def _epoch_ms(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+class SnapshotStore:
+    def __init__(self, path=SNAPSHOT_PATH):
+        """
+        Append-only history of account balances and positions, one row per refresh
+
+        :param path: sqlite database file, ':memory:' for a throwaway store
+        """
+        self.path = path
+        if path != ':memory:' and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS balances (
+                ts INTEGER NOT NULL,
+                account_id TEXT NOT NULL,
+                account_value REAL,
+                buying_power REAL,
+                PRIMARY KEY (account_id, ts));
+            CREATE INDEX IF NOT EXISTS balances_ts ON balances (ts);
+            CREATE TABLE IF NOT EXISTS positions (
+                ts INTEGER NOT NULL,
+                account_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                quantity REAL,
+                last_trade REAL,
+                price_paid REAL,
+                market_value REAL,
+                total_gain REAL,
+                pct_portfolio REAL,
+                PRIMARY KEY (account_id, symbol, ts));
+            CREATE INDEX IF NOT EXISTS positions_symbol_ts ON positions (symbol, ts);
+            CREATE INDEX IF NOT EXISTS positions_ts ON positions (ts);""")
+        self._conn.commit()
+
+    def append(self, accounts, ts=None, skip=()):
+        """
+        Store the current balances and positions of an Accounts object
+
+        :param ts: snapshot time, datetime or epoch ms, defaults to now
+        :param skip: accountIds left out of this snapshot, e.g. accounts whose fetch failed
+        :return: the snapshot time in epoch ms
+        """
+        ts = _epoch_ms(ts) if ts is not None else int(time.time() * 1000)
+        stored = [acc for acc in accounts.accounts if acc.accountId not in skip]
+        balances = [(ts, str(acc.accountId), acc.account_value, acc.buying_power) for acc in stored]
+        positions = [(ts, str(acc.accountId), pos.sym, pos.qty, pos.last_trade, pos.px_paid, pos.market_value,
+                      pos.total_gain, pos.pct_portfolio)
+                     for acc in stored for pos in accounts.accounts_positions.get(acc.accountId, [])]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO balances VALUES (?, ?, ?, ?)", balances)
+            self._conn.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", positions)
+            self._conn.commit()
+        return ts
+
+    def _query(self, sql, params):
+        with self._lock:
+            frame = pd.read_sql_query(sql, self._conn, params=params)
+        frame["ts"] = pd.to_datetime(frame["ts"], unit="ms")
+        return frame
+
+    @staticmethod
+    def _where(start, end, account_id=None, symbol=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(_epoch_ms(start))
+        if end is not None:
+            clauses.append("ts <= ?")
+            params.append(_epoch_ms(end))
+        if account_id is not None:
+            clauses.append("account_id = ?")
+            params.append(str(account_id))
+        if symbol is not None:
+            clauses.append("symbol = ?")
+            params.append(symbol)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def account_values(self, start=None, end=None, account_id=None) -> pd.DataFrame:
+        """
+        :return: account_value per snapshot, one column per account
+        """
+        where, params = self._where(start, end, account_id)
+        frame = self._query(f"SELECT ts, account_id, account_value FROM balances{where} ORDER BY ts", params)
+        return frame.pivot(index="ts", columns="account_id", values="account_value")
+
+    def portfolio_value(self, start=None, end=None, carry_forward=True) -> pd.Series:
+        """
+        Total value of all accounts per snapshot. A snapshot that skipped an account (failed fetch) would
+        otherwise show a false drop, so the account's last stored value is used instead.
+
+        :param carry_forward: False to return NaN for snapshots missing an account seen earlier
+        """
+        values = self.account_values(end=end)
+        if carry_forward:
+            values = values.ffill()
+            total = values.sum(axis=1)
+        else:
+            seen = values.notna().cummax()
+            total = values.sum(axis=1).where(~(seen & values.isna()).any(axis=1))
+        if start is not None:
+            total = total[total.index >= pd.to_datetime(_epoch_ms(start), unit="ms")]
+        return total.rename("value")
+
+    def pnl(self, start=None, end=None, account_id=None) -> pd.DataFrame:
+        """
+        :return: market value and total gain of all positions per snapshot
+        """
+        where, params = self._where(start, end, account_id)
+        return self._query(f"SELECT ts, SUM(market_value) AS market_value, SUM(total_gain) AS total_gain "
+                           f"FROM positions{where} GROUP BY ts ORDER BY ts", params).set_index("ts")
+
+    def position_history(self, symbol, start=None, end=None, account_id=None) -> pd.DataFrame:
+        """
+        :return: quantity, price, value and gain of one symbol per snapshot, summed over accounts
+        """
+        where, params = self._where(start, end, account_id, symbol)
+        return self._query(f"SELECT ts, SUM(quantity) AS quantity, MAX(last_trade) AS last_trade, "
+                           f"SUM(market_value) AS market_value, SUM(total_gain) AS total_gain "
+                           f"FROM positions{where} GROUP BY ts ORDER BY ts", params).set_index("ts")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
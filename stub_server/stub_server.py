@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+"""
+Local stand-in for the E*TRADE REST API used to benchmark and load-test the refresh and order paths.
+
+    python stub_server/stub_server.py --port 8080 --accounts 50 --positions 500 --latency 0.05 --error-rate 0.01
+
+then point Accounts/Market/Order at base_url http://127.0.0.1:8080 with dummy_session().
+Any OAuth header is accepted.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+DEFAULT_PORT = 8080
+TRANSACTION_PAGE_SIZE = 50
+ORDER_PAGE_SIZE = 100
+ERROR_STATUS = (429, 500, 503)
+ORDER_STATUSES = ["OPEN", "EXECUTED", "INDIVIDUAL_FILLS", "CANCELLED", "REJECTED", "EXPIRED"]
+OPTION_SHARE = 0.2 # share of generated positions that are options
+
+
+def to_xml(tag, value):
+    if isinstance(value, list):
+        return "".join(to_xml(tag, item) for item in value)
+    if isinstance(value, dict):
+        inner = "".join(to_xml(key, item) for key, item in value.items())
+    elif isinstance(value, bool):
+        inner = str(value).lower()
+    else:
+        inner = escape(str(value))
+    return f"<{tag}>{inner}</{tag}>"
+
+
+def _field(body, name):
+    """First value of a tag in an XML or JSON order payload"""
+    match = re.search(rf"<{name}>([^<]*)</{name}>", body) or re.search(rf'"{name}"\s*:\s*"?([^",}}]*)', body)
+    return match.group(1).strip() if match else None
+
+
+class Fixtures:
+    def __init__(self, accounts=2, positions=20, transactions=100, orders=10, seed=0, fixture_dir=None):
+        """
+        Generated account data, optionally overridden by recorded responses
+
+        :param accounts: number of accounts
+        :param positions: positions per account
+        :param transactions: transactions per account
+        :param orders: orders per account and status
+        :param fixture_dir: directory of recorded responses laid out like the API paths,
+                            e.g. <dir>/v1/accounts/list.json, served instead of generated data when present
+        """
+        self.rng = random.Random(seed)
+        self.fixture_dir = fixture_dir
+        self.accounts = []
+        self.balances = {}
+        self.positions = {}
+        self.transactions = {}
+        self.orders = {}
+        self.client_order_ids = {}
+        self._next_id = 1000
+        self._lock = threading.Lock()
+        now = datetime.now()
+        for a in range(accounts):
+            key = f"KEY{a:05d}"
+            self.accounts.append({"accountId": str(80000000 + a), "accountIdKey": key, "accountMode": "MARGIN",
+                                  "accountDesc": f"Stub {a}", "accountName": f"stub{a}", "accountType": "INDIVIDUAL",
+                                  "institutionType": "BROKERAGE", "accountStatus": "ACTIVE"})
+            self.positions[key] = [self._position(p, positions) for p in range(positions)]
+            self.transactions[key] = sorted((self._transaction(self.positions[key], now) for _ in range(transactions)),
+                                            key=lambda tx: tx["transactionDate"], reverse=True)
+            value = sum(pos["marketValue"] for pos in self.positions[key])
+            self.balances[key] = {"BalanceResponse": {"accountId": str(80000000 + a), "accountType": "INDIVIDUAL",
+                                                      "Computed": {"cashBuyingPower": round(self.rng.uniform(0, 1e5), 2),
+                                                                   "RealTimeValues": {"totalAccountValue": round(value, 2)}}}}
+            self.orders[key] = {status: [self._order(self.positions[key], status) for _ in range(orders)]
+                                for status in ORDER_STATUSES}
+
+    def _id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _position(self, i, total):
+        price = round(self.rng.uniform(5, 500), 2)
+        paid = round(price * self.rng.uniform(0.7, 1.3), 2)
+        quantity = self.rng.randint(1, 500)
+        if self.rng.random() < OPTION_SHARE:
+            expiry = datetime.now() + timedelta(days=self.rng.randint(1, 365))
+            strike = round(price * self.rng.uniform(0.8, 1.2))
+            call_put = self.rng.choice(["Call", "Put"])
+            description = f"SYM{i:04d} {expiry.strftime('%b %d')} '{expiry.strftime('%y')} ${strike} {call_put}"
+            symbol, security_type, multiplier = f"SYM{i:04d}", "OPTN", 100
+        else:
+            description = symbol = f"SYM{i:04d}"
+            security_type, multiplier = "EQ", 1
+        market_value = round(price * quantity * multiplier, 2)
+        return {"positionId": i, "symbolDescription": description, "quantity": quantity, "positionType": "LONG",
+                "pricePaid": paid, "totalGain": round((price - paid) * quantity * multiplier, 2),
+                "marketValue": market_value, "pctOfPortfolio": round(100 / max(total, 1), 4),
+                "Product": {"symbol": symbol, "securityType": security_type},
+                "Quick": {"lastTrade": price, "change": 0, "changePct": 0, "volume": self.rng.randint(0, 10 ** 6)}}
+
+    def _transaction(self, positions, now):
+        position = self.rng.choice(positions) if positions else None
+        when = now - timedelta(days=self.rng.randint(0, 120), seconds=self.rng.randint(0, 86400))
+        quantity = self.rng.randint(1, 100)
+        price = position["Quick"]["lastTrade"] if position else 1
+        return {"transactionId": str(self._id()), "transactionDate": int(when.timestamp() * 1000),
+                "amount": -round(price * quantity, 2), "description": "BOUGHT", "transactionType": "Bought",
+                "brokerage": {"displaySymbol": position["symbolDescription"] if position else "",
+                              "product": dict(position["Product"]) if position else {},
+                              "quantity": quantity, "price": price}}
+
+    def _order(self, positions, status, symbol=None, security_type="EQ", action="BUY", quantity=1, price_type="MARKET",
+               client_order_id=None):
+        position = self.rng.choice(positions) if positions and symbol is None else None
+        if position:
+            symbol, security_type = position["Product"]["symbol"], position["Product"]["securityType"]
+        filled = quantity if status in ("EXECUTED", "INDIVIDUAL_FILLS") else 0
+        return {"orderId": self._id(), "orderType": security_type, "clientOrderId": client_order_id,
+                "OrderDetail": [{"placedTime": int(time.time() * 1000), "status": status, "priceType": price_type,
+                                 "orderTerm": "GOOD_FOR_DAY", "limitPrice": 0, "stopPrice": 0,
+                                 "Instrument": [{"Product": {"symbol": symbol, "securityType": security_type},
+                                                 "orderAction": action, "orderedQuantity": quantity,
+                                                 "filledQuantity": filled, "averageExecutionPrice": 0}]}]}
+
+    def recorded(self, path):
+        if not self.fixture_dir:
+            return None
+        file = os.path.join(self.fixture_dir, path.lstrip("/") + ".json")
+        if os.path.exists(file):
+            with open(file) as f:
+                return json.load(f)
+        return None
+
+    def quote(self, symbol):
+        price = round(self.rng.uniform(5, 500), 2)
+        spread = round(price * 0.001, 2)
+        return {"dateTimeUTC": int(time.time()), "quoteStatus": "REALTIME",
+                "Product": {"symbol": symbol, "securityType": "EQ"},
+                "All": {"lastTrade": price, "bid": price - spread, "ask": price + spread, "bidSize": 100,
+                        "askSize": 100, "totalVolume": self.rng.randint(0, 10 ** 7), "changeClose": 0,
+                        "changeClosePercentage": 0}}
+
+    def place(self, key, body):
+        """
+        Record a placed order as OPEN
+
+        :return: (orderId, duplicate) where duplicate is True when the clientOrderId was already used
+        """
+        client_order_id = _field(body, "clientOrderId")
+        with self._lock:
+            if client_order_id and (key, client_order_id) in self.client_order_ids:
+                return self.client_order_ids[(key, client_order_id)], True
+        order = self._order([], "OPEN", symbol=_field(body, "symbol"), security_type=_field(body, "securityType") or "EQ",
+                            action=_field(body, "orderAction"), quantity=int(float(_field(body, "quantity") or 0)),
+                            price_type=_field(body, "priceType") or "MARKET", client_order_id=client_order_id)
+        with self._lock:
+            self.orders.setdefault(key, {}).setdefault("OPEN", []).insert(0, order)
+            if client_order_id:
+                self.client_order_ids[(key, client_order_id)] = order["orderId"]
+        return order["orderId"], False
+
+    def cancel(self, key, order_id):
+        with self._lock:
+            open_orders = self.orders.get(key, {}).get("OPEN", [])
+            for order in open_orders:
+                if str(order["orderId"]) == str(order_id):
+                    open_orders.remove(order)
+                    order["OrderDetail"][0]["status"] = "CANCELLED"
+                    self.orders[key].setdefault("CANCELLED", []).insert(0, order)
+                    return True
+        return False
+
+
+def _page(items, params, size):
+    count = min(int(params.get("count", size)), size)
+    start = int(params.get("marker", 0) or 0)
+    return items[start:start + count], (str(start + count) if start + count < len(items) else None)
+
+
+def _mmddyyyy(value, end=False):
+    day = datetime.strptime(value, "%m%d%Y")
+    return int(((day + timedelta(days=1)) if end else day).timestamp() * 1000)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "EtradeStub/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def _send(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply(self, status, payload, as_json):
+        if payload is None:
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif as_json:
+            self._send(status, json.dumps(payload), "application/json")
+        else:
+            (root, value), = payload.items()
+            self._send(status, to_xml(root, value), "application/xml")
+
+    def _handle(self, method):
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        path = parts.path
+        as_json = path.endswith(".json")
+        path = path[:-5] if as_json else path
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length).decode() if length else ""
+
+        if path.startswith("/oauth/"):
+            return self._oauth(path)
+        if server.require_auth and not self.headers.get("Authorization", "").startswith("OAuth"):
+            return self._reply(401, {"Error": {"code": 401, "message": "oauth_problem=signature_invalid"}}, as_json)
+        if server.error_rate and random.random() < server.error_rate:
+            status = random.choice(server.error_status)
+            with server.stats_lock:
+                server.errors += 1
+            return self._reply(status, {"Error": {"code": status, "message": "Injected error"}}, as_json)
+
+        recorded = server.fixtures.recorded(path) if method == "GET" else None
+        if recorded is not None:
+            return self._reply(200, recorded, as_json)
+        try:
+            status, payload = self._route(method, path, params, body)
+        except Exception as e:
+            status, payload = 400, {"Error": {"code": 400, "message": str(e)}}
+        self._reply(status, payload, as_json)
+
+    def _oauth(self, path):
+        if path.endswith("renew_access_token"):
+            return self._send(200, "Access Token has been renewed", "text/plain")
+        if path.endswith("revoke_access_token"):
+            return self._send(200, "Revoked Access Token", "text/plain")
+        self._send(200, "oauth_token=stub&oauth_token_secret=stub&oauth_callback_confirmed=true",
+                   "application/x-www-form-urlencoded")
+
+    def _route(self, method, path, params, body):
+        fixtures = self.server.fixtures
+        if path == "/v1/accounts/list":
+            return 200, {"AccountListResponse": {"Accounts": {"Account": fixtures.accounts}}}
+        match = re.fullmatch(r"/v1/market/quote/([^/]+)", path)
+        if match:
+            symbols = [sym for sym in match.group(1).split(",") if sym]
+            return 200, {"QuoteResponse": {"QuoteData": [fixtures.quote(sym.upper()) for sym in symbols]}}
+        match = re.fullmatch(r"/v1/accounts/([^/]+)/(.+)", path)
+        if not match:
+            return 404, {"Error": {"code": 404, "message": "Not found"}}
+        key, resource = match.groups()
+        if key not in fixtures.positions:
+            return 400, {"Error": {"code": 100, "message": "Invalid accountIdKey"}}
+
+        if method == "GET" and resource == "balance":
+            return 200, fixtures.balances[key]
+        if method == "GET" and resource == "portfolio":
+            return 200, {"PortfolioResponse": {"AccountPortfolio": [{"accountId": key,
+                                                                     "Position": fixtures.positions[key]}]}}
+        if method == "GET" and resource == "transactions":
+            transactions = fixtures.transactions[key]
+            if "startDate" in params:
+                start = _mmddyyyy(params["startDate"])
+                transactions = [tx for tx in transactions if tx["transactionDate"] >= start]
+            if "endDate" in params:
+                end = _mmddyyyy(params["endDate"], end=True)
+                transactions = [tx for tx in transactions if tx["transactionDate"] < end]
+            if not transactions:
+                return 204, None
+            page, marker = _page(transactions, params, TRANSACTION_PAGE_SIZE)
+            response = {"transactionCount": len(page), "totalCount": len(transactions),
+                        "moreTransactions": marker is not None, "Transaction": page}
+            if marker:
+                response["marker"] = marker
+            return 200, {"TransactionListResponse": response}
+        if method == "GET" and resource == "orders":
+            orders = fixtures.orders[key].get(params.get("status", "OPEN"), [])
+            if not orders:
+                return 204, None
+            page, marker = _page(orders, params, ORDER_PAGE_SIZE)
+            response = {"Order": page}
+            if marker:
+                response["marker"] = marker
+                response["next"] = self.path
+            return 200, {"OrdersResponse": response}
+
+        match = re.fullmatch(r"orders(?:/(\d+)/change)?/(preview|place|cancel)", resource)
+        if method in ("POST", "PUT") and match:
+            order_id, action = match.groups()
+            order = {"orderType": _field(body, "orderType") or "EQ", "clientOrderId": _field(body, "clientOrderId"),
+                     "Instrument": {"Product": {"symbol": _field(body, "symbol"),
+                                                "securityType": _field(body, "securityType") or "EQ"},
+                                    "orderAction": _field(body, "orderAction"),
+                                    "quantity": _field(body, "quantity")}}
+            if action == "cancel":
+                order_id = _field(body, "orderId")
+                if not fixtures.cancel(key, order_id):
+                    return 400, {"Error": {"code": 5001, "message": "This order is currently being executed "
+                                                                    "or rejected. It cannot be cancelled."}}
+                return 200, {"CancelOrderResponse": {"accountId": key, "orderId": int(order_id),
+                                                     "cancelTime": int(time.time() * 1000)}}
+            if action == "preview":
+                return 200, {"PreviewOrderResponse": {"orderType": order["orderType"], "Order": [order],
+                                                      "PreviewIds": [{"previewId": fixtures._id()}]}}
+            if order_id:
+                fixtures.cancel(key, order_id)
+            placed_id, duplicate = fixtures.place(key, body)
+            if duplicate:
+                return 400, {"Error": {"code": 1023, "message": "Duplicate clientOrderId"}}
+            return 200, {"PlaceOrderResponse": {"orderType": order["orderType"], "Order": [order],
+                                                "OrderIds": [{"orderId": placed_id}],
+                                                "placedTime": int(time.time() * 1000)}}
+        return 404, {"Error": {"code": 404, "message": "Not found"}}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, error_status=ERROR_STATUS,
+                 require_auth=True, verbose=False):
+        """
+        :param latency: seconds added to every response
+        :param jitter: extra uniformly random seconds added on top of latency
+        :param error_rate: probability a request is answered with one of error_status
+        :param require_auth: reject requests without an OAuth Authorization header; its signature is not checked
+        """
+        super().__init__(address, StubHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = tuple(error_status)
+        self.require_auth = require_auth
+        self.verbose = verbose
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def serve_in_thread(fixtures=None, port=0, **kwargs):
+    """
+    Start a StubServer on a daemon thread
+
+    :param port: 0 picks a free port
+    :return: the server; use server.base_url and server.shutdown()
+    """
+    server = StubServer(("127.0.0.1", port), fixtures if fixtures else Fixtures(), **kwargs)
+    threading.Thread(target=server.serve_forever, name="etrade-stub", daemon=True).start()
+    return server
+
+
+def dummy_session():
+    """rauth session with dummy credentials, accepted by the stub server"""
+    from rauth import OAuth1Session
+    return OAuth1Session("stub", "stub", access_token="stub", access_token_secret="stub")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the E*TRADE API")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--positions", type=int, default=20, help="positions per account")
+    parser.add_argument("--transactions", type=int, default=100, help="transactions per account")
+    parser.add_argument("--orders", type=int, default=10, help="orders per account and status")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", help="directory of recorded responses laid out like the API paths")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected error")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    fixtures = Fixtures(accounts=args.accounts, positions=args.positions, transactions=args.transactions,
+                        orders=args.orders, seed=args.seed, fixture_dir=args.fixtures)
+    server = StubServer(("127.0.0.1", args.port), fixtures, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, verbose=args.verbose)
+    print(f"E*TRADE stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import importlib.util
+import sys
+import types
+
+# etrade_config is generated by setup_etrade_config.sh and holds secrets; tests only need placeholder values
+if importlib.util.find_spec("etrade_config") is None:
+    etrade_config = types.ModuleType("etrade_config")
+    etrade_config.sender_email = "test@example.com"
+    etrade_config.email_password = ""
+    etrade_config.receiver_email = ["test@example.com"]
+    etrade_config.ACC_TYPE = {}
+    etrade_config.CONSUMER_KEY = "TEST_CONSUMER_KEY"
+    etrade_config.CONSUMER_SECRET = "TEST_CONSUMER_SECRET"
+    etrade_config.SANDBOX_BASE_URL = "https://apisb.etrade.com"
+    etrade_config.PROD_BASE_URL = "https://api.etrade.com"
+    etrade_config.RETAIN_RAW_JSON = False
+    sys.modules["etrade_config"] = etrade_config
@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_path + '/../')
+from basket.basket import BasketOrder, FAILED, PLACED, SKIPPED
+from holdings.holdings import SecurityHoldings
+from positions.positions import Position
+from rate_limiter.rate_limiter import bypass_limiters
+from stub_server.stub_server import Fixtures, _field, dummy_session, serve_in_thread
+
+SELLABLE = {"AAA": 10, "BBB": 5, "CCC": 1}
+EMPTY = "ZZZ" # holding with nothing to sell
+
+
+class RecordingSession:
+    """dummy_session that keeps the url and body of every POST"""
+
+    def __init__(self):
+        self.session = dummy_session()
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append((url, kwargs.get("data")))
+        return self.session.post(url, **kwargs)
+
+    def bodies(self, action):
+        return [body for url, body in self.posts if url.endswith(f"/orders/{action}.json")]
+
+
+class BasketOrderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        bypass_limiters(True) # the orders budget only slows the test down
+        cls.fixtures = Fixtures(accounts=1, positions=0, transactions=0, orders=0)
+        cls.server = serve_in_thread(cls.fixtures)
+        cls.account_id_key = cls.fixtures.accounts[0]["accountIdKey"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        bypass_limiters(False)
+
+    def setUp(self):
+        self.server.error_rate = 0.0
+        self.fixtures.client_order_ids.clear()
+        holdings = SecurityHoldings()
+        for sym, qty in list(SELLABLE.items()) + [(EMPTY, 0)]:
+            holdings.add_position(Position(sym, qty, 10.0, 8.0, 2.0 * qty, 10.0 * qty, 1.0))
+        self.holdings = list(holdings.holdings.values())
+
+    def execute(self, tag=None, place=True):
+        session = RecordingSession()
+        basket = BasketOrder(session, self.server.base_url, self.account_id_key, tag=tag)
+        return session, basket.execute(self.holdings, place=place).set_index("symbol")
+
+    def test_place_carries_preview_ids(self):
+        session, report = self.execute(tag="preview-ids")
+        placed = report.loc[list(SELLABLE)]
+        self.assertTrue((placed["status"] == PLACED).all(), report)
+        self.assertTrue(placed["orderId"].notna().all())
+        sent = {_field(body, "symbol"): int(_field(body, "previewId")) for body in session.bodies("place")}
+        self.assertEqual(sent, {sym: int(placed.loc[sym, "previewId"]) for sym in SELLABLE})
+
+    def test_skipped_rows_are_never_sent(self):
+        session, report = self.execute(tag="skipped")
+        self.assertEqual(report.loc[EMPTY, "status"], SKIPPED)
+        self.assertEqual(len(session.posts), 2 * len(SELLABLE))
+        self.assertNotIn(EMPTY, {_field(body, "symbol") for _, body in session.posts})
+
+    def test_repeated_client_order_id_is_rejected(self):
+        _, first = self.execute(tag="repeat")
+        session, second = self.execute(tag="repeat")
+        self.assertEqual(first["clientOrderId"].tolist(), second["clientOrderId"].tolist())
+        sent = {_field(body, "clientOrderId") for body in session.bodies("place")}
+        self.assertEqual(sent, set(first.loc[list(SELLABLE), "clientOrderId"]))
+        repeated = second.loc[list(SELLABLE)]
+        self.assertTrue((repeated["status"] == FAILED).all(), second)
+        self.assertTrue(repeated["error"].str.contains("Duplicate clientOrderId").all())
+
+        _, other = self.execute(tag="other")
+        self.assertTrue(set(other["clientOrderId"].dropna()).isdisjoint(first["clientOrderId"].dropna()))
+
+    def test_error_responses_become_failed_rows(self):
+        self.server.error_rate = 1.0
+        self.server.error_status = (500,)
+        session, report = self.execute(tag="errors")
+        failed = report.loc[list(SELLABLE)]
+        self.assertTrue((failed["status"] == FAILED).all(), report)
+        self.assertTrue(failed["error"].str.contains("Injected error").all())
+        self.assertEqual(session.bodies("place"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
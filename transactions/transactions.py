@@ -9,12 +9,20 @@ from datetime import datetime,timedelta
 BANNED_TRANSACTION_TYPE = ['Deposit', 'Sold']
 HOLDING_PERIOD = 31
 
+RETAIN_JSON = False # keep the raw API dict on every Transaction, for debugging
+
 class Transaction:
-    def __init__(self, displaySymbol, symbol, timestamp, amount, desc, txType, qty, price, securityType, json):
+    __slots__ = ("sym", "dsym", "epoch_ms", "amt", "desc", "qty", "px", "secType", "txType", "id", "json", "_timestamp")
+
+    def __init__(self, displaySymbol, symbol, timestamp, amount, desc, txType, qty, price, securityType, json=None,
+                 transactionId=None):
+        """
+        :param timestamp: transactionDate in epoch ms; the datetime and date string are derived on first use
+        :param json: raw API dict, only kept when retention is requested
+        """
         self.sym = symbol
         self.dsym = displaySymbol
-        self.timestamp = datetime.utcfromtimestamp(timestamp/1000)
-        self.date = self.timestamp.strftime('%m-%d-%Y')
+        self.epoch_ms = timestamp
         self.amt = amount
         self.desc = desc
         self.qty = qty
@@ -22,6 +30,22 @@ class Transaction:
         self.secType = securityType
         self.json = json
         self.txType = txType
+        self.id = transactionId
+        self._timestamp = None
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            self._timestamp = datetime.utcfromtimestamp(self.epoch_ms/1000)
+        return self._timestamp
+
+    @property
+    def date(self):
+        return self.timestamp.strftime('%m-%d-%Y')
+
+    def fields(self):
+        """Compact identity of the transaction, used instead of the raw dict for change detection"""
+        return self.id, self.epoch_ms, self.dsym, self.txType, self.qty, self.px, self.amt
 
     def __repr__(self) -> str:
         ret_str = f'Symbol: {self.dsym}; {self.date}; Amount: {self.amt}; Qty: {self.qty}; Px: {self.px}; Type: {self.secType}'
@@ -31,43 +55,59 @@ class Transaction:
         ret_str = f'Symbol: {self.dsym}; {self.date}; Amount: {self.amt}; Qty: {self.qty}; Px: {self.px}; Type: {self.secType}'
         return ret_str
     
-    def can_sell(self):
-        threshold = datetime.today() - timedelta(days = HOLDING_PERIOD)
-        return threshold >= self.timestamp
-    
-    def can_sell_date(self):
-        if self.can_sell():
-            return datetime.today()
+    @property
+    def release_date(self):
+        """When the lot clears HOLDING_PERIOD"""
         return self.timestamp + timedelta(days = HOLDING_PERIOD)
+
+    def can_sell(self, now=None):
+        return self.release_date <= (now if now else datetime.today())
+    
+    def can_sell_date(self, now=None):
+        now = now if now else datetime.today()
+        release = self.release_date
+        return now if release <= now else release
     
-    def can_sell_days(self):
-        if self.can_sell():
-            return 0
-        return (self.timestamp + timedelta(days = HOLDING_PERIOD)) - datetime.today()
+    def can_sell_days(self, now=None):
+        now = now if now else datetime.today()
+        release = self.release_date
+        return 0 if release <= now else release - now
+
+def parse_transaction(tx, retain=None):
+    """
+    Build a Transaction from a single TransactionListResponse entry.
+    Returns None for banned transaction types.
+
+    :param retain: keep the raw dict as Transaction.json, defaults to RETAIN_JSON
+    """
+    if tx['transactionType'] in BANNED_TRANSACTION_TYPE:
+        return None
+    return Transaction(
+        displaySymbol=tx['brokerage']['displaySymbol'],
+        symbol=tx['brokerage']['product']['symbol'],
+        timestamp=tx['transactionDate'],
+        amount=tx['amount'],
+        desc=tx['description'],
+        qty=tx['brokerage']['quantity'],
+        price=tx['brokerage']['price'],
+        securityType=tx['brokerage']['product']['securityType'],
+        txType=tx['transactionType'],
+        transactionId=tx.get('transactionId'),
+        json=tx if (RETAIN_JSON if retain is None else retain) else None)
 
 def TransactionParser(transactionListResponse):
     transactionDict = transactionListResponse['TransactionListResponse']['Transaction']
     ls = []
     for tx in transactionDict:
-        if tx['transactionType'] not in BANNED_TRANSACTION_TYPE:          
-            try:
-                ls.append(
-                    Transaction(
-                        displaySymbol=tx['brokerage']['displaySymbol'],
-                        symbol=tx['brokerage']['product']['symbol'],
-                        timestamp=tx['transactionDate'],
-                        amount=tx['amount'],
-                        desc=tx['description'],
-                        qty=tx['brokerage']['quantity'],
-                        price=tx['brokerage']['price'],
-                        securityType=tx['brokerage']['product']['securityType'],
-                        txType=tx['transactionType'],
-                        json=tx)
-                )
-            except Exception as e:
-                print("==========================")
-                print("Error:",e)
-                print("Error Adding Transaction")
-                print(tx['description'])
-                print("==========================")
-    return ls
\ No newline at end of file
+        try:
+            transaction = parse_transaction(tx)
+        except Exception as e:
+            print("==========================")
+            print("Error:",e)
+            print("Error Adding Transaction")
+            print(tx['description'])
+            print("==========================")
+        else:
+            if transaction is not None:
+                ls.append(transaction)
+    return ls